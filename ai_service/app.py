@@ -4,7 +4,14 @@ Main Flask application module for AI Service
 
 import logging
 from flask import Flask
+from werkzeug.serving import is_running_from_reloader
+from config import AI_SERVICE_SOCKET, AI_SERVICE_DEBUG, DEDUP_ENABLED
 from routes import register_routes
+from profiling import register_profiling
+from scheduler import register_scheduling
+from usage import register_usage
+from socket_transport import serve_socket
+from dedup import preload_index
 
 # Configure logging
 logging.basicConfig(
@@ -16,15 +23,34 @@ def create_app():
     """Create and configure the Flask application"""
     # Initialize Flask app
     app = Flask(__name__)
+
+    # Register opt-in request profiling hooks
+    register_profiling(app)
+
+    # Tag requests with their priority class for provider call scheduling
+    register_scheduling(app)
+
+    # Tag requests with their route and caller for token and cost accounting
+    register_usage(app)
     
     # Register routes
     register_routes(app)
+
+    # Load the duplicate index now rather than inside the first /extract request
+    if DEDUP_ENABLED:
+        preload_index()
     
     return app
 
-# Create the Flask app
-app = create_app()
+# Create the Flask app. Spawned image workers re-import the script that started
+# the service as __mp_main__; when that is app.py, they must not build the app
+if __name__ != '__mp_main__':
+    app = create_app()
 
 # If this file is run directly, start the Flask server
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5050, debug=True)
\ No newline at end of file
+    # With the debug reloader the first process only watches files and restarts the
+    # child that serves requests; otherwise this process serves the socket itself
+    if AI_SERVICE_SOCKET and (not AI_SERVICE_DEBUG or is_running_from_reloader()):
+        serve_socket(app, AI_SERVICE_SOCKET)
+    app.run(host='0.0.0.0', port=5050, debug=AI_SERVICE_DEBUG)
\ No newline at end of file
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Streaming backfill of stored recipe images.
+
+Reads a recipe export (the JSON from /api/recipes/data/export) incrementally,
+one recipe at a time, and runs the image of each recipe through the cover
+pipeline of ingest.py: downscale, detect the cover, crop. The new images are
+written as JSONL updates, one {"id", "imageData"} object per line, ready to be
+sent to PATCH /api/recipes/<id>.
+
+The export is never loaded as a whole: only the recipe being parsed and the
+recipes in flight are held in memory, so memory use does not grow with the size
+of the export. Provider calls run with bounded async concurrency; decoding and
+cropping run on a process pool.
+
+Progress is recorded in a manifest like ingest.py, so an interrupted run resumes
+where it stopped. If a recipe is re-processed after a crash, the last update
+line for its id wins.
+
+Usage:
+    python backfill.py my-recipes.json --out <dir> [--workers N] [--concurrency M] [--batch-api provider]
+    curl ... /api/recipes/data/export | python backfill.py - --out <dir>
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import multiprocessing
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from config import INGEST_MAX_SIDE, INGEST_CONCURRENCY, BATCH_API_CONCURRENCY
+from ingest import load_manifest, preprocess, crop_and_encode
+from scheduler import priority
+from batch_api import batch_mode, create_session
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Characters read from the export at a time; grows while a single recipe is larger
+CHUNK_SIZE = 1024 * 1024
+_OUTSIDE_STRING = re.compile(r'["{}\[\]]')
+_INSIDE_STRING = re.compile(r'["\\]')
+_SCALAR_END = re.compile(r'[\s,\]}]')
+_WHITESPACE = " \t\r\n"
+
+
+class JsonArrayReader:
+    """Reads the elements of one array of a JSON document from a text stream, one at a time.
+
+    Only the element being read is kept in memory. Element boundaries are found
+    with a scanner that jumps between quotes and brackets, then each element is
+    parsed with json.loads.
+    """
+
+    def __init__(self, stream, chunk_size=CHUNK_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+
+    def _more(self):
+        """Drop the consumed text and append the next chunk. Returns the shift of positions."""
+        shift = self.pos
+        pending = len(self.buffer) - self.pos
+        # Read at least as much as is pending, so a large element costs linear time
+        chunk = self.stream.read(max(self.chunk_size, pending))
+        if not chunk:
+            raise ValueError("Unexpected end of the JSON document")
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return shift
+
+    def _peek(self):
+        """Skip whitespace and return the next character without consuming it."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            self._more()
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError(f"Expected '{char}' at '{self.buffer[self.pos:self.pos + 20]}'")
+        self.pos += 1
+
+    def _value_end(self):
+        """Return the end position of the value starting at self.pos, reading more as needed."""
+        start = self._peek()
+        i = self.pos + 1
+        if start not in '{["':
+            while True:
+                match = _SCALAR_END.search(self.buffer, i)
+                if match:
+                    return match.start()
+                i -= self._more()
+
+        depth = 0 if start == '"' else 1
+        in_string = start == '"'
+        while True:
+            pattern = _INSIDE_STRING if in_string else _OUTSIDE_STRING
+            match = pattern.search(self.buffer, i)
+            if match is None or match.end() == len(self.buffer) and match.group() == "\\":
+                # Keep an escape and the character it escapes together
+                i = (match.start() if match else len(self.buffer)) - self._more()
+                continue
+            char, i = match.group(), match.end()
+            if char == "\\":
+                i += 1
+            elif char == '"':
+                in_string = not in_string
+                if not in_string and depth == 0:
+                    return i
+            elif char in "{[":
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return i
+
+    def _read_value(self):
+        end = self._value_end()
+        value = json.loads(self.buffer[self.pos:end])
+        self.pos = end
+        return value
+
+    def _skip_value(self):
+        self.pos = self._value_end()
+
+    def iter_key(self, key):
+        """Yield the elements of the array under a key of the top-level object."""
+        self._expect("{")
+        while True:
+            if self._peek() == "}":
+                raise KeyError(f"No '{key}' array in the JSON document")
+            name = self._read_value()
+            self._expect(":")
+            if name == key:
+                break
+            self._skip_value()
+            if self._peek() == ",":
+                self.pos += 1
+
+        self._expect("[")
+        while True:
+            char = self._peek()
+            if char == "]":
+                self.pos += 1
+                return
+            if char == ",":
+                self.pos += 1
+                continue
+            yield self._read_value()
+
+
+def split_data_url(image_data):
+    """Return the base64 payload of an image, with or without a data: URL prefix."""
+    if image_data.startswith("data:"):
+        return image_data.split(",", 1)[1]
+    return image_data
+
+
+def preprocess_stored(image_data, max_side):
+    """Decode and downscale a stored base64 image in a worker process. Returns base64 JPEG data."""
+    return preprocess(base64.b64decode(split_data_url(image_data)), max_side)
+
+
+class Backfill:
+    """Runs the backfill pipeline and owns its output files."""
+
+    def __init__(self, args, crop_module):
+        self.args = args
+        self.crop_module = crop_module
+        self.updates = open(os.path.join(args.out, 'updates.jsonl'), 'a')
+        self.manifest = open(os.path.join(args.out, 'manifest.jsonl'), 'a')
+        # Forked workers could inherit locks held by the provider threads
+        self.process_pool = ProcessPoolExecutor(max_workers=args.workers,
+                                                mp_context=multiprocessing.get_context("spawn"))
+        self.provider_slots = asyncio.Semaphore(args.concurrency)
+        self.counts = {"ok": 0, "error": 0, "skipped": 0}
+        self.bytes = {"before": 0, "after": 0}
+
+    async def process(self, recipe):
+        """Run the image of one recipe through the pipeline and record the result."""
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        image_data = recipe.get("imageData")
+        record = {"id": recipe["id"]}
+        if not image_data:
+            record["status"] = "skipped"
+            self._finish(record)
+            return
+        try:
+            prepared = await loop.run_in_executor(
+                self.process_pool, preprocess_stored, image_data, self.args.max_side)
+            async with self.provider_slots:
+                crop_result, tier_info = await asyncio.to_thread(self.crop_module.detect_cover, prepared)
+            cropped_bytes = await loop.run_in_executor(
+                self.process_pool, crop_and_encode, prepared, crop_result["bbox"])
+
+            update = {"id": recipe["id"],
+                      "imageData": "data:image/jpeg;base64," + base64.b64encode(cropped_bytes).decode("ascii")}
+            record.update({
+                "status": "ok",
+                "cover_type": crop_result.get("cover_type"),
+                "bbox": crop_result.get("bbox"),
+                "model_tier": tier_info,
+                "bytes_before": len(image_data),
+                "bytes_after": len(update["imageData"]),
+            })
+        except Exception as e:
+            logger.error(f"Failed to backfill recipe {recipe['id']}: {e}")
+            update = None
+            record.update({"status": "error", "error": str(e)})
+
+        record["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        self._finish(record, update)
+
+    def _finish(self, record, update=None):
+        """Append the update, then mark the recipe as done in the manifest."""
+        if update is not None:
+            self.updates.write(json.dumps(update) + "\n")
+            self.updates.flush()
+            self.bytes["before"] += record["bytes_before"]
+            self.bytes["after"] += record["bytes_after"]
+        tier = record.get("model_tier")
+        record["prompts"] = [tier["prompt"]] if tier and "prompt" in tier else []
+        self.manifest.write(json.dumps(record) + "\n")
+        self.manifest.flush()
+        os.fsync(self.manifest.fileno())
+        self.counts[record["status"]] += 1
+
+    async def run(self, recipes):
+        # Bound the number of in-flight recipes so memory stays flat for large exports
+        in_flight = asyncio.Semaphore(self.args.concurrency * 2)
+        tasks = set()
+
+        async def guarded(recipe):
+            try:
+                await self.process(recipe)
+            finally:
+                in_flight.release()
+
+        for recipe in recipes:
+            await in_flight.acquire()
+            task = asyncio.create_task(guarded(recipe))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    def close(self):
+        self.process_pool.shutdown()
+        self.updates.close()
+        self.manifest.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streaming backfill of stored recipe images")
+    parser.add_argument('export', help="Recipe export JSON file, or - to read it from stdin")
+    parser.add_argument('--out', required=True, help="Output directory for updates.jsonl and the manifest")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help="Processes for decoding and cropping (default: CPU count)")
+    parser.add_argument('--concurrency', type=int,
+                        help="Concurrent provider calls (default: INGEST_CONCURRENCY, "
+                             "or BATCH_API_CONCURRENCY with --batch-api)")
+    parser.add_argument('--max-side', type=int, default=INGEST_MAX_SIDE,
+                        help="Longest side in pixels of images sent to the provider and stored")
+    parser.add_argument('--batch-api', choices=['provider', 'local'],
+                        help="Send provider calls in provider batch jobs (local: synchronous stand-in)")
+    parser.add_argument('--retry-failed', action='store_true',
+                        help="Re-process recipes that failed in a previous run")
+    args = parser.parse_args()
+
+    # Provider modules are only needed in the parent process
+    from routes import crop_module
+    from providers import get_client
+
+    session = None
+    if args.batch_api:
+        session = create_session(args.batch_api, get_client)
+    if args.concurrency is None:
+        # Jobs are filled with the calls of the recipes in flight
+        args.concurrency = BATCH_API_CONCURRENCY if args.batch_api else INGEST_CONCURRENCY
+
+    os.makedirs(args.out, exist_ok=True)
+    done = load_manifest(os.path.join(args.out, 'manifest.jsonl'), args.retry_failed)
+    if done:
+        logger.info(f"Resuming: {len(done)} recipes already finished")
+
+    stream = sys.stdin if args.export == '-' else open(args.export, encoding='utf-8')
+    recipes = (recipe for recipe in JsonArrayReader(stream).iter_key("recipes") if recipe["id"] not in done)
+
+    backfill = Backfill(args, crop_module)
+    start = time.perf_counter()
+
+    async def run():
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=args.concurrency + 4))
+        # Provider calls of every recipe task inherit the bulk class
+        with priority("bulk"), batch_mode(session):
+            await backfill.run(recipes)
+
+    try:
+        asyncio.run(run())
+    finally:
+        backfill.close()
+        stream.close()
+        if session is not None:
+            session.close()
+            logger.info(f"Batch API: {session.get_stats()}")
+
+    elapsed = time.perf_counter() - start
+    total = sum(backfill.counts.values())
+    logger.info(
+        f"Backfilled {total} recipes in {elapsed:.1f} s ({backfill.counts['ok']} ok, "
+        f"{backfill.counts['error']} failed, {backfill.counts['skipped']} without an image); "
+        f"image data {backfill.bytes['before'] / 1e6:.1f} MB -> {backfill.bytes['after'] / 1e6:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+"""
+Provider batch API mode for AI Service
+
+Bulk work that does not need interactive latency (ingest.py, backfill.py) can
+send its provider calls through the batch APIs of the providers instead of one
+chat completion at a time. Batch calls cost less and have their own rate limits.
+
+Inside batch_mode(session), providers.chat_completion hands each call to the
+session. The session queues the call and blocks the calling thread. Concurrent
+calls are collected into one JSONL job per provider, which is submitted and
+polled until it completes. Each result is mapped back to its call by custom_id
+and returned as a regular ChatCompletion, so parsing, quality checks and
+cascade escalation work exactly as for synchronous calls. Escalated calls are
+collected into the next job.
+
+LocalBatchBackend is a stand-in for the provider batch APIs. It runs a job
+through a function, e.g. the synchronous API or a fake for tests.
+"""
+
+import contextvars
+import itertools
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from openai.types.chat import ChatCompletion
+from config import BATCH_API_MAX_REQUESTS, BATCH_API_LINGER_SECONDS, BATCH_API_POLL_SECONDS
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+ENDPOINT = "/v1/chat/completions"
+PENDING, COMPLETED, FAILED = "pending", "completed", "failed"
+
+# Batch session of the current task; None sends calls synchronously
+_session = contextvars.ContextVar("batch_session", default=None)
+
+
+def current_session():
+    """Return the batch session of the current task, or None."""
+    return _session.get()
+
+
+@contextmanager
+def batch_mode(session):
+    """Send the enclosed provider calls through a batch session (None leaves them synchronous)."""
+    token = _session.set(session)
+    try:
+        yield
+    finally:
+        _session.reset(token)
+
+
+class BatchRequestError(RuntimeError):
+    """Raised for a call whose batch request failed, or whose job failed."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _state(status):
+    status = (status or "").lower()
+    if status == "completed":
+        return COMPLETED
+    if status in ("failed", "expired", "cancelled", "cancelling"):
+        return FAILED
+    return PENDING
+
+
+class ProviderBatchBackend:
+    """Batch jobs on the files and batches API of a provider client (OpenAI or Together)."""
+
+    def __init__(self, provider, client):
+        self.provider = provider
+        self.client = client
+
+    def create(self, data):
+        """Upload a JSONL job and submit it. Returns the job id."""
+        if self.provider != "together":
+            uploaded = self.client.files.create(file=("batch.jsonl", data), purpose="batch")
+            return self.client.batches.create(input_file_id=uploaded.id, endpoint=ENDPOINT,
+                                              completion_window="24h").id
+        # The Together SDK uploads from a path
+        with tempfile.NamedTemporaryFile(suffix=".jsonl", delete=False) as f:
+            f.write(data)
+        try:
+            uploaded = self.client.files.upload(file=f.name, purpose="batch-api", check=False)
+        finally:
+            os.unlink(f.name)
+        return self.client.batches.create(input_file_id=uploaded.id, endpoint=ENDPOINT).job.id
+
+    def status(self, job_id):
+        """Return (state, output file id, error file id, error message) of a job."""
+        job = self.client.batches.retrieve(job_id)
+        error = getattr(job, "error", None) or getattr(job, "errors", None)
+        return _state(job.status), job.output_file_id, job.error_file_id, str(error) if error else None
+
+    def download(self, file_id):
+        return self.client.files.content(file_id).read()
+
+
+class LocalBatchBackend:
+    """In-process stand-in for a provider batch API.
+
+    respond(body) returns the chat completion for a request body as a dict, or
+    raises to fail that request. A job runs on its first status poll and
+    completes on the next one, so callers go through the same polling as with a
+    provider.
+    """
+
+    def __init__(self, respond, workers=4):
+        self.respond = respond
+        self.workers = workers
+        self.jobs = {}
+        self.files = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def create(self, data):
+        with self.lock:
+            job_id = f"local-batch-{next(self.ids)}"
+            self.jobs[job_id] = {"input": data, "output_file_id": None}
+        return job_id
+
+    def status(self, job_id):
+        with self.lock:
+            job = self.jobs[job_id]
+        if job["output_file_id"] is None:
+            requests = [json.loads(line) for line in job["input"].splitlines()]
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                output = list(executor.map(self._run_request, requests))
+            with self.lock:
+                file_id = f"{job_id}-output"
+                self.files[file_id] = "".join(json.dumps(line) + "\n" for line in output).encode("utf-8")
+                job["output_file_id"] = file_id
+            return PENDING, None, None, None
+        return COMPLETED, job["output_file_id"], None, None
+
+    def _run_request(self, request):
+        try:
+            response = {"status_code": 200, "body": self.respond(request["body"])}
+        except Exception as e:
+            response = {"status_code": getattr(e, "status_code", None) or 500,
+                        "body": {"error": {"message": str(e)}}}
+        return {"custom_id": request["custom_id"], "response": response, "error": None}
+
+    def download(self, file_id):
+        with self.lock:
+            return self.files[file_id]
+
+
+def sync_responder(client):
+    """Return a LocalBatchBackend respond function that runs requests on the synchronous API."""
+    return lambda body: client.chat.completions.create(**body).model_dump()
+
+
+class BatchSession:
+    """Collects provider calls into batch jobs and hands each caller its result."""
+
+    def __init__(self, backend_for, max_requests=BATCH_API_MAX_REQUESTS, linger=BATCH_API_LINGER_SECONDS,
+                 poll_interval=BATCH_API_POLL_SECONDS):
+        self.backend_for = backend_for
+        self.backends = {}
+        self.max_requests = max_requests
+        self.linger = linger
+        self.poll_interval = poll_interval
+        self.condition = threading.Condition()
+        self.queued = {}
+        self.last_queued = {}
+        self.ids = itertools.count(1)
+        self.stats = {"jobs": 0, "requests": 0, "failed_requests": 0, "failed_jobs": 0}
+        self.closed = False
+        threading.Thread(target=self._flush_loop, name="batch-api-flush", daemon=True).start()
+
+    def submit(self, provider, model, kwargs):
+        """Queue one chat completion and block until its batch job has completed. Returns the ChatCompletion."""
+        future = Future()
+        body = dict(kwargs, model=model)
+        with self.condition:
+            custom_id = f"request-{next(self.ids)}"
+            self.queued.setdefault(provider, []).append((custom_id, body, future))
+            self.last_queued[provider] = time.monotonic()
+            if len(self.queued[provider]) >= self.max_requests:
+                self._start_job(provider)
+            self.condition.notify()
+        return future.result()
+
+    def _flush_loop(self):
+        with self.condition:
+            while not self.closed:
+                now = time.monotonic()
+                for provider in [p for p, requests in self.queued.items() if requests]:
+                    if now - self.last_queued[provider] >= self.linger:
+                        self._start_job(provider)
+                self.condition.wait(min(self.linger, 1.0))
+
+    def _start_job(self, provider):
+        """Take the queued requests of a provider into a job. Called with the condition held."""
+        requests, self.queued[provider] = self.queued[provider], []
+        if provider not in self.backends:
+            self.backends[provider] = self.backend_for(provider)
+        threading.Thread(target=self._run_job, args=(provider, self.backends[provider], requests),
+                         name="batch-api-job", daemon=True).start()
+
+    def _run_job(self, provider, backend, requests):
+        data = "".join(json.dumps({"custom_id": custom_id, "method": "POST", "url": ENDPOINT, "body": body}) + "\n"
+                       for custom_id, body, _ in requests).encode("utf-8")
+        try:
+            job_id = backend.create(data)
+            logger.info(f"Submitted {provider} batch job {job_id} with {len(requests)} requests")
+            while True:
+                state, output_file_id, error_file_id, error = backend.status(job_id)
+                if state == FAILED:
+                    raise BatchRequestError(f"Batch job {job_id} failed: {error}")
+                if state == COMPLETED:
+                    break
+                time.sleep(self.poll_interval)
+            results = {}
+            for file_id in (output_file_id, error_file_id):
+                if file_id:
+                    for line in backend.download(file_id).decode("utf-8").splitlines():
+                        if line.strip():
+                            result = json.loads(line)
+                            results[result["custom_id"]] = result
+        except Exception as e:
+            logger.error(f"{provider} batch job with {len(requests)} requests failed: {e}")
+            with self.condition:
+                self.stats["jobs"] += 1
+                self.stats["failed_jobs"] += 1
+                self.stats["requests"] += len(requests)
+                self.stats["failed_requests"] += len(requests)
+            for _, _, future in requests:
+                future.set_exception(e)
+            return
+
+        outcomes = []
+        for custom_id, _, future in requests:
+            try:
+                outcomes.append((future, _completion(results.get(custom_id), custom_id), None))
+            except BatchRequestError as e:
+                outcomes.append((future, None, e))
+        failed = sum(error is not None for _, _, error in outcomes)
+        logger.info(f"{provider} batch job {job_id} completed: {len(requests) - failed} answered, {failed} failed")
+        # Count the job before waking its callers, so their stats include it
+        with self.condition:
+            self.stats["jobs"] += 1
+            self.stats["requests"] += len(requests)
+            self.stats["failed_requests"] += failed
+        for future, completion, error in outcomes:
+            if error is None:
+                future.set_result(completion)
+            else:
+                future.set_exception(error)
+
+    def close(self):
+        """Stop the flush thread; calls still queued are not submitted."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+    def get_stats(self):
+        with self.condition:
+            return dict(self.stats, queued=sum(len(requests) for requests in self.queued.values()))
+
+
+def _completion(result, custom_id):
+    """Return the ChatCompletion of a batch result line, or raise BatchRequestError."""
+    if result is None:
+        raise BatchRequestError(f"No result for batch request {custom_id}")
+    response = result.get("response") or {}
+    status_code = response.get("status_code")
+    if result.get("error") or status_code != 200:
+        error = result.get("error") or (response.get("body") or {}).get("error")
+        raise BatchRequestError(f"Batch request {custom_id} failed ({status_code}): {error}", status_code)
+    return ChatCompletion.construct(**response["body"])
+
+
+def create_session(mode, get_client):
+    """Return a batch session for a --batch-api mode: "provider" or "local" (synchronous stand-in)."""
+    if mode == "provider":
+        return BatchSession(lambda provider: ProviderBatchBackend(provider, get_client(provider)))
+    if mode == "local":
+        return BatchSession(lambda provider: LocalBatchBackend(sync_responder(get_client(provider))),
+                            poll_interval=0.1)
+    raise ValueError(f"Unknown batch API mode: {mode}")
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Benchmark the fused /analyze route against the three-call /verify + /extract + /crop path.
+
+Runs both paths in-process against the configured providers (real API calls) for
+every image in a directory and reports latency and token cost side by side.
+
+Usage:
+    python benchmarks/fused_vs_separate.py [image_dir] [--repeat N] [--json results.json]
+"""
+
+import argparse
+import base64
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import config
+from app import app
+from usage import estimate_cost
+
+DEFAULT_IMAGE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    'test_images')
+
+# Provider calls made while the current path runs
+_calls = []
+
+
+def _record_calls(client):
+    """Wrap a provider client so every chat completion records its model, latency and usage."""
+    if client is None:
+        return
+    completions = client.chat.completions
+    original_create = completions.create
+
+    def create(*args, **kwargs):
+        start = time.perf_counter()
+        response = original_create(*args, **kwargs)
+        usage = getattr(response, 'usage', None)
+        _calls.append({
+            "model": kwargs.get('model'),
+            "latency": time.perf_counter() - start,
+            "prompt_tokens": getattr(usage, 'prompt_tokens', 0) or 0,
+            "completion_tokens": getattr(usage, 'completion_tokens', 0) or 0,
+        })
+        return response
+
+    completions.create = create
+
+
+def _run_path(client, routes, image_data):
+    """POST the image to each route in turn and summarize the provider calls."""
+    _calls.clear()
+    start = time.perf_counter()
+    ok = True
+    for route in routes:
+        response = client.post(route, json={"image": image_data})
+        ok = ok and response.status_code == 200
+    elapsed = time.perf_counter() - start
+    return {
+        "ok": ok,
+        "latency": elapsed,
+        "calls": len(_calls),
+        "prompt_tokens": sum(c["prompt_tokens"] for c in _calls),
+        "completion_tokens": sum(c["completion_tokens"] for c in _calls),
+        "cost": sum(estimate_cost(c["model"], c["prompt_tokens"], c["completion_tokens"]) for c in _calls),
+    }
+
+
+def _summarize(runs):
+    latencies = sorted(run["latency"] for run in runs)
+    return {
+        "runs": len(runs),
+        "failures": sum(1 for run in runs if not run["ok"]),
+        "latency_p50": statistics.median(latencies),
+        "latency_max": latencies[-1],
+        "calls_per_image": statistics.mean(run["calls"] for run in runs),
+        "prompt_tokens_per_image": statistics.mean(run["prompt_tokens"] for run in runs),
+        "completion_tokens_per_image": statistics.mean(run["completion_tokens"] for run in runs),
+        "cost_per_image": statistics.mean(run["cost"] for run in runs),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('image_dir', nargs='?', default=DEFAULT_IMAGE_DIR)
+    parser.add_argument('--repeat', type=int, default=1, help="Runs per image and path")
+    parser.add_argument('--json', help="Write the summary to this JSON file")
+    args = parser.parse_args()
+
+    image_files = sorted(
+        f for f in os.listdir(args.image_dir)
+        if f.lower().endswith(('.png', '.jpg', '.jpeg')))
+    if not image_files:
+        raise RuntimeError(f"No images found in '{args.image_dir}'")
+
+    _record_calls(config.openai_client)
+    _record_calls(config.together_client)
+    client = app.test_client()
+
+    paths = {
+        "separate": ['/verify', '/extract', '/crop'],
+        "fused": ['/analyze'],
+    }
+    runs = {name: [] for name in paths}
+    for image_file in image_files:
+        with open(os.path.join(args.image_dir, image_file), 'rb') as f:
+            image_data = base64.b64encode(f.read()).decode('utf-8')
+        for _ in range(args.repeat):
+            for name, routes in paths.items():
+                run = _run_path(client, routes, image_data)
+                runs[name].append(run)
+                print(f"{image_file} [{name}]: {run['latency'] * 1000:.0f} ms, "
+                      f"{run['prompt_tokens']}+{run['completion_tokens']} tokens, "
+                      f"${run['cost']:.5f}")
+
+    summary = {name: _summarize(path_runs) for name, path_runs in runs.items()}
+
+    print(f"\n{'':28}{'separate':>14}{'fused':>14}")
+    for key in summary["fused"]:
+        print(f"{key:28}{summary['separate'][key]:>14.4f}{summary['fused'][key]:>14.4f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f"\nSummary written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
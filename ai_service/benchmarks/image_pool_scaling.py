@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Benchmark cropping throughput of the image worker pool against in-process cropping.
+
+Simulates a threaded server: many threads crop images concurrently, either on the
+request threads (GIL-bound) or through the shared-memory worker pool with 1, 2,
+4, ... processes up to the available cores. No provider calls are made.
+
+Usage:
+    python benchmarks/image_pool_scaling.py [image_dir] [--requests N] [--threads T]
+"""
+
+import argparse
+import base64
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import image_pool
+from utils import crop_image_regions
+
+DEFAULT_IMAGE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    'test_images')
+
+BBOX = {"ymin": 100, "xmin": 150, "ymax": 700, "xmax": 900}
+
+
+def load_images(image_dir):
+    images = []
+    for name in sorted(os.listdir(image_dir)):
+        if name.lower().endswith(('.jpg', '.jpeg', '.png')):
+            with open(os.path.join(image_dir, name), 'rb') as f:
+                images.append(base64.b64encode(f.read()).decode('utf-8'))
+    return images
+
+
+def run(crop, images, requests, threads):
+    """Crop `requests` images on `threads` threads. Returns crops per second."""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(lambda i: crop(images[i % len(images)], [BBOX]), range(requests)))
+    elapsed = time.perf_counter() - start
+    if any(not result or result[0] is None for result in results):
+        raise RuntimeError("Some crops failed")
+    return requests / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the image worker pool")
+    parser.add_argument('image_dir', nargs='?', default=DEFAULT_IMAGE_DIR)
+    parser.add_argument('--requests', type=int, default=48, help="Crops per measurement")
+    parser.add_argument('--threads', type=int, default=16, help="Concurrent request threads")
+    args = parser.parse_args()
+
+    images = load_images(args.image_dir)
+    if not images:
+        sys.exit(f"No images found in {args.image_dir}")
+    cores = image_pool.available_cores()
+    print(f"{len(images)} images, {args.requests} crops per run, {args.threads} threads, {cores} cores")
+
+    baseline = run(crop_image_regions, images, args.requests, args.threads)
+    print(f"{'in-process':>12}: {baseline:7.1f} crops/s")
+
+    workers = 1
+    while True:
+        image_pool._pool = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        try:
+            # Warm up so process start-up is not measured
+            run(image_pool.crop_base64_regions, images, workers, workers)
+            throughput = run(image_pool.crop_base64_regions, images, args.requests, args.threads)
+        finally:
+            image_pool._pool.shutdown()
+            image_pool._pool = None
+        print(f"{workers:>4} workers: {throughput:7.1f} crops/s ({throughput / baseline:.2f}x)")
+        if workers >= cores:
+            break
+        workers = min(workers * 2, cores)
+
+
+if __name__ == '__main__':
+    main()
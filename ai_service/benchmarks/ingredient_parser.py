@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark for the local ingredient parser (ingredients.py).
+
+Parses a corpus of ingredient lines, the ingredients of test_images/golden.json
+plus a fixed mix of US and metric lines, repeated to the requested size. Reports
+lines per second for parsing alone and for parse + scale + format as /scale
+runs it. With --min-rate the run fails (exit code 1) when either rate is below
+the given lines per second.
+
+Usage:
+    python benchmarks/ingredient_parser.py [--lines 100000] [--repeat 5] [--min-rate 20000] [--json results.json]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ingredients import parse_ingredient, scale_ingredient
+
+DEFAULT_GOLDEN = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    'test_images', 'golden.json')
+
+MIXED_LINES = [
+    "1 1/2 cups all-purpose flour",
+    "2-3 cloves garlic, minced",
+    "1 (14 oz) can diced tomatoes",
+    "2 to 3 tbsp. olive oil",
+    "½ tsp ground cumin",
+    "1½ lbs boneless chicken thighs",
+    "3 x 400g tins chopped tomatoes",
+    "750 ml vegetable stock",
+    "a pinch of salt",
+    "2 large eggs, beaten",
+    "1 T sugar",
+    "salt and pepper to taste",
+]
+
+
+def load_lines(golden_path):
+    """Return the ingredient lines of the golden set and the fixed mix."""
+    lines = list(MIXED_LINES)
+    if os.path.exists(golden_path):
+        with open(golden_path) as f:
+            golden = json.load(f)
+        for entry in golden.get("images", {}).values():
+            lines.extend((entry.get("recipe") or {}).get("ingredients") or [])
+    return lines
+
+
+def best_rate(run, lines, repeat):
+    """Return the best lines per second of several runs over the corpus."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(lines)
+        best = min(best, time.perf_counter() - start)
+    return len(lines) / best
+
+
+def parse_only(lines):
+    for line in lines:
+        parse_ingredient(line)
+
+
+def parse_scale_format(lines):
+    for line in lines:
+        scale_ingredient(parse_ingredient(line), 1.5, "metric")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the local ingredient parser")
+    parser.add_argument('--golden', default=DEFAULT_GOLDEN, help="Golden set with ingredient lines")
+    parser.add_argument('--lines', type=int, default=100000, help="Lines in the corpus")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per case; the best is reported")
+    parser.add_argument('--min-rate', type=float, help="Fail when a rate is below this many lines per second")
+    parser.add_argument('--json', help="Write the results to a JSON file")
+    args = parser.parse_args()
+
+    unique = load_lines(args.golden)
+    lines = (unique * (args.lines // len(unique) + 1))[:args.lines]
+    results = {
+        "lines": len(lines),
+        "unique_lines": len(unique),
+        "parse_lines_per_s": round(best_rate(parse_only, lines, args.repeat)),
+        "scale_lines_per_s": round(best_rate(parse_scale_format, lines, args.repeat)),
+    }
+
+    print(f"{results['lines']} lines ({results['unique_lines']} unique)")
+    print(f"  parse:                {results['parse_lines_per_s']:>10,} lines/s")
+    print(f"  parse + scale/format: {results['scale_lines_per_s']:>10,} lines/s")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.min_rate and min(results["parse_lines_per_s"], results["scale_lines_per_s"]) < args.min_rate:
+        print(f"Below the minimum rate of {args.min_rate:,.0f} lines/s")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the two transports between the Node server and the AI service.
+
+Sends the images in test_images/ to an echo route of the Flask app over loopback
+HTTP (base64 JSON body on a keep-alive connection, as the Node server does) and
+over the Unix domain socket transport (raw image bytes in a frame, one connection
+per request, as server/aiServiceSocket.ts does). The echo route decodes the
+image field like a real route but makes no provider calls, so only transport,
+encoding and request parsing are measured. Client-side encoding is included.
+
+Usage:
+    python benchmarks/service_transports.py [--repeat 50] [--json results.json]
+"""
+
+import argparse
+import base64
+import http.client
+import json
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from flask import jsonify, request
+from werkzeug.serving import make_server
+from app import create_app
+from socket_transport import start_socket_server, read_frame, write_frame
+
+DEFAULT_IMAGE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    'test_images')
+ECHO_ROUTE = '/benchmark/echo'
+
+
+def build_app():
+    """Return the service app with an echo route that decodes the image field and returns its size."""
+    app = create_app()
+
+    @app.route(ECHO_ROUTE, methods=['POST'])
+    def echo():
+        image = base64.b64decode(request.get_json()['image'])
+        return jsonify({"success": True, "bytes": len(image)})
+
+    return app
+
+
+def post_http(connection, raw):
+    """Send one image as a base64 JSON body over HTTP; return the response and request size."""
+    body = json.dumps({"image": base64.b64encode(raw).decode('ascii')}).encode('utf-8')
+    connection.request('POST', ECHO_ROUTE, body=body, headers={'Content-Type': 'application/json'})
+    response = json.loads(connection.getresponse().read())
+    return response, len(body)
+
+
+def post_socket(path, raw):
+    """Send one image as a frame on a new socket connection; return the response and frame size."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(path)
+        with connection.makefile('rwb') as stream:
+            size = write_frame(stream, {"method": "POST", "path": ECHO_ROUTE, "headers": {}, "fields": {}}, raw)
+            header, body, _ = read_frame(stream)
+    return json.loads(body), size
+
+
+def measure(send, repeat):
+    """Return median, p95 and min time (ms) over repeat calls, and the request size in bytes."""
+    response, size = send()  # warm up
+    if not response.get("success"):
+        raise RuntimeError(f"Echo request failed: {response}")
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        send()
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return {
+        "median_ms": round(statistics.median(times), 3),
+        "p95_ms": round(times[int(0.95 * (len(times) - 1))], 3),
+        "min_ms": round(times[0], 3),
+        "request_bytes": size,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('image_dir', nargs='?', default=DEFAULT_IMAGE_DIR)
+    parser.add_argument('--repeat', type=int, default=50, help="Timed requests per image and transport")
+    parser.add_argument('--json', help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    names = sorted(f for f in os.listdir(args.image_dir) if f.lower().endswith(('.jpg', '.jpeg', '.png', '.webp')))
+    if not names:
+        raise RuntimeError(f"No images found in '{args.image_dir}'")
+
+    app = build_app()
+    http_server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    socket_dir = tempfile.mkdtemp()
+    socket_path = os.path.join(socket_dir, 'ai_service.sock')
+    socket_server = start_socket_server(app, socket_path)
+    connection = http.client.HTTPConnection('127.0.0.1', http_server.server_port)
+
+    results = {}
+    try:
+        for name in names:
+            with open(os.path.join(args.image_dir, name), 'rb') as f:
+                raw = f.read()
+            results[name] = {
+                "http": measure(lambda: post_http(connection, raw), args.repeat),
+                "socket": measure(lambda: post_socket(socket_path, raw), args.repeat),
+            }
+            print(f"{name} ({len(raw) / 1024:.0f} KB)")
+            for transport, result in results[name].items():
+                print(f"  {transport:8}{result['median_ms']:>10.3f} ms{result['p95_ms']:>10.3f} ms p95"
+                      f"{result['request_bytes'] / 1024:>12.0f} KB sent")
+            speedup = results[name]["http"]["median_ms"] / results[name]["socket"]["median_ms"]
+            print(f"  socket is {speedup:.2f}x faster (median)")
+    finally:
+        connection.close()
+        http_server.shutdown()
+        socket_server.shutdown()
+        socket_server.server_close()
+        os.unlink(socket_path)
+        os.rmdir(socket_dir)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
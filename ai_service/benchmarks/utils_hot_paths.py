@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the image helpers in utils.py that run on every request.
+
+Times is_valid_base64_image, base64_to_pil_image, the pixel decode it defers,
+crop_image, pil_image_to_base64 and the full decode -> crop -> encode chain on
+the images in test_images/, at several sizes and source formats. Peak Python
+heap allocations of each call are measured separately with tracemalloc (pixel
+buffers allocated inside Pillow are not included).
+
+Results are compared with a stored baseline: the run fails (exit code 1) when
+the best time or the peak allocations of a case grow by more than the threshold.
+The best of several calls is compared rather than the median, since it is far
+less sensitive to other load on the machine. Baselines are machine specific; save one on the machine that runs
+the comparison.
+
+Usage:
+    python benchmarks/utils_hot_paths.py --save-baseline
+    python benchmarks/utils_hot_paths.py [--threshold 0.2] [--json results.json]
+"""
+
+import argparse
+import base64
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import PIL
+from PIL import Image
+from utils import is_valid_base64_image, base64_to_pil_image, crop_image, pil_image_to_base64
+
+DEFAULT_IMAGE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    'test_images')
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'utils_hot_paths.json')
+
+BBOX = {"ymin": 100, "xmin": 150, "ymax": 700, "xmax": 900}
+# Longest side of the resized variants; None keeps the original size
+SIZES = [None, 2048, 1024]
+FORMATS = ["JPEG", "PNG", "WEBP"]
+# Time differences below this are noise, whatever the relative change
+MIN_REGRESSION_MS = 0.05
+MIN_REGRESSION_KB = 4
+
+
+def load_cases(image_dir, sizes, formats, all_images):
+    """Return {case name: base64 image}: every image as stored, plus resized and re-encoded variants.
+
+    Variants are made from the first image only (all images with all_images).
+    """
+    names = sorted(f for f in os.listdir(image_dir) if f.lower().endswith(('.jpg', '.jpeg', '.png', '.webp')))
+    if not names:
+        raise RuntimeError(f"No images found in '{image_dir}'")
+    cases = {}
+    for index, name in enumerate(names):
+        with open(os.path.join(image_dir, name), 'rb') as f:
+            raw = f.read()
+        cases[name] = base64.b64encode(raw).decode('utf-8')
+        if index > 0 and not all_images:
+            continue
+        source = Image.open(io.BytesIO(raw)).convert("RGB")
+        for side in sizes:
+            image = source
+            if side and max(source.size) > side:
+                image = source.copy()
+                image.thumbnail((side, side), Image.LANCZOS)
+            for format in formats:
+                if side is None and format == "JPEG":
+                    continue
+                buffer = io.BytesIO()
+                image.save(buffer, format=format)
+                label = f"{image.width}x{image.height}"
+                cases[f"{name}@{label}/{format}"] = base64.b64encode(buffer.getvalue()).decode('utf-8')
+    return cases
+
+
+def case_functions(image_data):
+    """Return {function name: callable} for one image; setup work is done here, not timed."""
+    loaded = base64_to_pil_image(image_data)
+    loaded.load()
+    cropped = crop_image(loaded, BBOX)
+
+    def decode():
+        base64_to_pil_image(image_data).load()
+
+    return {
+        "is_valid_base64_image": lambda: is_valid_base64_image(image_data),
+        # Only parses the header; the pixels are decoded on first use
+        "base64_to_pil_image": lambda: base64_to_pil_image(image_data),
+        "decode": decode,
+        "crop_image": lambda: crop_image(loaded, BBOX),
+        "pil_image_to_base64": lambda: pil_image_to_base64(cropped),
+        "chain": lambda: pil_image_to_base64(crop_image(base64_to_pil_image(image_data), BBOX)),
+    }
+
+
+def measure(function, repeat):
+    """Return median and min time (ms) over repeat calls and the peak Python allocations (KB)."""
+    function()  # warm up
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    # Traced separately: tracemalloc slows every allocation down
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "median_ms": round(statistics.median(times), 3),
+        "min_ms": round(min(times), 3),
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Return the regressions of results against a baseline as readable lines."""
+    regressions = []
+    for case, functions in results.items():
+        for name, current in functions.items():
+            previous = baseline.get(case, {}).get(name)
+            if not previous:
+                continue
+            for metric, floor in (("min_ms", MIN_REGRESSION_MS), ("peak_kb", MIN_REGRESSION_KB)):
+                before, after = previous[metric], current[metric]
+                if after > before * (1 + threshold) and after - before > floor:
+                    regressions.append(f"{case} {name} {metric}: {before} -> {after} "
+                                       f"(+{(after / before - 1) * 100 if before else float('inf'):.0f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('image_dir', nargs='?', default=DEFAULT_IMAGE_DIR)
+    parser.add_argument('--repeat', type=int, default=7, help="Timed calls per function and case")
+    parser.add_argument('--sizes', nargs='+', type=int, help="Longest sides of resized variants")
+    parser.add_argument('--formats', nargs='+', default=FORMATS, help="Source formats of the variants")
+    parser.add_argument('--all-images', action='store_true', help="Make variants of every image, not just the first")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="Baseline JSON file")
+    parser.add_argument('--save-baseline', action='store_true', help="Store this run as the baseline")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="Relative slowdown or allocation growth that fails the run")
+    parser.add_argument('--json', help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    sizes = [None] + args.sizes if args.sizes else SIZES
+    cases = load_cases(args.image_dir, sizes, args.formats, args.all_images)
+    results = {}
+    for case, image_data in cases.items():
+        results[case] = {name: measure(function, args.repeat)
+                         for name, function in case_functions(image_data).items()}
+        print(case)
+        for name, result in results[case].items():
+            print(f"  {name:24}{result['median_ms']:>10.3f} ms{result['min_ms']:>10.3f} ms min"
+                  f"{result['peak_kb']:>12.1f} KB peak")
+
+    run = {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "machine": f"{platform.machine()} {platform.processor() or platform.system()}",
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(run, f, indent=2)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(run, f, indent=2)
+        print(f"\nBaseline written to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline to create one")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if (baseline.get("python"), baseline.get("pillow")) != (run["python"], run["pillow"]):
+        print(f"\nNote: baseline was made with Python {baseline.get('python')} / Pillow {baseline.get('pillow')}")
+    regressions = compare(results, baseline["results"], args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} regressions beyond {args.threshold:.0%} against {args.baseline}:")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    print(f"\nNo regressions beyond {args.threshold:.0%} against {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""
+Circuit breakers for provider calls in AI Service
+
+Every provider/model pair has a breaker. After BREAKER_FAILURE_THRESHOLD
+consecutive failed calls (errors, or answers slower than
+BREAKER_SLOW_CALL_SECONDS) it opens: calls fail fast with CircuitOpenError
+instead of waiting on a degraded provider, so the cascade moves on to the next
+tier and routes fall back right away. After BREAKER_OPEN_SECONDS one probe call
+is let through (half-open); its outcome closes the breaker or opens it again.
+
+Routes can also remember their last result per input with serve_stale(), and
+get it back while every provider they would call is open.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+from config import (BREAKER_ENABLED, BREAKER_FAILURE_THRESHOLD, BREAKER_SLOW_CALL_SECONDS,
+                    BREAKER_OPEN_SECONDS, BREAKER_CACHE_SIZE)
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling a provider/model whose breaker is open."""
+
+
+def _is_caller_error(error):
+    """Return True for errors caused by the request itself (bad input), not the provider."""
+    status = getattr(error, "status_code", None) or getattr(error, "http_status", None)
+    return isinstance(status, int) and 400 <= status < 500 and status not in (408, 429)
+
+
+class CircuitBreaker:
+    """Breaker state of one provider/model pair."""
+
+    def __init__(self, name):
+        self.name = name
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+        self.stats = {"calls": 0, "failures": 0, "slow_calls": 0, "rejected": 0, "opened": 0}
+        self.last_error = None
+
+    def before_call(self):
+        """Let a call through or raise CircuitOpenError. Returns True if the call is a probe."""
+        with self.lock:
+            if self.state == CLOSED:
+                return False
+            if self.state == OPEN and time.time() - self.opened_at >= BREAKER_OPEN_SECONDS:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self.probing:
+                self.probing = True
+                logger.info(f"Circuit {self.name} half-open, probing")
+                return True
+            self.stats["rejected"] += 1
+        raise CircuitOpenError(f"Circuit open for {self.name}: {self.last_error}")
+
+    def after_call(self, latency, error=None, probe=False):
+        """Record the outcome of a call let through by before_call."""
+        with self.lock:
+            if probe:
+                self.probing = False
+            self.stats["calls"] += 1
+            slow = error is None and latency > BREAKER_SLOW_CALL_SECONDS
+            if error is None and not slow:
+                if self.state != CLOSED:
+                    logger.info(f"Circuit {self.name} closed")
+                self.state = CLOSED
+                self.consecutive_failures = 0
+                return
+
+            if slow:
+                self.stats["slow_calls"] += 1
+                self.last_error = f"slow call ({latency:.1f} s)"
+            else:
+                self.stats["failures"] += 1
+                self.last_error = f"{type(error).__name__}: {error}"[:200]
+            self.consecutive_failures += 1
+            if probe or (self.state == CLOSED and self.consecutive_failures >= BREAKER_FAILURE_THRESHOLD):
+                self.state = OPEN
+                self.opened_at = time.time()
+                self.stats["opened"] += 1
+                logger.warning(f"Circuit {self.name} opened after {self.consecutive_failures} "
+                               f"failed calls: {self.last_error}")
+
+    def release_probe(self):
+        """Let another probe through after a probe call that never reached the provider."""
+        with self.lock:
+            self.probing = False
+
+    def status(self):
+        with self.lock:
+            status = dict(self.stats, state=self.state, consecutive_failures=self.consecutive_failures,
+                          last_error=self.last_error)
+            if self.state != CLOSED:
+                status["retry_in_s"] = round(max(0.0, self.opened_at + BREAKER_OPEN_SECONDS - time.time()), 1)
+            return status
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(provider, model):
+    """Return the breaker of a provider/model pair, creating it on first use."""
+    name = f"{provider}/{model}"
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def guarded_call(provider, model, call, slot=nullcontext):
+    """Run call() in slot() through the breaker of a provider/model pair and return its result.
+
+    Raises CircuitOpenError before entering the slot when the breaker is open, so
+    rejected calls never queue. Only the call itself is timed and recorded: errors
+    raised by slot() are re-raised without touching the breaker. Errors caused by
+    the request itself (4xx other than timeouts and rate limits) do not count as
+    provider failures.
+    """
+    if not BREAKER_ENABLED:
+        with slot():
+            return call()
+    breaker = get_breaker(provider, model)
+    probe = breaker.before_call()
+    try:
+        with slot():
+            start = time.perf_counter()
+            try:
+                result = call()
+            except Exception as e:
+                breaker.after_call(time.perf_counter() - start, None if _is_caller_error(e) else e, probe)
+                probe = False
+                raise
+            breaker.after_call(time.perf_counter() - start, probe=probe)
+            probe = False
+            return result
+    finally:
+        # The slot failed (queue timeout or rejection) before the provider was called
+        if probe:
+            breaker.release_probe()
+
+
+# Last result per route, prompt and input, served while the providers are unavailable
+_results = OrderedDict()
+_results_lock = threading.Lock()
+_stale_served = 0
+
+
+def serve_stale(name, image_data, compute):
+    """Return compute() and remember it, or the remembered result if every circuit is open.
+
+    compute() returns (result, tier_info). name identifies the route and prompt
+    version, so results of another prompt are never served. A stale result has
+    tier_info["stale"] set and its age in tier_info["stale_age_s"]. Raises
+    CircuitOpenError if nothing was remembered for this input.
+    """
+    global _stale_served
+    key = f"{name}|{hashlib.sha256(image_data.encode('utf-8')).hexdigest()}"
+    try:
+        result, tier_info = compute()
+    except CircuitOpenError:
+        with _results_lock:
+            cached = _results.get(key)
+            if cached is None:
+                raise
+            _stale_served += 1
+        result, tier_info, stored_at = cached
+        logger.info(f"Provider circuits open, serving the {name} result from "
+                    f"{time.time() - stored_at:.0f} s ago")
+        return result, dict(tier_info, stale=True, stale_age_s=round(time.time() - stored_at, 1))
+
+    with _results_lock:
+        _results[key] = (result, tier_info, time.time())
+        _results.move_to_end(key)
+        while len(_results) > BREAKER_CACHE_SIZE:
+            _results.popitem(last=False)
+    return result, tier_info
+
+
+def get_status():
+    """Return the state of every breaker and of the stale result cache."""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    with _results_lock:
+        cache = {"results": len(_results), "capacity": BREAKER_CACHE_SIZE, "stale_served": _stale_served}
+    return {
+        "enabled": BREAKER_ENABLED,
+        "breakers": {breaker.name: breaker.status() for breaker in breakers},
+        "stale_cache": cache,
+        "settings": {
+            "failure_threshold": BREAKER_FAILURE_THRESHOLD,
+            "slow_call_s": BREAKER_SLOW_CALL_SECONDS,
+            "open_s": BREAKER_OPEN_SECONDS,
+        },
+    }
@@ -0,0 +1,128 @@
+"""
+Model cascade for AI Service routes
+
+Each route has an ordered list of model tiers in config.MODEL_CASCADES. The
+cheapest tier runs first; its answer is checked locally and only escalates to
+the next tier when the check reports problems or the call fails.
+"""
+
+import logging
+import statistics
+import threading
+import time
+from collections import deque
+from config import MODEL_CASCADES, CASCADE_MIN_CONFIDENCE
+from usage import budget_exhausted, budget_model
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Per route, tier and model called: call counts and recent latencies for tuning the cascade
+_stats = {}
+_stats_lock = threading.Lock()
+_LATENCY_WINDOW = 500
+
+
+def _record(route, tier_index, model, latency, accepted):
+    with _stats_lock:
+        tier_stats = _stats.setdefault(route, {}).setdefault(tier_index, {}).setdefault(model, {
+            "calls": 0,
+            "answered": 0,
+            "escalated": 0,
+            "latencies": deque(maxlen=_LATENCY_WINDOW),
+        })
+        tier_stats["calls"] += 1
+        tier_stats["answered" if accepted else "escalated"] += 1
+        tier_stats["latencies"].append(latency)
+
+
+def get_stats():
+    """Return call counts and p50 latency for every route, tier and model called."""
+    with _stats_lock:
+        return {
+            route: {
+                str(tier_index): {
+                    model: {
+                        "calls": tier_stats["calls"],
+                        "answered": tier_stats["answered"],
+                        "escalated": tier_stats["escalated"],
+                        "latency_p50_ms": round(statistics.median(tier_stats["latencies"]) * 1000, 1),
+                    }
+                    for model, tier_stats in models.items()
+                }
+                for tier_index, models in tiers.items()
+            }
+            for route, tiers in _stats.items()
+        }
+
+
+def low_confidence(result):
+    """Return a problem description if the model reported low confidence."""
+    confidence = result.get('confidence')
+    if isinstance(confidence, (int, float)) and confidence < CASCADE_MIN_CONFIDENCE:
+        return [f"low confidence ({confidence})"]
+    return []
+
+
+def check_bbox(bbox):
+    """Return a list of problems with a normalized (0-1000) bounding box."""
+    if not isinstance(bbox, dict) or not all(k in bbox for k in ['ymin', 'xmin', 'ymax', 'xmax']):
+        return ["missing bbox coordinates"]
+    try:
+        ymin, xmin, ymax, xmax = (float(bbox[k]) for k in ['ymin', 'xmin', 'ymax', 'xmax'])
+    except (TypeError, ValueError):
+        return ["non-numeric bbox coordinates"]
+    if xmax <= xmin or ymax <= ymin:
+        return ["degenerate bbox"]
+    # Boxes covering less than 1% of the image are almost always wrong
+    if (xmax - xmin) * (ymax - ymin) < 10000:
+        return ["bbox too small"]
+    return []
+
+
+def run_cascade(route, call_tier, check):
+    """Run the model cascade for a route.
+
+    call_tier(tier) performs the model call for a tier dict and returns the parsed
+    result. Its model is already the one to call: the budget fallback is resolved
+    here, so the call, the stats and tier_info name the same model. check(result)
+    returns a list of problems; an empty list accepts the answer.
+
+    Returns (result, problems, tier_info). If every tier fails its check, the last
+    tier's result and problems are returned. If the last tier raises, the
+    exception propagates to the caller.
+    """
+    tiers = MODEL_CASCADES[route]
+    budget_reason = budget_exhausted()
+    if budget_reason:
+        # Escalating only spends more, so stay on the cheapest tier
+        logger.info(f"Cascade {route} limited to tier 0: {budget_reason}")
+        tiers = tiers[:1]
+    for tier_index, tier in enumerate(tiers):
+        tier = dict(tier, model=budget_model(tier["model"]))
+        is_last = tier_index == len(tiers) - 1
+        start = time.perf_counter()
+        try:
+            result = call_tier(tier)
+            problems = check(result)
+        except Exception as e:
+            _record(route, tier_index, tier["model"], time.perf_counter() - start, False)
+            if is_last:
+                raise
+            logger.warning(f"Cascade {route} tier {tier_index} ({tier['model']}) failed: {e}")
+            continue
+
+        _record(route, tier_index, tier["model"], time.perf_counter() - start, not problems)
+        if problems and not is_last:
+            logger.info(
+                f"Cascade {route} tier {tier_index} ({tier['model']}) escalating: {', '.join(problems)}")
+            continue
+
+        tier_info = {
+            "tier": tier_index,
+            "provider": tier["provider"],
+            "model": tier["model"],
+        }
+        if budget_reason or tier["model"] != tiers[tier_index]["model"]:
+            tier_info["budget_limited"] = True
+        return result, problems, tier_info
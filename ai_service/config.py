@@ -3,9 +3,11 @@ Configuration module for AI service
 """
 
 import os
+import json
 import logging
 from dotenv import load_dotenv
 from openai import OpenAI
+from http_transport import build_http_client, build_timeout
 
 # Load environment variables
 load_dotenv()
@@ -20,16 +22,216 @@ AI_PROVIDER = "together"
 
 OPENAI_CROP_MODEL = "gpt-4.1"  # Using gpt-4.1 model
 LLAMA_CROP_MODEL = "meta-llama/Llama-4-Maverick-17B-128E-Instruct-FP8"
+# Model cascades per route: tiers run cheapest first and only answers that fail
+# the local quality checks in cascade.py escalate to the next, larger model
+MODEL_CASCADES = {
+    "extract": [
+        {"provider": "openai", "model": "gpt-4.1-nano"},
+        {"provider": "openai", "model": "gpt-4.1-mini"},
+    ],
+    # Multi-recipe pages need both extraction and bounding boxes
+    "extract_multi": [
+        {"provider": "openai", "model": "gpt-4.1-mini"},
+        {"provider": "openai", "model": OPENAI_CROP_MODEL},
+    ],
+    # Tiles of a dense page hold partial recipes, so they are not escalated
+    "extract_tile": [
+        {"provider": "openai", "model": "gpt-4.1-mini"},
+    ],
+    "crop": [
+        {"provider": "openai", "model": "gpt-4.1-mini"},
+        {"provider": "openai", "model": OPENAI_CROP_MODEL},
+    ],
+    "crop_llama": [
+        {"provider": "together", "model": "meta-llama/Llama-4-Scout-17B-16E-Instruct"},
+        {"provider": "together", "model": LLAMA_CROP_MODEL},
+    ],
+}
+# Ranked cover candidates (/crop with "candidates": true) use the same models
+MODEL_CASCADES["crop_candidates"] = MODEL_CASCADES["crop"]
+MODEL_CASCADES["crop_llama_candidates"] = MODEL_CASCADES["crop_llama"]
+# Answers with a lower self-reported confidence (0-1) are escalated
+CASCADE_MIN_CONFIDENCE = 0.6
+
+# Circuit breaker per provider/model: opens after BREAKER_FAILURE_THRESHOLD
+# consecutive failed calls (or calls slower than BREAKER_SLOW_CALL_SECONDS), fails
+# fast for BREAKER_OPEN_SECONDS, then lets one probe call through
+BREAKER_ENABLED = os.getenv("BREAKER_ENABLED", "true").lower() == "true"
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv("BREAKER_SLOW_CALL_SECONDS", "30"))
+BREAKER_OPEN_SECONDS = int(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+# Cover detections remembered per image, served while every crop model is unavailable
+BREAKER_CACHE_SIZE = 1024
+
+# Bounding boxes from the models are repaired and snapped to nearby image edges
+# (photo borders, page edges) before cropping, on a copy downscaled to this side
+BBOX_REFINE_ENABLED = os.getenv("BBOX_REFINE_ENABLED", "true").lower() == "true"
+BBOX_REFINE_SIDE = 384
+
+# Most cover candidates returned by /crop, and the overlap (IoU) above which two
+# candidate boxes count as the same cover
+CROP_MAX_CANDIDATES = 3
+CROP_CANDIDATE_MAX_IOU = 0.8
+
+# Extra attempts when a structured answer cannot be parsed or repaired
+STRUCTURED_OUTPUT_RETRIES = 1
+
+# Multi-page extraction: pages are downscaled to this longest side and sent together
+MULTI_PAGE_MAX_SIDE = 1600
+MULTI_PAGE_MAX_PAGES = 6
+# Output tokens of an extraction call per page sent. One page of recipe JSON fits in
+# 800 tokens; a merged multi-page recipe can hold the text of every page, so the
+# limit grows with the page count instead of truncating the instructions
+EXTRACT_MAX_TOKENS_PER_PAGE = 800
+
+# Tiled extraction for dense pages: images above the pixel threshold whose share of
+# text-like cells (roi.text_density) reaches TILE_MIN_TEXT_DENSITY are split into
+# overlapping tiles (fraction of the tile size) that are extracted concurrently.
+# The threshold is well above common phone photos (12 MP is 4032x3024), since a
+# tiled extraction costs one cascade call per tile
+TILE_PIXEL_THRESHOLD = 30_000_000
+TILE_MIN_TEXT_DENSITY = 0.2
+TILE_SIZE = 1536
+TILE_OVERLAP = 0.15
+TILE_MAX_TILES = 12
+
+# Text-region detection for /extract: only the dominant text block is sent when a
+# region covering between ROI_MIN_AREA and ROI_MAX_AREA of the image is found
+ROI_ENABLED = True
+ROI_ANALYSIS_SIDE = 512
+ROI_MIN_AREA = 0.1
+ROI_MAX_AREA = 0.85
+ROI_MARGIN = 0.03
+
+# Near-duplicate detection (dedup.py): MinHash permutations split into LSH bands
+# of DEDUP_NUM_PERM / DEDUP_BANDS rows, and the estimated similarity from which a
+# stored recipe is reported as a likely duplicate of an /extract result
+DEDUP_ENABLED = True
+DEDUP_INDEX_DIR = os.getenv("DEDUP_INDEX_DIR", "dedup_index")
+DEDUP_NUM_PERM = 128
+DEDUP_BANDS = 32
+DEDUP_THRESHOLD = 0.5
+DEDUP_MAX_RESULTS = 5
+
+# Local ingredient parsing (ingredients.py): parsed_ingredients on /extract results,
+# and the most ingredient lines one /scale request may send
+INGREDIENT_PARSING_ENABLED = os.getenv("INGREDIENT_PARSING_ENABLED", "true").lower() == "true"
+SCALE_MAX_INGREDIENTS = 500
+
+# Priority scheduling of provider calls (scheduler.py): concurrent provider calls,
+# weighted fair queuing weights per priority class, slots and share of the call
+# rate (calls per minute, 0 for no limit) that only a class may use, and the class
+# of requests by path prefix or default (X-Priority can only lower it)
+SCHEDULER_CONCURRENCY = int(os.getenv("SCHEDULER_CONCURRENCY", "8"))
+SCHEDULER_WEIGHTS = {"interactive": 4, "bulk": 1}
+SCHEDULER_RESERVED_SLOTS = {"interactive": 2}
+SCHEDULER_RATE_LIMIT = int(os.getenv("SCHEDULER_RATE_LIMIT", "0"))
+SCHEDULER_RESERVED_RATE = {"interactive": 0.25}
+SCHEDULER_DEFAULT_CLASS = "interactive"
+SCHEDULER_ROUTE_CLASSES = {"/batch/": "bulk"}
+
+# Token and cost accounting (usage.py): budgets in USD per window for routes
+# (request path, e.g. {"/extract": 5.0}) and callers (X-Caller header), cheaper
+# models used once a budget is spent, and the interval in seconds of the usage
+# summary log line (0 to disable)
+USAGE_ROUTE_BUDGETS = json.loads(os.getenv("USAGE_ROUTE_BUDGETS", "{}"))
+USAGE_CALLER_BUDGETS = json.loads(os.getenv("USAGE_CALLER_BUDGETS", "{}"))
+USAGE_BUDGET_WINDOW = 24 * 60 * 60
+USAGE_FALLBACK_MODELS = {
+    "gpt-4.1": "gpt-4.1-mini",
+    "gpt-4.1-mini": "gpt-4.1-nano",
+    "meta-llama/Llama-4-Maverick-17B-128E-Instruct-FP8": "meta-llama/Llama-4-Scout-17B-16E-Instruct",
+}
+USAGE_LOG_INTERVAL = int(os.getenv("USAGE_LOG_INTERVAL", "300"))
+
+# Pinned prompt versions by prompt name (prompts.py), e.g. {"extract": "v1"};
+# prompts without a pin use their latest version
+PROMPT_VERSIONS = json.loads(os.getenv("PROMPT_VERSIONS", "{}"))
+
+# Worker processes for decoding, cropping and re-encoding images (image_pool.py):
+# 0 sizes the pool to the available cores; smaller images are processed in-process
+IMAGE_POOL_ENABLED = os.getenv("IMAGE_POOL_ENABLED", "true").lower() == "true"
+IMAGE_POOL_WORKERS = int(os.getenv("IMAGE_POOL_WORKERS", "0"))
+IMAGE_POOL_MIN_BYTES = 256 * 1024
+
+# Offline bulk ingest (ingest.py): longest side of images sent to the provider
+# and number of concurrent provider calls
+INGEST_MAX_SIDE = 2048
+INGEST_CONCURRENCY = 8
+
+# Batch endpoint (/batch/<route>): default and maximum concurrent items per batch,
+# maximum batch size, and the local image store that item references point into
+BATCH_CONCURRENCY = 4
+BATCH_MAX_CONCURRENCY = 16
+BATCH_MAX_ITEMS = 500
+BATCH_STORE_DIR = os.getenv("BATCH_STORE_DIR", "batch_store")
+
+# Provider batch API mode of ingest.py and backfill.py (--batch-api): provider calls
+# are collected into batch jobs, which cost less and have their own rate limits.
+# A job is submitted once it holds BATCH_API_MAX_REQUESTS requests or no request
+# was added for BATCH_API_LINGER_SECONDS
+BATCH_API_MAX_REQUESTS = int(os.getenv("BATCH_API_MAX_REQUESTS", "200"))
+BATCH_API_LINGER_SECONDS = float(os.getenv("BATCH_API_LINGER_SECONDS", "5"))
+BATCH_API_POLL_SECONDS = float(os.getenv("BATCH_API_POLL_SECONDS", "30"))
+# Items in flight in batch API mode when --concurrency is not given. A waiting item
+# only holds a thread blocked on its queued request, not a provider connection, and
+# jobs hold at most as many requests as there are items in flight, so the default
+# lets a job fill up to BATCH_API_MAX_REQUESTS before it is submitted
+BATCH_API_CONCURRENCY = int(os.getenv("BATCH_API_CONCURRENCY", str(BATCH_API_MAX_REQUESTS)))
+# Price of batch calls relative to synchronous calls, per provider
+BATCH_API_PRICE_FACTOR = {"openai": 0.5, "together": 0.5}
+
+# Model used by the fused /analyze route (verify + extract + crop in one call)
+OPENAI_ANALYZE_MODEL = "gpt-4.1"
+
+# Approximate provider prices in USD per 1M tokens, used for cost estimates
+MODEL_PRICING = {
+    "gpt-4.1": {"input": 2.00, "output": 8.00},
+    "gpt-4.1-mini": {"input": 0.40, "output": 1.60},
+    "gpt-4.1-nano": {"input": 0.10, "output": 0.40},
+    "meta-llama/Llama-4-Maverick-17B-128E-Instruct-FP8": {"input": 0.27, "output": 0.85},
+    "meta-llama/Llama-4-Scout-17B-16E-Instruct": {"input": 0.18, "output": 0.59},
+}
+
+# Unix domain socket served next to the HTTP port for co-located callers (the Node
+# server in the same container): framed requests carry raw image bytes instead of
+# base64 JSON. Empty disables it
+AI_SERVICE_SOCKET = os.getenv("AI_SERVICE_SOCKET", "")
+# Flask debug mode (with the code reloader) for run.py and app.py
+AI_SERVICE_DEBUG = os.getenv("AI_SERVICE_DEBUG", "true").lower() == "true"
+SOCKET_MAX_FRAME_BYTES = 64 * 1024 * 1024
+
+# Shared HTTP transport of the provider clients: pooled keep-alive connections,
+# so calls reuse warm connections instead of paying TCP and TLS handshakes.
+# HTTP/2 needs the optional h2 package
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "32"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "16"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "120"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "false").lower() == "true"
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "120"))
+# Longest wait for a free pooled connection
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "30"))
+
+http_client = build_http_client(HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE, HTTP_KEEPALIVE_EXPIRY, HTTP2_ENABLED,
+                                HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_POOL_TIMEOUT)
+http_timeout = build_timeout(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_POOL_TIMEOUT)
 
 # Initialize OpenAI client
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=http_client, timeout=http_timeout)
 
 # Initialize Together client only if we're using Together provider
 together_client = None
 if AI_PROVIDER == "together":
     try:
         from together import Together
-        together_client = Together(api_key=os.getenv("TOGETHER_API_KEY"))
+        try:
+            together_client = Together(api_key=os.getenv("TOGETHER_API_KEY"), http_client=http_client,
+                                       timeout=http_timeout)
+        except TypeError:
+            # Older together SDKs are not built on httpx
+            logger.warning("This together version cannot use the shared HTTP transport")
+            together_client = Together(api_key=os.getenv("TOGETHER_API_KEY"))
 
         # Check if Together API key is set
         if not os.getenv("TOGETHER_API_KEY"):
@@ -48,3 +250,13 @@ if AI_PROVIDER == "openai" and not os.getenv("OPENAI_API_KEY"):
     logger.warning(
         "OPENAI_API_KEY environment variable is not set. The OpenAI services will not work properly."
     )
+
+# Profiling configuration
+# Requests sent with an "X-Profile: 1" header are always profiled. In addition a
+# fraction of all requests can be sampled (0.0 disables sampling, 1.0 profiles everything)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+# Number of stack frames tracemalloc keeps per allocation
+PROFILE_TRACE_DEPTH = int(os.getenv("PROFILE_TRACE_DEPTH", "10"))
+# Soak-test mode: seconds between heap snapshots (0 disables the monitor)
+PROFILE_SOAK_INTERVAL = int(os.getenv("PROFILE_SOAK_INTERVAL", "0"))
@@ -0,0 +1,467 @@
+#!/usr/bin/env python3
+"""
+Near-duplicate recipe detection for AI Service
+
+Recipes are reduced to MinHash signatures over word shingles of their normalized
+title, ingredients and instructions. Signatures are split into LSH bands, so a
+lookup only compares against recipes sharing at least one band instead of the
+whole index. The estimated Jaccard similarity of the candidates is then the
+share of equal signature values.
+
+The index lives in a directory: index.npz is written by the bulk build command,
+additions.jsonl logs recipes added to or removed from a running service since the
+last build. Every server process replays the log before a lookup, so changes made
+through one worker are seen by all of them.
+
+Usage:
+    python dedup.py build <export.json> [<export.json> ...] [--index <dir>]
+    python dedup.py compact [--index <dir>]
+"""
+
+import argparse
+import fcntl
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import unicodedata
+import zlib
+from contextlib import contextmanager
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from config import (DEDUP_INDEX_DIR, DEDUP_NUM_PERM, DEDUP_BANDS, DEDUP_THRESHOLD,
+                    DEDUP_MAX_RESULTS)
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Words per shingle
+SHINGLE_SIZE = 3
+# Fixed seed: signatures are only comparable when built with the same permutations
+SEED = 1
+# Largest prime below 2**32, the range of the shingle hashes
+PRIME = 4294967291
+
+_rng = np.random.default_rng(SEED)
+_PERM_A = _rng.integers(1, 2 ** 31, size=DEDUP_NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.integers(0, PRIME, size=DEDUP_NUM_PERM, dtype=np.uint64)
+_BAND_MIX = _rng.integers(1, 2 ** 63, size=DEDUP_NUM_PERM, dtype=np.uint64) | np.uint64(1)
+
+
+def normalize(text):
+    """Lowercase, strip accents and punctuation, and return the list of words."""
+    text = unicodedata.normalize("NFKD", str(text or ""))
+    text = text.encode("ascii", "ignore").decode("ascii").lower()
+    return re.findall(r"[a-z0-9]+", text)
+
+
+def shingles(recipe):
+    """Return the set of word shingles of a recipe's title, ingredients and instructions."""
+    fields = [[recipe.get("title")]]
+    fields += [recipe.get("ingredients") or [], recipe.get("instructions") or []]
+    result = set()
+    for field in fields:
+        # Shingles never span two fields, so moving a line between them matters less
+        words = [word for line in field for word in normalize(line)]
+        if 0 < len(words) < SHINGLE_SIZE:
+            result.add(" ".join(words))
+        for i in range(len(words) - SHINGLE_SIZE + 1):
+            result.add(" ".join(words[i:i + SHINGLE_SIZE]))
+    return result
+
+
+def signature(recipe):
+    """Return the MinHash signature of a recipe, or None if it has no text."""
+    tokens = shingles(recipe)
+    if not tokens:
+        return None
+    hashes = np.fromiter((zlib.crc32(token.encode("utf-8")) for token in tokens),
+                         dtype=np.uint64, count=len(tokens))
+    # One universal hash per permutation, all shingles at once
+    permuted = (np.outer(_PERM_A, hashes) + _PERM_B[:, None]) % PRIME
+    return permuted.min(axis=1).astype(np.uint32)
+
+
+class DuplicateIndex:
+    """MinHash signatures of known recipes with LSH band tables for candidate lookup.
+
+    Recipes from index.npz live in numpy arrays sorted by id: the signature
+    matrix and, for each band, the band keys in sorted order with the rows they
+    belong to. A lookup is one binary search per band, and memory stays at a few
+    hundred bytes per recipe with no Python object per entry. Recipes added to a
+    running service go into a small delta with dict buckets until the next save
+    folds them into the arrays. Removed recipes are skipped by lookups and dropped
+    by the next save.
+    """
+
+    def __init__(self, num_perm=DEDUP_NUM_PERM, bands=DEDUP_BANDS):
+        if num_perm % bands:
+            raise ValueError(f"{num_perm} permutations cannot be split into {bands} bands")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self._set_base(np.zeros(0, dtype=str), np.zeros(0, dtype=str),
+                       np.zeros((0, num_perm), dtype=np.uint32))
+        self.lock = threading.Lock()
+        # Bytes of additions.jsonl applied, and the index.npz they apply to
+        self.log_offset = 0
+        self.source = None
+
+    def _set_base(self, ids, titles, signatures, band_keys=None, band_rows=None):
+        """Replace the array part of the index and clear the delta. ids must be sorted and unique."""
+        self.base_ids = ids
+        self.base_titles = titles
+        self.base_signatures = signatures
+        if band_keys is None:
+            keys = self._band_keys(signatures).T
+            band_rows = np.argsort(keys, axis=1, kind="stable").astype(np.int32)
+            band_keys = np.take_along_axis(keys, band_rows, axis=1)
+        self.band_keys = band_keys
+        self.band_rows = band_rows
+        # Titles of re-indexed base recipes, by row
+        self.replaced_titles = {}
+        # Delta: recipes added since the arrays were built, at positions after the base rows
+        self.ids = []
+        self.titles = []
+        self.signatures = []
+        self.buckets = [{} for _ in range(self.bands)]
+        self.positions = {}
+        # Positions of removed recipes, base rows or delta
+        self.removed = set()
+
+    def __len__(self):
+        return len(self.base_ids) + len(self.ids) - len(self.removed)
+
+    def _band_keys(self, signatures, chunk=65536):
+        """Return a (recipes, bands) array with one 64-bit key per band of each signature."""
+        keys = np.empty((len(signatures), self.bands), dtype=np.uint64)
+        # In chunks, so building a large index does not need a uint64 copy of every signature
+        for start in range(0, len(signatures), chunk):
+            part = signatures[start:start + chunk]
+            bands = part.reshape(len(part), self.bands, self.rows).astype(np.uint64)
+            # Mix the rows of each band into one 64-bit value; collisions only add candidates
+            keys[start:start + chunk] = (bands * _BAND_MIX[:self.rows]).sum(axis=2)
+        return keys
+
+    def _base_row(self, recipe_id):
+        row = int(np.searchsorted(self.base_ids, recipe_id))
+        if row < len(self.base_ids) and self.base_ids[row] == recipe_id:
+            return row
+        return None
+
+    def _add_delta(self, recipe_id, title, sig):
+        row = self._base_row(recipe_id)
+        if row is not None:
+            # Re-indexed recipes keep their row; stale band entries only add a candidate
+            position = row
+            self.base_signatures[row] = sig
+            self.replaced_titles[row] = title
+        elif recipe_id in self.positions:
+            position = self.positions[recipe_id]
+            self.signatures[position - len(self.base_ids)] = sig
+            self.titles[position - len(self.base_ids)] = title
+        else:
+            position = len(self.base_ids) + len(self.ids)
+            self.positions[recipe_id] = position
+            self.ids.append(recipe_id)
+            self.titles.append(title)
+            self.signatures.append(sig)
+        self.removed.discard(position)
+        for bucket, key in zip(self.buckets, self._band_keys(sig[None, :])[0].tolist()):
+            bucket.setdefault(key, []).append(position)
+
+    def add(self, recipe_id, recipe):
+        """Index a recipe. Returns its signature, or None if it has no text to index."""
+        sig = signature(recipe)
+        if sig is None:
+            return None
+        with self.lock:
+            self._add_delta(str(recipe_id), recipe.get("title") or "", sig)
+        return sig
+
+    def _indexed(self, recipe_id):
+        """Return the position of a recipe that is indexed and not removed, or None."""
+        position = self._base_row(recipe_id)
+        if position is None:
+            position = self.positions.get(recipe_id)
+        return None if position in self.removed else position
+
+    def _remove(self, recipe_id):
+        position = self._indexed(recipe_id)
+        if position is None:
+            return False
+        self.removed.add(position)
+        return True
+
+    def remove(self, recipe_id):
+        """Drop a recipe from lookups. Returns False if it was not indexed."""
+        with self.lock:
+            return self._remove(str(recipe_id))
+
+    def _entry(self, position):
+        """Return (id, title, signature) of a position in the base rows or the delta."""
+        base_size = len(self.base_ids)
+        if position < base_size:
+            title = self.replaced_titles.get(position, self.base_titles[position])
+            return str(self.base_ids[position]), str(title), self.base_signatures[position]
+        position -= base_size
+        return self.ids[position], self.titles[position], self.signatures[position]
+
+    def query(self, recipe, threshold=DEDUP_THRESHOLD, limit=DEDUP_MAX_RESULTS):
+        """Return likely duplicates of a recipe as [{"id", "title", "similarity"}], best first."""
+        sig = signature(recipe)
+        if sig is None:
+            return []
+        keys = self._band_keys(sig[None, :])[0]
+        with self.lock:
+            candidates = set()
+            for band, key in enumerate(keys):
+                band_keys = self.band_keys[band]
+                low = np.searchsorted(band_keys, key, side="left")
+                high = np.searchsorted(band_keys, key, side="right")
+                if high > low:
+                    candidates.update(self.band_rows[band, low:high].tolist())
+                candidates.update(self.buckets[band].get(int(key), ()))
+            candidates -= self.removed
+            matches = []
+            for position in candidates:
+                recipe_id, title, candidate = self._entry(position)
+                similarity = float(np.count_nonzero(candidate == sig)) / self.num_perm
+                if similarity >= threshold:
+                    matches.append({"id": recipe_id, "title": title, "similarity": round(similarity, 3)})
+        matches.sort(key=lambda match: match["similarity"], reverse=True)
+        return matches[:limit]
+
+    def extend(self, recipe_ids, titles, signatures):
+        """Fold the delta and a batch of new recipes into the arrays. Later entries of an id win."""
+        with self.lock:
+            base_titles = self.base_titles.astype(object)
+            for row, title in self.replaced_titles.items():
+                base_titles[row] = title
+            ids = np.concatenate([self.base_ids, np.array(self.ids + list(recipe_ids), dtype=str)])
+            all_titles = np.concatenate([base_titles, np.array(self.titles + list(titles), dtype=object)])
+            delta = np.array(self.signatures, dtype=np.uint32).reshape(-1, self.num_perm)
+            new = np.asarray(signatures, dtype=np.uint32).reshape(-1, self.num_perm)
+            all_signatures = np.concatenate([self.base_signatures, delta, new])
+            if self.removed:
+                alive = np.ones(len(ids), dtype=bool)
+                alive[list(self.removed)] = False
+                ids, all_titles, all_signatures = ids[alive], all_titles[alive], all_signatures[alive]
+            order = np.argsort(ids, kind="stable")
+            ids = ids[order]
+            # Of equal ids the stable sort keeps insertion order, so the last one is the newest
+            keep = np.append(ids[1:] != ids[:-1], True) if len(ids) else np.zeros(0, dtype=bool)
+            rows = order[keep]
+            self._set_base(ids[keep], all_titles[rows].astype(str), all_signatures[rows])
+
+    def save(self, index_dir):
+        """Fold the delta into the arrays, write them to index.npz and clear the additions log."""
+        if self.ids or self.replaced_titles or self.removed:
+            self.extend([], [], [])
+        os.makedirs(index_dir, exist_ok=True)
+        with self.lock:
+            path = os.path.join(index_dir, "index.npz")
+            # Write next to the old file and swap, so a crash never leaves a partial index
+            with open(path + ".tmp", "wb") as f:
+                np.savez(f, ids=self.base_ids, titles=self.base_titles, signatures=self.base_signatures,
+                         band_keys=self.band_keys, band_rows=self.band_rows, bands=self.bands)
+            os.replace(path + ".tmp", path)
+            open(os.path.join(index_dir, "additions.jsonl"), "w").close()
+            self.log_offset = 0
+            self.source = _file_stamp(path)
+
+    def _log(self, index_dir, entry):
+        """Append an entry to the additions log and apply every entry logged since the last sync."""
+        os.makedirs(index_dir, exist_ok=True)
+        with _log_lock(index_dir), open(os.path.join(index_dir, "additions.jsonl"), "a") as log:
+            log.write(json.dumps(entry) + "\n")
+        self.sync(index_dir)
+
+    def append(self, index_dir, recipe_id, recipe):
+        """Index a recipe and record it in the additions log so it survives a restart."""
+        sig = signature(recipe)
+        if sig is None:
+            return False
+        self._log(index_dir, {"id": str(recipe_id), "title": recipe.get("title") or "",
+                              "signature": sig.tolist()})
+        return True
+
+    def append_removal(self, index_dir, recipe_id):
+        """Remove a recipe and record the removal in the additions log. Returns False if it was not indexed."""
+        with self.lock:
+            indexed = self._indexed(str(recipe_id)) is not None
+        self._log(index_dir, {"id": str(recipe_id), "removed": True})
+        return indexed
+
+    def stale(self, index_dir):
+        """Return True if index.npz was replaced or the additions log truncated since this index was loaded."""
+        if _file_stamp(os.path.join(index_dir, "index.npz")) != self.source:
+            return True
+        additions = _file_stamp(os.path.join(index_dir, "additions.jsonl"))
+        return (additions[1] if additions else 0) < self.log_offset
+
+    def sync(self, index_dir):
+        """Apply the entries other processes appended to the additions log since the last sync."""
+        path = os.path.join(index_dir, "additions.jsonl")
+        try:
+            if os.path.getsize(path) <= self.log_offset:
+                return
+            with open(path, "rb") as log:
+                log.seek(self.log_offset)
+                data = log.read()
+        except FileNotFoundError:
+            return
+        # A line still being written is applied by the next sync
+        end = data.rfind(b"\n") + 1
+        with self.lock:
+            for line in data[:end].splitlines():
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash can leave a partial line
+                    continue
+                if entry.get("removed"):
+                    self._remove(entry["id"])
+                else:
+                    self._add_delta(entry["id"], entry["title"], np.array(entry["signature"], dtype=np.uint32))
+            self.log_offset += end
+
+    @classmethod
+    def load(cls, index_dir):
+        """Load an index directory. A missing directory gives an empty index."""
+        index = cls()
+        path = os.path.join(index_dir, "index.npz")
+        index.source = _file_stamp(path)
+        if os.path.exists(path):
+            with np.load(path) as data:
+                if data["signatures"].shape[1] != index.num_perm or int(data["bands"]) != index.bands:
+                    raise ValueError(f"Index at {index_dir} was built with different MinHash settings")
+                if "band_keys" in data:
+                    index._set_base(data["ids"], data["titles"], data["signatures"],
+                                    data["band_keys"], data["band_rows"])
+                else:
+                    # Indexes written before the band tables were stored
+                    index.extend(data["ids"].tolist(), data["titles"].tolist(), data["signatures"])
+        index.sync(index_dir)
+        return index
+
+
+def _file_stamp(path):
+    """Return (inode, size, mtime) of a file, or None if it does not exist."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+@contextmanager
+def _log_lock(index_dir):
+    """Hold the lock that serializes writers of an index directory across processes."""
+    with open(os.path.join(index_dir, "additions.lock"), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """Return the service-wide index, loading it from DEDUP_INDEX_DIR on first use.
+
+    Entries other server processes logged since the last call are applied first,
+    and the index is reloaded after `dedup.py compact` replaced index.npz.
+    """
+    global _index
+    with _index_lock:
+        if _index is None or _index.stale(DEDUP_INDEX_DIR):
+            start = time.perf_counter()
+            _index = DuplicateIndex.load(DEDUP_INDEX_DIR)
+            logger.info(f"Loaded duplicate index with {len(_index)} recipes "
+                        f"in {time.perf_counter() - start:.1f} s")
+        else:
+            _index.sync(DEDUP_INDEX_DIR)
+        return _index
+
+
+def preload_index():
+    """Load the service-wide index in a background thread at startup."""
+    def load():
+        try:
+            get_index()
+        except Exception as e:
+            logger.error(f"Failed to load duplicate index: {e}")
+    threading.Thread(target=load, name="dedup-index-load", daemon=True).start()
+
+
+def find_duplicates(recipe, wait=True):
+    """Return likely duplicates of a recipe from the service-wide index.
+
+    With wait=False, returns None instead of waiting while the index is still loading.
+    """
+    if not wait and _index is None:
+        return None
+    return get_index().query(recipe)
+
+
+def iter_export_recipes(paths):
+    """Yield recipes from /api/recipes/data/export files ({"recipes": [...], "favorites": [...]})."""
+    for path in paths:
+        with open(path) as f:
+            data = json.load(f)
+        recipes = data.get("recipes", []) if isinstance(data, dict) else data
+        for recipe in recipes:
+            yield recipe
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Near-duplicate recipe index")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Build the index from recipe export files")
+    build.add_argument('exports', nargs='+', help="JSON files from /api/recipes/data/export")
+    build.add_argument('--index', default=DEDUP_INDEX_DIR, help="Index directory")
+    build.add_argument('--append', action='store_true',
+                       help="Add to the existing index instead of starting from scratch")
+    compact = commands.add_parser("compact", help="Fold the additions log of a running service into index.npz")
+    compact.add_argument('--index', default=DEDUP_INDEX_DIR, help="Index directory")
+    args = parser.parse_args()
+
+    os.makedirs(args.index, exist_ok=True)
+    # Servers append to the log while running; hold it until the new index is written
+    with _log_lock(args.index):
+        build_index(args)
+
+
+def build_index(args):
+    index = DuplicateIndex.load(args.index) if args.command == "compact" or args.append else DuplicateIndex()
+    start = time.perf_counter()
+    recipe_ids, titles, signatures = [], [], []
+    skipped = 0
+    for recipe in iter_export_recipes(args.exports if args.command == "build" else []):
+        sig = signature(recipe) if "id" in recipe else None
+        if sig is None:
+            skipped += 1
+            continue
+        recipe_ids.append(str(recipe["id"]))
+        titles.append(recipe.get("title") or "")
+        signatures.append(sig)
+    added = len(signatures)
+    index.extend(recipe_ids, titles, np.array(signatures, dtype=np.uint32).reshape(-1, index.num_perm))
+    index.save(args.index)
+    logger.info(f"Indexed {added} recipes ({skipped} skipped, {len(index)} total) "
+                f"in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+"""
+Evaluate crop and extraction quality of every configured provider/model.
+
+Runs each model of the crop, crop_llama and extract cascades (MODEL_CASCADES) on
+its own over a labeled golden set, and reports side by side:
+- crop: bbox IoU with the labeled cover (as returned and after local refinement),
+  share of boxes with IoU >= 0.5 and cover type accuracy
+- extract: per-field accuracy (title, servings, cooking time, ingredients,
+  instructions)
+- for both: parse-failure rate, share of answers the cascade would escalate,
+  latency percentiles and cost per image
+
+Live runs can record every provider response; replay runs answer from such a
+recording instead of calling the providers, so prompt and scoring changes can be
+compared on the same answers. Recorded latencies are reported in replay mode.
+Recordings are keyed by prompt version: answers of an older prompt are not
+replayed and count as missing.
+
+Usage:
+    python evaluate.py [--golden ../test_images/golden.json] [--record responses.jsonl]
+    python evaluate.py --replay responses.jsonl [--json report.json] [--history history.jsonl]
+    python evaluate.py --add crop=openai/gpt-4.1-nano --only openai/gpt-4.1-nano
+"""
+
+import argparse
+import base64
+import difflib
+import json
+import logging
+import math
+import os
+import re
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import providers
+import usage
+from config import MODEL_CASCADES, BBOX_REFINE_SIDE
+from prompts import get_prompt, active_versions
+from refine import refine_bbox
+from schemas import StructuredOutputError
+from utils import base64_to_pil_image
+from routes import crop, crop_llama, extract
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_GOLDEN = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'test_images', 'golden.json')
+
+# Boxes overlapping the labeled cover at least this much count as a hit
+IOU_HIT = 0.5
+# Normalized text similarity (0-1) for a title or ingredient line to count as correct
+TITLE_MATCH = 0.8
+LINE_MATCH = 0.7
+# Cascade routes whose models are evaluated
+ROUTES = ["crop", "crop_llama", "extract"]
+
+
+class ReplayMissing(Exception):
+    """Raised when a replayed call has no recorded response."""
+
+
+def _task_request(route):
+    """Return (task, prompt name, request(image_data, tier), check) of a cascade route."""
+    if route == "crop":
+        return "crop", "crop", crop.request_crop_box, crop.check_crop
+    if route == "crop_llama":
+        return "crop", "crop_llama", crop_llama.request_crop_box, crop_llama.check_crop
+    return "extract", "extract", lambda image_data, tier: extract.request_recipe([image_data], tier), \
+        extract.check_recipe
+
+
+def _to_object(value):
+    """Rebuild a recorded response so it reads like a provider response object."""
+    if isinstance(value, dict):
+        return SimpleNamespace(**{key: _to_object(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return [_to_object(item) for item in value]
+    return value
+
+
+def _to_dict(response):
+    if hasattr(response, "model_dump"):
+        return response.model_dump()
+    return json.loads(json.dumps(response, default=vars))
+
+
+class CallLog:
+    """Stands in for the provider clients during an evaluation.
+
+    Live: forwards to the real clients, timing and optionally recording every
+    response. Replay: answers from a recording. Calls are grouped by the key
+    of the model/image/prompt being evaluated.
+    """
+
+    def __init__(self, replay=None, record_path=None):
+        self.replay = replay
+        self.record_path = record_path
+        self.key = None
+        self.calls = []
+        self._get_client = providers.get_client
+
+    def start(self, key):
+        self.key = key
+        self.calls = []
+
+    def finish(self):
+        """Return the calls of the current key, recording them in live mode."""
+        if self.record_path and self.replay is None and self.calls:
+            with open(self.record_path, 'a') as f:
+                f.write(json.dumps({"key": self.key, "calls": self.calls}) + "\n")
+        return self.calls
+
+    def get_client(self, provider):
+        log = self
+        completions = SimpleNamespace(create=lambda **kwargs: log.create(provider, **kwargs))
+        return SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+    def create(self, provider, **kwargs):
+        if self.replay is not None:
+            recorded = self.replay.get(self.key, [])
+            if len(self.calls) >= len(recorded):
+                raise ReplayMissing(f"No recorded response for {self.key}")
+            call = recorded[len(self.calls)]
+            self.calls.append(call)
+            return _to_object(call["response"])
+
+        start = time.perf_counter()
+        response = self._get_client(provider).chat.completions.create(**kwargs)
+        self.calls.append({
+            "model": kwargs.get("model"),
+            "latency_s": round(time.perf_counter() - start, 4),
+            "response": _to_dict(response),
+        })
+        return response
+
+
+def load_recording(path):
+    """Return recorded calls by key; the last line for a key wins."""
+    recording = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                recording[entry["key"]] = entry["calls"]
+    return recording
+
+
+def bbox_iou(a, b):
+    """Intersection over union of two normalized bounding boxes."""
+    a = {k: float(a[k]) for k in ['ymin', 'xmin', 'ymax', 'xmax']}
+    b = {k: float(b[k]) for k in ['ymin', 'xmin', 'ymax', 'xmax']}
+    width = min(a["xmax"], b["xmax"]) - max(a["xmin"], b["xmin"])
+    height = min(a["ymax"], b["ymax"]) - max(a["ymin"], b["ymin"])
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    union = ((a["xmax"] - a["xmin"]) * (a["ymax"] - a["ymin"]) +
+             (b["xmax"] - b["xmin"]) * (b["ymax"] - b["ymin"]) - intersection)
+    return intersection / union if union > 0 else 0.0
+
+
+def _normalize(text):
+    text = str(text).lower().replace("&", " and ")
+    return " ".join(re.sub(r"[^\w\s]", " ", text).split())
+
+
+def similarity(a, b):
+    """Similarity (0-1) of two texts, ignoring case and punctuation."""
+    return difflib.SequenceMatcher(None, _normalize(a), _normalize(b)).ratio()
+
+
+def line_f1(expected, actual):
+    """F1 of matching expected lines to extracted lines (each used once)."""
+    if not expected or not actual:
+        return 1.0 if not expected and not actual else 0.0
+    unmatched = [_normalize(line) for line in actual]
+    matched = 0
+    for line in expected:
+        line = _normalize(line)
+        scores = [difflib.SequenceMatcher(None, line, other).ratio() for other in unmatched]
+        if scores and max(scores) >= LINE_MATCH:
+            unmatched.pop(scores.index(max(scores)))
+            matched += 1
+    precision, recall = matched / len(actual), matched / len(expected)
+    return 2 * precision * recall / (precision + recall) if matched else 0.0
+
+
+def _same_number(expected, actual):
+    try:
+        return float(expected) == float(actual)
+    except (TypeError, ValueError):
+        return False
+
+
+def score_recipe(expected, actual):
+    """Return a 0-1 score for every labeled field of a recipe."""
+    scores = {}
+    for field, value in expected.items():
+        if field == "title":
+            scores[field] = float(similarity(value, actual.get(field, "")) >= TITLE_MATCH)
+        elif field == "ingredients":
+            scores[field] = round(line_f1(value, actual.get(field) or []), 4)
+        elif field == "instructions":
+            # Models split the method into steps differently, so compare the whole text
+            scores[field] = round(similarity(" ".join(value), " ".join(map(str, actual.get(field) or []))), 4)
+        else:
+            scores[field] = float(_same_number(value, actual.get(field)))
+    return scores
+
+
+def score_crop(expected, actual, image):
+    """Return IoU before and after refinement and whether the cover type matches."""
+    bbox = actual.get("bbox")
+    try:
+        iou = bbox_iou(expected["bbox"], bbox)
+    except (KeyError, TypeError, ValueError):
+        iou = 0.0
+    refined = refine_bbox(image, bbox, side=BBOX_REFINE_SIDE) if image is not None else None
+    return {
+        "iou": round(iou, 4),
+        "iou_refined": round(bbox_iou(expected["bbox"], refined) if refined else iou, 4),
+        "cover_type": float(actual.get("cover_type") == expected["cover_type"]),
+    }
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def _mean(values):
+    return round(statistics.mean(values), 4) if values else None
+
+
+def _call_cost(call):
+    tokens = call["response"].get("usage") or {}
+    return usage.estimate_cost(call["model"], tokens.get("prompt_tokens") or 0,
+                               tokens.get("completion_tokens") or 0)
+
+
+def summarize(route, tier, task, items):
+    """Roll the item results of one model up into its report entry."""
+    answered = [item for item in items if item["outcome"] == "ok"]
+    attempted = [item for item in items if item["outcome"] != "missing"]
+    latencies = [item["latency_ms"] for item in attempted]
+    summary = {
+        "route": route,
+        "provider": tier["provider"],
+        "model": tier["model"],
+        "task": task,
+        "runs": len(attempted),
+        # Runs answered by a budget fallback model instead of this one
+        "fallback_runs": sum(item["model"] != tier["model"] for item in attempted),
+        "missing": len(items) - len(attempted),
+        "parse_failures": sum(item["outcome"] == "parse_failure" for item in items),
+        "errors": sum(item["outcome"] == "error" for item in items),
+        "parse_failure_rate": round(sum(item["outcome"] == "parse_failure" for item in items) /
+                                    len(attempted), 4) if attempted else None,
+        "escalation_rate": round(sum(bool(item["problems"]) for item in answered) /
+                                 len(answered), 4) if answered else None,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.5), 1),
+            "p90": round(percentile(latencies, 0.9), 1),
+            "p95": round(percentile(latencies, 0.95), 1),
+            "max": round(max(latencies), 1),
+        } if latencies else None,
+        "cost_usd_per_image": round(statistics.mean(item["cost_usd"] for item in attempted), 6)
+        if attempted else None,
+    }
+    # Failed answers score 0, so unreliable models are not flattered
+    scored = [item["scores"] for item in attempted]
+    if task == "crop":
+        summary["iou_mean"] = _mean([s.get("iou", 0.0) for s in scored])
+        summary["iou_refined_mean"] = _mean([s.get("iou_refined", 0.0) for s in scored])
+        summary["hit_rate"] = _mean([float(s.get("iou", 0.0) >= IOU_HIT) for s in scored])
+        summary["cover_type_accuracy"] = _mean([s.get("cover_type", 0.0) for s in scored])
+    else:
+        fields = sorted({field for s in scored for field in s})
+        summary["fields"] = {field: _mean([s.get(field, 0.0) for s in scored]) for field in fields}
+        summary["field_accuracy"] = _mean([s.get(field, 0.0) for s in scored for field in fields])
+    return summary
+
+
+def subjects(only=None, added=()):
+    """Yield (route, tier) for every configured model, plus added ones, deduplicated."""
+    seen = set()
+    extra = [(route, {"provider": provider, "model": model}) for route, provider, model in added]
+    for route, tier in [(route, tier) for route in ROUTES for tier in MODEL_CASCADES.get(route, [])] + extra:
+        name = f"{tier['provider']}/{tier['model']}"
+        if (route, name) in seen or (only and name not in only):
+            continue
+        seen.add((route, name))
+        yield route, tier
+
+
+def evaluate(golden, image_dir, log, only=None, added=(), repeat=1):
+    """Run every subject over the golden set. Returns (summaries, items)."""
+    summaries, all_items = [], []
+    images = {}
+    for name in golden:
+        with open(os.path.join(image_dir, name), 'rb') as f:
+            image_data = base64.b64encode(f.read()).decode('utf-8')
+        image = base64_to_pil_image(image_data)
+        image.load()
+        images[name] = (image_data, image)
+
+    for route, tier in subjects(only, added):
+        task, prompt_name, request, check = _task_request(route)
+        prompt_id = get_prompt(prompt_name).id
+        items = []
+        for name, labels in golden.items():
+            image_data, image = images[name]
+            for run in range(repeat):
+                key = f"{route}|{tier['provider']}/{tier['model']}|{prompt_id}|{name}|{run}"
+                log.start(key)
+                # A used-up budget switches to the fallback model; the item names the model that ran
+                called = dict(tier, model=usage.budget_model(tier["model"]))
+                item = {"route": route, "model": called["model"], "image": name, "run": run,
+                        "outcome": "ok", "problems": [], "scores": {}}
+                start = time.perf_counter()
+                try:
+                    answer = request(image_data, called)
+                    item["problems"] = check(answer)
+                    if task == "crop":
+                        item["scores"] = score_crop(labels["cover"], answer, image)
+                    else:
+                        item["scores"] = score_recipe(labels["recipe"], answer)
+                except ReplayMissing:
+                    item["outcome"] = "missing"
+                except StructuredOutputError as e:
+                    item["outcome"] = "parse_failure"
+                    item["error"] = str(e)
+                except Exception as e:
+                    logger.warning(f"{key} failed: {e}")
+                    item["outcome"] = "error"
+                    item["error"] = str(e)
+                elapsed = time.perf_counter() - start
+                calls = log.finish()
+                # Provider time only: recorded in replay mode, and free of local queueing
+                item["latency_ms"] = round(sum(c["latency_s"] for c in calls) * 1000, 1) \
+                    if calls else round(elapsed * 1000, 1)
+                item["cost_usd"] = round(sum(_call_cost(c) for c in calls), 6)
+                item["calls"] = len(calls)
+                items.append(item)
+                logger.info(f"{key}: {item['outcome']} {item['scores']}")
+        summaries.append(summarize(route, tier, task, items))
+        all_items += items
+    return summaries, all_items
+
+
+def print_table(summaries):
+    """Print the main metrics of every model side by side."""
+    columns = [
+        ("parse fail", lambda s: s["parse_failure_rate"]),
+        ("escalate", lambda s: s["escalation_rate"]),
+        ("p50 ms", lambda s: s["latency_ms"] and s["latency_ms"]["p50"]),
+        ("p95 ms", lambda s: s["latency_ms"] and s["latency_ms"]["p95"]),
+        ("$/image", lambda s: s["cost_usd_per_image"]),
+        ("IoU", lambda s: s.get("iou_mean")),
+        ("IoU ref", lambda s: s.get("iou_refined_mean")),
+        ("hit", lambda s: s.get("hit_rate")),
+        ("fields", lambda s: s.get("field_accuracy")),
+    ]
+    print(f"\n{'route':12}{'model':52}" + "".join(f"{title:>12}" for title, _ in columns))
+    for summary in summaries:
+        cells = []
+        for _, value in columns:
+            value = value(summary)
+            cells.append(f"{'-':>12}" if value is None else f"{value:>12.4g}")
+        print(f"{summary['route']:12}{summary['provider'] + '/' + summary['model']:52}" + "".join(cells))
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Evaluate crop and extraction models on a golden set")
+    parser.add_argument('--golden', default=DEFAULT_GOLDEN, help="Golden set JSON")
+    parser.add_argument('--images', help="Image directory (default: next to the golden set)")
+    parser.add_argument('--replay', help="Answer from a recording instead of calling the providers")
+    parser.add_argument('--record', help="Append the provider responses of a live run to this JSONL file")
+    parser.add_argument('--only', nargs='+', help="Only evaluate these provider/model names")
+    parser.add_argument('--add', nargs='+', default=[], metavar="ROUTE=PROVIDER/MODEL",
+                        help="Also evaluate a model that is not configured, e.g. crop=openai/gpt-4.1-nano")
+    parser.add_argument('--repeat', type=int, default=1, help="Runs per image and model")
+    parser.add_argument('--json', help="Write the full report to this JSON file")
+    parser.add_argument('--history', help="Append the summary to this JSONL file for trend tracking")
+    args = parser.parse_args()
+
+    with open(args.golden) as f:
+        golden = json.load(f)["images"]
+    added = []
+    for spec in args.add:
+        route, _, name = spec.partition("=")
+        provider, _, model = name.partition("/")
+        if route not in ROUTES or not model:
+            parser.error(f"Invalid --add {spec}: expected one of {ROUTES}=provider/model")
+        added.append((route, provider, model))
+
+    log = CallLog(load_recording(args.replay) if args.replay else None, args.record)
+    providers.get_client = log.get_client
+    summaries, items = evaluate(golden, args.images or os.path.dirname(os.path.abspath(args.golden)),
+                                log, set(args.only) if args.only else None, added, args.repeat)
+    print_table(summaries)
+
+    report = {
+        "generated_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "mode": "replay" if args.replay else "live",
+        "golden_set": os.path.abspath(args.golden),
+        "images": len(golden),
+        "repeat": args.repeat,
+        "prompts": active_versions(),
+        "results": summaries,
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(dict(report, items=items), f, indent=2)
+        print(f"\nReport written to {args.json}")
+    if args.history:
+        with open(args.history, 'a') as f:
+            f.write(json.dumps(report) + "\n")
+
+
+if __name__ == '__main__':
+    main()
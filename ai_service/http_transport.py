@@ -0,0 +1,130 @@
+"""
+Shared HTTP transport for the provider clients in AI Service
+
+The OpenAI and Together clients are built on one explicitly configured httpx
+client: a sized connection pool with keep-alive, optional HTTP/2 and separate
+connect/read/pool timeouts. Reusing warm connections saves the TCP and TLS
+handshakes that otherwise take a large share of small calls such as /verify.
+
+The transport traces every request to report pool statistics: active and idle
+connections, time spent waiting for a connection, and new connections and TLS
+handshakes with their durations.
+"""
+
+import logging
+import statistics
+import threading
+import time
+from collections import deque
+import httpx
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+_WAIT_WINDOW = 1000
+
+
+class TracedTransport(httpx.HTTPTransport):
+    """HTTP transport that records connection pool and handshake statistics."""
+
+    def __init__(self, http2=False, **kwargs):
+        super().__init__(http2=http2, **kwargs)
+        self.http2 = http2
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "errors": 0, "connections_opened": 0, "tls_handshakes": 0,
+                       "connect_ms_total": 0.0, "tls_ms_total": 0.0}
+        self._waits = deque(maxlen=_WAIT_WINDOW)
+
+    def handle_request(self, request):
+        start = time.perf_counter()
+        events = {}
+
+        def trace(name, info):
+            events[name] = time.perf_counter()
+
+        request.extensions = dict(request.extensions, trace=trace)
+        try:
+            return super().handle_request(request)
+        except Exception:
+            with self._lock:
+                self._stats["errors"] += 1
+            raise
+        finally:
+            self._record(start, events)
+
+    def _record(self, start, events):
+        connect = events.get("connection.connect_tcp.complete", 0) - events.get("connection.connect_tcp.started", 0)
+        tls = events.get("connection.start_tls.complete", 0) - events.get("connection.start_tls.started", 0)
+        sent = next((events[name] for name in ("http11.send_request_headers.started",
+                                               "http2.send_request_headers.started") if name in events), None)
+        with self._lock:
+            self._stats["requests"] += 1
+            if "connection.connect_tcp.complete" in events:
+                self._stats["connections_opened"] += 1
+                self._stats["connect_ms_total"] += connect * 1000
+            if "connection.start_tls.complete" in events:
+                self._stats["tls_handshakes"] += 1
+                self._stats["tls_ms_total"] += tls * 1000
+            if sent is not None:
+                # Time until the request could be sent, minus setting up a new connection
+                self._waits.append(max(0.0, (sent - start - connect - tls) * 1000))
+
+    def get_stats(self):
+        connections = list(self._pool.connections)
+        with self._lock:
+            stats = dict(self._stats)
+            waits = sorted(self._waits)
+        opened, handshakes = stats["connections_opened"], stats["tls_handshakes"]
+        stats.update({
+            "http2": self.http2,
+            "active": sum(1 for c in connections if not c.is_idle() and not c.is_closed()),
+            "idle": sum(1 for c in connections if c.is_idle()),
+            "connect_ms_total": round(stats["connect_ms_total"], 1),
+            "tls_ms_total": round(stats["tls_ms_total"], 1),
+            "connect_ms_mean": round(stats["connect_ms_total"] / opened, 1) if opened else None,
+            "tls_ms_mean": round(stats["tls_ms_total"] / handshakes, 1) if handshakes else None,
+            # Share of requests that reused a warm connection
+            "reuse_rate": round(1 - opened / stats["requests"], 4) if stats["requests"] else None,
+            "wait_ms": {
+                "p50": round(statistics.median(waits), 2),
+                "p95": round(waits[int(0.95 * (len(waits) - 1))], 2),
+                "max": round(waits[-1], 2),
+            } if waits else None,
+        })
+        return stats
+
+
+_transport = None
+
+
+def http2_available():
+    """Return True if the optional h2 package needed for HTTP/2 is installed."""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def build_http_client(max_connections, max_keepalive, keepalive_expiry, http2,
+                      connect_timeout, read_timeout, pool_timeout):
+    """Build the httpx client shared by the provider clients."""
+    global _transport
+    if http2 and not http2_available():
+        logger.warning("HTTP/2 requested but the h2 package is not installed, using HTTP/1.1")
+        http2 = False
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive,
+                          keepalive_expiry=keepalive_expiry)
+    _transport = TracedTransport(limits=limits, http2=http2)
+    return httpx.Client(transport=_transport,
+                        timeout=build_timeout(connect_timeout, read_timeout, pool_timeout))
+
+
+def build_timeout(connect_timeout, read_timeout, pool_timeout):
+    """Return the httpx timeout for provider calls; writes share the read timeout."""
+    return httpx.Timeout(read_timeout, connect=connect_timeout, pool=pool_timeout)
+
+
+def get_stats():
+    """Return the pool statistics of the shared transport, or None before it is built."""
+    return _transport.get_stats() if _transport is not None else None
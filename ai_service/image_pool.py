@@ -0,0 +1,128 @@
+"""
+Process pool for CPU-bound image work in AI Service
+
+Decoding, cropping and JPEG re-encoding hold the GIL, so a threaded server runs
+them one at a time across concurrent requests. Large images are handed to a pool
+of worker processes sized to the available cores instead. Image bytes travel
+through shared memory blocks; only block names and sizes are pickled.
+Small images and a disabled pool use the same functions in-process.
+
+Workers run image_worker.py, which imports no config or provider clients. They
+are spawned, and spawned processes re-import the main script, so the entry
+points (run.py, app.py) do not build the app when imported as __mp_main__.
+"""
+
+import atexit
+import base64
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+from utils import crop_pil_regions
+from image_worker import to_shared, take_shared, crop_regions
+from config import (IMAGE_POOL_ENABLED, IMAGE_POOL_WORKERS, IMAGE_POOL_MIN_BYTES, BBOX_REFINE_ENABLED,
+                    BBOX_REFINE_SIDE)
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def available_cores():
+    """Return the number of cores this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def get_pool():
+    """Return the shared worker pool, starting it on first use. None if disabled."""
+    global _pool
+    if not IMAGE_POOL_ENABLED:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            workers = IMAGE_POOL_WORKERS or available_cores()
+            # Spawned workers do not inherit the server's threads and locks
+            _pool = ProcessPoolExecutor(max_workers=workers,
+                                        mp_context=multiprocessing.get_context("spawn"))
+            atexit.register(_pool.shutdown)
+            logger.info(f"Started image worker pool with {workers} processes")
+        return _pool
+
+
+def crop_base64_regions(base64_image, bboxes, format="JPEG", refine=BBOX_REFINE_ENABLED):
+    """Crop several regions out of a base64 encoded image.
+
+    Same contract as utils.crop_image_regions on both paths: returns a list of
+    base64 encoded crops in the order of bboxes, with None for a region that
+    could not be cropped, or None if the image cannot be decoded. Images of at
+    least IMAGE_POOL_MIN_BYTES are processed in the worker pool; if the pool
+    fails, they are processed in-process. The boxes come from the models, so
+    they are refined by default.
+    """
+    try:
+        image_bytes = base64.b64decode(base64_image)
+    except Exception as e:
+        logger.error(f"Error converting base64 to image bytes: {e}")
+        return None
+    return crop_image_data_regions(image_bytes, bboxes, format, refine)
+
+
+def crop_image_data_regions(image_bytes, bboxes, format="JPEG", refine=BBOX_REFINE_ENABLED, image=None):
+    """Crop several regions out of already decoded image bytes, like crop_base64_regions.
+
+    image is the PIL image opened from image_bytes (utils.decode_base64_image),
+    if the caller has it; the in-process path crops it without opening the
+    bytes again.
+    """
+    pool = get_pool()
+    if pool is None or len(image_bytes) < IMAGE_POOL_MIN_BYTES:
+        return _crop_in_process(image_bytes, bboxes, format, refine, image)
+
+    try:
+        block = to_shared(image_bytes)
+    except Exception as e:
+        logger.error(f"Error copying image to shared memory: {e}")
+        return None
+    try:
+        # The block may be rounded up to a page size, so pass the real length
+        outputs = pool.submit(crop_regions, block.name, len(image_bytes), list(bboxes), format,
+                              BBOX_REFINE_SIDE if refine else None).result()
+    except Exception as e:
+        logger.warning(f"Error cropping image in worker pool, cropping in-process: {e}")
+        outputs = None
+    finally:
+        block.close()
+        block.unlink()
+    if outputs is None:
+        return _crop_in_process(image_bytes, bboxes, format, refine, image)
+    return [base64.b64encode(take_shared(name, size)).decode('utf-8') if name else None
+            for name, size in outputs]
+
+
+def _crop_in_process(image_bytes, bboxes, format, refine, image=None):
+    if image is None:
+        try:
+            image = Image.open(io.BytesIO(image_bytes))
+        except Exception as e:
+            logger.error(f"Error opening image: {e}")
+            return None
+    return crop_pil_regions(image, bboxes, format, refine, BBOX_REFINE_SIDE)
+
+
+def crop_base64_image(base64_image, bbox, format="JPEG", refine=BBOX_REFINE_ENABLED):
+    """Crop one region out of a base64 encoded image. Returns base64 data or None."""
+    crops = crop_base64_regions(base64_image, [bbox], format, refine)
+    return crops[0] if crops else None
+
+
+def crop_image_data(image_bytes, bbox, format="JPEG", refine=BBOX_REFINE_ENABLED, image=None):
+    """Crop one region out of already decoded image bytes. Returns base64 data or None."""
+    crops = crop_image_data_regions(image_bytes, [bbox], format, refine, image)
+    return crops[0] if crops else None
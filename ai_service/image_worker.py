@@ -0,0 +1,73 @@
+"""
+Worker process side of the image pool (image_pool.py)
+
+Spawned workers import this module, so it imports only PIL and the image
+helpers: no config, provider clients or Flask app.
+"""
+
+import io
+import logging
+from multiprocessing import shared_memory
+from PIL import Image
+from utils import crop_image
+from refine import refine_bboxes
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+def to_shared(data):
+    """Copy bytes into a new shared memory block. The caller owns (and unlinks) the block."""
+    block = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+    block.buf[:len(data)] = data
+    return block
+
+
+def take_shared(name, size):
+    """Read and unlink a shared memory block created by the other side."""
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        return bytes(block.buf[:size])
+    finally:
+        block.close()
+        block.unlink()
+
+
+def crop_regions(name, size, bboxes, format, refine_side):
+    """Crop regions out of the image in a shared block.
+
+    Returns [(block_name, size)] of the encoded crops in the order of bboxes,
+    with (None, 0) for a region that could not be cropped. Raises if the image
+    cannot be decoded.
+    """
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        image = Image.open(io.BytesIO(block.buf[:size]))
+        image.load()
+    finally:
+        block.close()
+
+    if refine_side:
+        bboxes = refine_bboxes(image, bboxes, refine_side)
+    results = []
+    try:
+        for bbox in bboxes:
+            try:
+                buffer = io.BytesIO()
+                crop_image(image, bbox).save(buffer, format=format)
+            except Exception as e:
+                logger.error(f"Error cropping region {bbox}: {e}")
+                results.append((None, 0))
+                continue
+            out = to_shared(buffer.getbuffer())
+            results.append((out.name, buffer.tell()))
+            out.close()
+    except Exception:
+        # Do not leak the blocks of crops made before the failure
+        for out_name, _ in results:
+            if out_name is not None:
+                leftover = shared_memory.SharedMemory(name=out_name)
+                leftover.close()
+                leftover.unlink()
+        raise
+    return results
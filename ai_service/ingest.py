@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Offline bulk ingest of cookbook photos.
+
+Walks directories and zip/tar archives of recipe photos, detects the cover of
+each one (and optionally extracts the recipe) and writes the results as
+streaming JSONL plus cropped image files. Decoding, downscaling and cropping run
+on a process pool; provider calls run with bounded async concurrency.
+
+Progress is recorded in a manifest so an interrupted run can be resumed without
+redoing finished items. Items finished with a prompt version that is no longer
+active are processed again. Each result line carries the item id; if an item is
+re-processed after a crash, the last line for that id wins.
+
+Usage:
+    python ingest.py <input> [<input> ...] --out <dir> [--extract] [--workers N] [--concurrency M]
+                     [--batch-api provider]
+"""
+
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import tarfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from PIL import Image
+from utils import base64_to_pil_image, pil_image_to_base64, crop_image, downscale_image
+from refine import refine_bbox
+from config import (INGEST_MAX_SIDE, INGEST_CONCURRENCY, BBOX_REFINE_ENABLED, BBOX_REFINE_SIDE,
+                    BATCH_API_CONCURRENCY)
+from scheduler import priority
+from batch_api import batch_mode, create_session
+from prompts import active_versions
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz')
+
+
+def _item_id(source):
+    """Return a stable id for an input item."""
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()[:16]
+
+
+def iter_items(inputs, skip=()):
+    """Yield (item_id, source, read) for every image in the given directories and archives.
+
+    read() returns the raw image bytes; it is called lazily so only in-flight items
+    are held in memory. Tar members can only be read in order, so they are read
+    while iterating, and the generator must be advanced by the thread that calls
+    read(). Items whose id is in skip are left out without being read.
+    """
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(IMAGE_EXTENSIONS):
+                        file_path = os.path.join(root, name)
+                        if _item_id(file_path) in skip:
+                            continue
+                        yield _item_id(file_path), file_path, (
+                            lambda file_path=file_path: open(file_path, 'rb').read())
+        elif path.lower().endswith('.zip'):
+            archive = zipfile.ZipFile(path)
+            for name in sorted(archive.namelist()):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    source = f"{path}:{name}"
+                    if _item_id(source) not in skip:
+                        yield _item_id(source), source, (lambda name=name: archive.read(name))
+        elif path.lower().endswith(ARCHIVE_EXTENSIONS):
+            # Streaming mode reads compressed archives front to back without seeking
+            with tarfile.open(path, 'r|*') as archive:
+                for member in archive:
+                    if member.isfile() and member.name.lower().endswith(IMAGE_EXTENSIONS):
+                        source = f"{path}:{member.name}"
+                        if _item_id(source) in skip:
+                            continue
+                        data = archive.extractfile(member).read()
+                        yield _item_id(source), source, (lambda data=data: data)
+        else:
+            logger.warning(f"Skipping unsupported input: {path}")
+
+
+def load_manifest(manifest_path, retry_failed):
+    """Return the ids of items already finished in a previous run with the active prompts."""
+    active = set(active_versions().values())
+    done = set()
+    if not os.path.exists(manifest_path):
+        return done
+    with open(manifest_path) as manifest:
+        for line in manifest:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # A crash can leave a partial last line
+                continue
+            if not active.issuperset(entry.get("prompts", [])):
+                # Results of an older prompt version are redone, like a cache miss
+                done.discard(entry["id"])
+            elif entry.get("status") == "ok" or not retry_failed:
+                done.add(entry["id"])
+    return done
+
+
+def preprocess(raw_bytes, max_side):
+    """Decode and downscale an image in a worker process. Returns base64 JPEG data."""
+    image = Image.open(io.BytesIO(raw_bytes))
+    return pil_image_to_base64(downscale_image(image, max_side))
+
+
+def crop_and_encode(image_data, bbox):
+    """Crop the cover out of a preprocessed image in a worker process. Returns JPEG bytes."""
+    image = base64_to_pil_image(image_data)
+    if BBOX_REFINE_ENABLED:
+        bbox = refine_bbox(image, bbox, side=BBOX_REFINE_SIDE) or bbox
+    cropped = crop_image(image, bbox)
+    buffer = io.BytesIO()
+    cropped.save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+class Ingest:
+    """Runs the ingest pipeline and owns its output files."""
+
+    def __init__(self, args, crop_module, extract_module):
+        self.args = args
+        self.crop_module = crop_module
+        self.extract_module = extract_module
+        self.image_dir = os.path.join(args.out, 'images')
+        os.makedirs(self.image_dir, exist_ok=True)
+        self.results = open(os.path.join(args.out, 'results.jsonl'), 'a')
+        self.manifest = open(os.path.join(args.out, 'manifest.jsonl'), 'a')
+        # Forked workers could inherit locks held by the reader and provider threads
+        self.process_pool = ProcessPoolExecutor(max_workers=args.workers,
+                                                mp_context=multiprocessing.get_context("spawn"))
+        # The input is iterated and archive members are read on this one thread only:
+        # zip and tar readers are not thread-safe
+        self.reader = ThreadPoolExecutor(max_workers=1)
+        self.provider_slots = asyncio.Semaphore(args.concurrency)
+        self.counts = {"ok": 0, "error": 0}
+
+    async def _provider_call(self, fn, *args):
+        """Run a blocking provider call in a thread, bounded by the concurrency limit."""
+        async with self.provider_slots:
+            return await asyncio.to_thread(fn, *args)
+
+    async def process(self, item_id, source, read):
+        """Run one item through the pipeline and record the result."""
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        record = {"id": item_id, "source": source}
+        try:
+            raw_bytes = await loop.run_in_executor(self.reader, read)
+            image_data = await loop.run_in_executor(
+                self.process_pool, preprocess, raw_bytes, self.args.max_side)
+
+            calls = [self._provider_call(self.crop_module.detect_cover, image_data)]
+            if self.args.extract:
+                calls.append(self._provider_call(self.extract_module.extract_recipe_data, image_data))
+            answers = await asyncio.gather(*calls)
+
+            crop_result, tier_info = answers[0]
+            cropped_bytes = await loop.run_in_executor(
+                self.process_pool, crop_and_encode, image_data, crop_result["bbox"])
+            image_path = os.path.join(self.image_dir, f"{item_id}.jpg")
+            await asyncio.to_thread(_write_file, image_path, cropped_bytes)
+
+            record.update({
+                "status": "ok",
+                "cover_type": crop_result.get("cover_type"),
+                "bbox": crop_result.get("bbox"),
+                "image_path": os.path.relpath(image_path, self.args.out),
+                "model_tier": tier_info,
+            })
+            if self.args.extract:
+                record["recipe"], record["extract_model_tier"] = answers[1]
+        except Exception as e:
+            logger.error(f"Failed to ingest {source}: {e}")
+            record.update({"status": "error", "error": str(e)})
+
+        record["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        self._finish(record)
+
+    def _finish(self, record):
+        """Append the result, then mark the item as done in the manifest."""
+        self.results.write(json.dumps(record) + "\n")
+        self.results.flush()
+        prompts = [tier["prompt"] for tier in (record.get("model_tier"), record.get("extract_model_tier"))
+                   if tier and "prompt" in tier]
+        self.manifest.write(json.dumps({"id": record["id"], "status": record["status"],
+                                        "prompts": prompts}) + "\n")
+        self.manifest.flush()
+        os.fsync(self.manifest.fileno())
+        self.counts[record["status"]] += 1
+
+    async def run(self, items):
+        # Bound the number of in-flight items so memory stays flat for large inputs
+        in_flight = asyncio.Semaphore(self.args.concurrency * 2)
+        tasks = set()
+        loop = asyncio.get_running_loop()
+        items = iter(items)
+
+        async def guarded(item):
+            try:
+                await self.process(*item)
+            finally:
+                in_flight.release()
+
+        while True:
+            await in_flight.acquire()
+            # Advance the input on the reader thread, which also runs every read()
+            item = await loop.run_in_executor(self.reader, next, items, None)
+            if item is None:
+                in_flight.release()
+                break
+            task = asyncio.create_task(guarded(item))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    def close(self):
+        self.process_pool.shutdown()
+        self.reader.shutdown()
+        self.results.close()
+        self.manifest.close()
+
+
+def _write_file(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk ingest of cookbook photos")
+    parser.add_argument('inputs', nargs='+', help="Directories, .zip or .tar archives of images")
+    parser.add_argument('--out', required=True, help="Output directory")
+    parser.add_argument('--extract', action='store_true', help="Also extract the recipe of each image")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help="Processes for decoding and cropping (default: CPU count)")
+    parser.add_argument('--concurrency', type=int,
+                        help="Concurrent provider calls (default: INGEST_CONCURRENCY, "
+                             "or BATCH_API_CONCURRENCY with --batch-api)")
+    parser.add_argument('--max-side', type=int, default=INGEST_MAX_SIDE,
+                        help="Longest side in pixels of images sent to the provider")
+    parser.add_argument('--batch-api', choices=['provider', 'local'],
+                        help="Send provider calls in provider batch jobs (local: synchronous stand-in)")
+    parser.add_argument('--retry-failed', action='store_true',
+                        help="Re-process items that failed in a previous run")
+    args = parser.parse_args()
+
+    # Provider modules are only needed in the parent process
+    from routes import crop_module, extract
+    from providers import get_client
+
+    session = None
+    if args.batch_api:
+        session = create_session(args.batch_api, get_client)
+    if args.concurrency is None:
+        # Jobs are filled with the calls of the items in flight
+        args.concurrency = BATCH_API_CONCURRENCY if args.batch_api else INGEST_CONCURRENCY
+
+    os.makedirs(args.out, exist_ok=True)
+    done = load_manifest(os.path.join(args.out, 'manifest.jsonl'), args.retry_failed)
+    if done:
+        logger.info(f"Resuming: {len(done)} items already finished")
+    items = iter_items(args.inputs, done)
+
+    ingest = Ingest(args, crop_module, extract)
+    start = time.perf_counter()
+
+    async def run():
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=args.concurrency + 4))
+        # Provider calls of every item task inherit the bulk class
+        with priority("bulk"), batch_mode(session):
+            await ingest.run(items)
+
+    try:
+        asyncio.run(run())
+    finally:
+        ingest.close()
+        if session is not None:
+            session.close()
+            logger.info(f"Batch API: {session.get_stats()}")
+
+    elapsed = time.perf_counter() - start
+    total = sum(ingest.counts.values())
+    logger.info(
+        f"Ingested {total} items in {elapsed:.1f} s ({ingest.counts['ok']} ok, "
+        f"{ingest.counts['error']} failed)")
+
+
+if __name__ == '__main__':
+    main()
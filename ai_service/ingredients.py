@@ -0,0 +1,416 @@
+"""
+Local ingredient parsing and scaling for AI Service
+
+Turns free-text ingredient lines from the extraction models into quantity,
+unit and item, without a provider call. Handles integers, decimals, fractions
+("1/2", "1 1/2", "½", "1½"), number words, ranges ("2-3", "2 to 3"), pack sizes
+("2 x 150g duck breasts", "1 (400g) tin"), equivalent amounts ("1 cup (240 ml)")
+and unit synonyms. Parsed lines can be scaled to another number of servings and
+converted between metric and US units.
+
+One compiled regular expression does the parsing, so tens of thousands of lines
+are parsed per second.
+"""
+
+import logging
+import re
+from functools import lru_cache
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+VULGAR_FRACTIONS = {
+    "½": 1 / 2, "⅓": 1 / 3, "⅔": 2 / 3, "¼": 1 / 4, "¾": 3 / 4, "⅕": 1 / 5, "⅖": 2 / 5, "⅗": 3 / 5,
+    "⅘": 4 / 5, "⅙": 1 / 6, "⅚": 5 / 6, "⅛": 1 / 8, "⅜": 3 / 8, "⅝": 5 / 8, "⅞": 7 / 8,
+}
+NUMBER_WORDS = {
+    "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7,
+    "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12, "half": 0.5, "a dozen": 12, "dozen": 12,
+}
+
+# Canonical unit: (kind, size in ml or g, synonyms). Count units have no size
+UNITS = {
+    "tsp": ("volume", 4.92892, ["teaspoons", "teaspoon", "tsps", "tsp"]),
+    "tbsp": ("volume", 14.7868, ["tablespoons", "tablespoon", "tbsps", "tbsp", "tbs", "tbl"]),
+    "cup": ("volume", 236.588, ["cups", "cup", "c"]),
+    "fl oz": ("volume", 29.5735, ["fluid ounces", "fluid ounce", "fl. oz", "fl oz", "floz"]),
+    "pint": ("volume", 473.176, ["pints", "pint", "pt"]),
+    "quart": ("volume", 946.353, ["quarts", "quart", "qt"]),
+    "gallon": ("volume", 3785.41, ["gallons", "gallon", "gal"]),
+    "ml": ("volume", 1.0, ["milliliters", "milliliter", "millilitres", "millilitre", "ml"]),
+    "cl": ("volume", 10.0, ["centiliters", "centiliter", "centilitres", "centilitre", "cl"]),
+    "dl": ("volume", 100.0, ["deciliters", "deciliter", "decilitres", "decilitre", "dl"]),
+    "l": ("volume", 1000.0, ["liters", "liter", "litres", "litre", "l"]),
+    "mg": ("mass", 0.001, ["milligrams", "milligram", "mg"]),
+    "g": ("mass", 1.0, ["grams", "gram", "grammes", "gramme", "gr", "g"]),
+    "kg": ("mass", 1000.0, ["kilograms", "kilogram", "kilos", "kilo", "kg"]),
+    "oz": ("mass", 28.3495, ["ounces", "ounce", "oz"]),
+    "lb": ("mass", 453.592, ["pounds", "pound", "lbs", "lb"]),
+    "pinch": ("count", None, ["pinches", "pinch"]),
+    "dash": ("count", None, ["dashes", "dash"]),
+    "clove": ("count", None, ["cloves", "clove"]),
+    "can": ("count", None, ["cans", "can"]),
+    "tin": ("count", None, ["tins", "tin"]),
+    "jar": ("count", None, ["jars", "jar"]),
+    "packet": ("count", None, ["packets", "packet", "packages", "package", "pkgs", "pkg", "packs", "pack"]),
+    "bunch": ("count", None, ["bunches", "bunch"]),
+    "sprig": ("count", None, ["sprigs", "sprig"]),
+    "slice": ("count", None, ["slices", "slice"]),
+    "piece": ("count", None, ["pieces", "piece", "pcs", "pc"]),
+    "stick": ("count", None, ["sticks", "stick"]),
+    "handful": ("count", None, ["handfuls", "handful"]),
+    "head": ("count", None, ["heads", "head"]),
+    "stalk": ("count", None, ["stalks", "stalk"]),
+    "sheet": ("count", None, ["sheets", "sheet"]),
+}
+# Plural display names of count units
+_PLURALS = {"pinch": "pinches", "dash": "dashes", "bunch": "bunches", "cup": "cups"}
+# Items whose plural does not follow the regular rules, and the way back
+IRREGULAR_PLURALS = {
+    "leaf": "leaves", "loaf": "loaves", "half": "halves", "potato": "potatoes", "tomato": "tomatoes",
+    "mango": "mangoes", "chili": "chilies", "chilli": "chillies", "cookie": "cookies", "brownie": "brownies",
+    "pie": "pies",
+}
+_SINGULARS = {plural: singular for singular, plural in IRREGULAR_PLURALS.items()}
+
+_SYNONYMS = {synonym: unit for unit, (_, _, synonyms) in UNITS.items() for synonym in synonyms}
+# "T" is a tablespoon and "t" a teaspoon; every other unit is matched case-insensitively
+_UNIT = "(?:" + "|".join(re.escape(s).replace(r"\ ", r"\s*") for s in sorted(_SYNONYMS, key=len, reverse=True)) \
+        + r"|(?-i:[tT]))\.?(?![^\W\d_])"
+# Units that hold a pack size written before them, as in "2 14 oz cans"
+_CONTAINER = r"(?:cans|can|tins|tin|jars|jar)\b"
+_FRACTIONS = "".join(VULGAR_FRACTIONS)
+_NUMBER = (rf"(?:\d+\s+\d+\s*[/⁄]\s*\d+|\d+\s*[{_FRACTIONS}]|\d+\s*[/⁄]\s*\d+|\d{{1,3}}(?:,\d{{3}})+(?!\d)"
+           rf"|\d+(?:[.,]\d+)?|[{_FRACTIONS}]"
+           rf"|(?:a\s+dozen|dozen|one|two|three|four|five|six|seven|eight|nine|ten|eleven|twelve|half)\b"
+           rf"|an?(?=\s+(?:{_UNIT}|\d+\s*-?\s*{_UNIT}\s*{_CONTAINER})))")
+_MODIFIERS = r"heaped|heaping|level|rounded|scant|generous|good|large|small|medium|big"
+
+_LINE = re.compile(
+    rf"""^\s*(?:[-•*·–]\s+)?
+    (?:(?P<qty>{_NUMBER})(?:\s*(?:-|–|—|to|or)\s*(?P<qty_max>{_NUMBER}))?
+       (?:\s*[x×]\s*(?P<size_qty>{_NUMBER})\s*(?P<size_unit>{_UNIT})
+        |\s+(?=\d)(?P<container_qty>{_NUMBER})\s*-?\s*(?P<container_unit>{_UNIT})(?=\s*{_CONTAINER}))?
+       \s*(?:\((?P<paren>[^)]*)\)\s*)?
+       (?:an?\s+)?
+       (?:(?P<modifier>{_MODIFIERS})\s+(?={_UNIT}))?
+       (?P<unit>{_UNIT})?
+       (?:\s+of\b)?
+    )?
+    \s*(?P<rest>.*?)\s*$""",
+    re.IGNORECASE | re.VERBOSE | re.DOTALL)
+_PAREN_SIZE = re.compile(rf"^\s*(?P<qty>{_NUMBER})\s*(?P<unit>{_UNIT})\s*$", re.IGNORECASE)
+_PAREN_REST = re.compile(r"^\((?P<paren>[^)]*)\)\s*(?P<rest>.*)$", re.DOTALL)
+_CONTAINER_REST = re.compile(rf"^(?P<unit>{_CONTAINER})\s*(?P<rest>.*)$", re.IGNORECASE | re.DOTALL)
+# Last word of an item, before a trailing parenthesis: the word that takes the plural
+_HEAD_WORD = re.compile(r"^(.*?)([^\W\d_]+)(\s*\(.*\))?$", re.DOTALL)
+_MIXED = re.compile(r"(\d+)\s+(\d+)\s*[/⁄]\s*(\d+)")
+_FRACTION = re.compile(r"(\d+)\s*[/⁄]\s*(\d+)")
+
+
+def parse_number(text):
+    """Return the value of a quantity token, e.g. "1 1/2", "1½", "0,5", "three"."""
+    text = text.strip()
+    lower = text.lower()
+    if lower in NUMBER_WORDS:
+        return float(NUMBER_WORDS[lower])
+    if lower.startswith("a") and lower.endswith("dozen"):
+        return 12.0
+    if text[-1] in VULGAR_FRACTIONS:
+        whole = text[:-1].strip()
+        return (float(whole) if whole else 0.0) + VULGAR_FRACTIONS[text[-1]]
+    match = _MIXED.fullmatch(text)
+    if match:
+        return int(match.group(1)) + int(match.group(2)) / int(match.group(3))
+    match = _FRACTION.fullmatch(text)
+    if match:
+        return int(match.group(1)) / int(match.group(2)) if int(match.group(2)) else None
+    if re.fullmatch(r"\d{1,3}(?:,\d{3})+", text):
+        return float(text.replace(",", ""))
+    return float(text.replace(",", "."))
+
+
+def canonical_unit(text):
+    """Return the canonical name of a unit synonym, e.g. "Tablespoons" -> "tbsp"."""
+    if text is None:
+        return None
+    text = text.rstrip(".")
+    if text in ("t", "T"):
+        return "tsp" if text == "t" else "tbsp"
+    return _SYNONYMS.get(re.sub(r"\s+", " ", text.lower()).replace("fl. oz", "fl oz"))
+
+
+def _unparsed(line, rest):
+    """Return the parse of a line without a usable quantity: the whole text is the item."""
+    item, _, note = rest.partition(",")
+    return {"quantity": None, "quantity_max": None, "unit": None, "unit_word": None, "item": item.strip(),
+            "note": note.strip() or None, "size": None, "alt": None, "modifier": None, "raw": line}
+
+
+def _unit_word(unit, text):
+    """Return the unit as written, for count units whose display keeps the recipe's word."""
+    if unit is None or UNITS[unit][0] != "count":
+        return None
+    return " ".join(text.rstrip(".").lower().split())
+
+
+def _amount(text):
+    """Return {"quantity", "unit", "unit_word"} of a bracketed amount such as "240 ml", or None."""
+    match = _PAREN_SIZE.match(text)
+    if not match or parse_number(match.group("qty")) is None:
+        return None
+    unit = canonical_unit(match.group("unit"))
+    return {"quantity": parse_number(match.group("qty")), "unit": unit,
+            "unit_word": _unit_word(unit, match.group("unit"))}
+
+
+def parse_ingredient(line):
+    """Parse an ingredient line into a dict.
+
+    Returns quantity and quantity_max (None unless a range), the canonical unit
+    and, for count units, the unit as written ("packages"), the item, a note
+    (text after the first comma), the pack size of lines such as "2 x 150g duck
+    breasts", "1 (400g) tin tomatoes" or "12 oz can tomatoes", the equivalent
+    amount in brackets after a unit ("1 cup (240 ml) milk") as alt, and a size
+    modifier ("heaped"). Lines without a quantity, or with one that has no value
+    ("1/0"), keep the whole text as the item.
+    """
+    match = _LINE.match(line)
+    groups = match.groupdict()
+    quantity = quantity_max = size = None
+    if groups["qty"]:
+        quantity = parse_number(groups["qty"])
+        if groups["qty_max"]:
+            quantity_max = parse_number(groups["qty_max"])
+            if quantity_max is None:
+                return _unparsed(line, line.strip())
+        if quantity is None:
+            return _unparsed(line, line.strip())
+        size_qty = groups["size_qty"] or groups["container_qty"]
+        if size_qty:
+            size = {"quantity": parse_number(size_qty),
+                    "unit": canonical_unit(groups["size_unit"] or groups["container_unit"])}
+            if size["quantity"] is None:
+                return _unparsed(line, line.strip())
+    unit = canonical_unit(groups["unit"])
+    unit_word = _unit_word(unit, groups["unit"])
+
+    rest = groups["rest"]
+    paren = groups["paren"]
+    if paren is not None:
+        paren_size = _amount(paren)
+        if paren_size and size is None:
+            size = {"quantity": paren_size["quantity"], "unit": paren_size["unit"]}
+        else:
+            rest = f"({paren}) {rest}"
+
+    # An amount in brackets after the unit is the pack size of a container ("1 can (14 oz)"),
+    # otherwise the same amount in other units ("1 cup (240 ml)", "1 cup (2 sticks)")
+    alt = None
+    after_unit = _PAREN_REST.match(rest) if unit is not None and rest.startswith("(") else None
+    amount = _amount(after_unit.group("paren")) if after_unit else None
+    if amount:
+        if size is None and _CONTAINER_REST.match(unit_word or ""):
+            size = {"quantity": amount["quantity"], "unit": amount["unit"]}
+        elif amount["unit"] != unit:
+            alt = amount
+        if size is not None or alt is not None:
+            rest = after_unit.group("rest")
+
+    # "12 oz can tomatoes" is one can of 12 oz, like "1 (12 oz) can tomatoes"
+    container = (size is None and alt is None and quantity_max is None and unit is not None
+                 and UNITS[unit][0] != "count" and _CONTAINER_REST.match(rest))
+    if container:
+        size = {"quantity": quantity, "unit": unit}
+        quantity, unit, rest = 1.0, canonical_unit(container.group("unit")), container.group("rest")
+        unit_word = _unit_word(unit, container.group("unit"))
+
+    item, _, note = rest.partition(",")
+    return {
+        "quantity": quantity,
+        "quantity_max": quantity_max,
+        "unit": unit,
+        "unit_word": unit_word,
+        "item": item.strip(),
+        "note": note.strip() or None,
+        "size": size,
+        "alt": alt,
+        "modifier": groups["modifier"].lower() if groups["modifier"] else None,
+        "raw": line,
+    }
+
+
+def parse_ingredients(lines):
+    """Parse a list of ingredient lines; entries that are not strings are skipped."""
+    return [parse_ingredient(line) for line in lines or [] if isinstance(line, str)]
+
+
+def _metric_unit(kind, amount):
+    """Return (unit, amount) in the metric unit that reads best for an amount in ml or g."""
+    if kind == "volume":
+        return ("l", amount / 1000) if amount >= 1000 else ("ml", amount)
+    return ("kg", amount / 1000) if amount >= 1000 else ("g", amount)
+
+
+def _us_unit(kind, amount):
+    """Return (unit, amount) in the US unit that reads best for an amount in ml or g."""
+    if kind == "volume":
+        for unit in ("cup", "tbsp"):
+            if amount >= UNITS[unit][1] * (0.25 if unit == "cup" else 1):
+                return unit, amount / UNITS[unit][1]
+        return "tsp", amount / UNITS["tsp"][1]
+    if amount >= UNITS["lb"][1]:
+        return "lb", amount / UNITS["lb"][1]
+    return "oz", amount / UNITS["oz"][1]
+
+
+def convert(quantity, unit, system):
+    """Convert a quantity to the "metric" or "us" system. Returns (quantity, unit).
+
+    Count units and US units are kept in the US system; teaspoons and
+    tablespoons stay as they are in metric recipes, other metric amounts are
+    moved between g and kg, ml and l.
+    """
+    if quantity is None or unit not in UNITS or system is None:
+        return quantity, unit
+    kind, size, _ = UNITS[unit]
+    if kind == "count" or (system == "metric" and unit in ("tsp", "tbsp", "mg")):
+        return quantity, unit
+    if system == "us" and unit in ("tsp", "tbsp", "cup", "fl oz", "pint", "quart", "gallon", "oz", "lb"):
+        return quantity, unit
+    pick = _metric_unit if system == "metric" else _us_unit
+    new_unit, _ = pick(kind, quantity * size)
+    return quantity * size / UNITS[new_unit][1], new_unit
+
+
+def format_quantity(value, unit=None):
+    """Return a readable quantity: fractions for US and count units, rounded decimals for metric."""
+    if value is None:
+        return None
+    if unit in ("ml", "g", "mg", "cl", "dl", "l", "kg"):
+        if value >= 100:
+            value = round(value / 5) * 5
+        elif value >= 10:
+            value = round(value)
+        else:
+            value = round(value, 1)
+        return f"{value:g}"
+    whole = int(value)
+    remainder = value - whole
+    for fraction, text in ((0, ""), (1 / 8, "⅛"), (1 / 4, "¼"), (1 / 3, "⅓"), (3 / 8, "⅜"), (1 / 2, "½"),
+                           (5 / 8, "⅝"), (2 / 3, "⅔"), (3 / 4, "¾"), (7 / 8, "⅞"), (1, "")):
+        if abs(remainder - fraction) < 0.05:
+            whole += fraction == 1
+            if not text:
+                return str(whole)
+            return f"{whole}{text}" if whole else text
+    return f"{round(value, 2):g}"
+
+
+def _unit_text(unit, quantity, word=None):
+    if unit is None or UNITS[unit][0] != "count" and unit != "cup":
+        return unit
+    plural = quantity is not None and quantity > 1
+    if word:
+        # The recipe's own word, so "2 packages" does not turn into "2 packets"
+        return _inflect_unit(word, plural)
+    return _PLURALS.get(unit, unit + "s") if plural else unit
+
+
+def _is_plural(parsed):
+    quantity = parsed["quantity_max"] or parsed["quantity"]
+    return quantity is not None and quantity > 1
+
+
+def inflect(item, plural):
+    """Return an item with its last word in the plural or singular, e.g. "red onion" -> "red onions"."""
+    match = _HEAD_WORD.match(item)
+    if not match:
+        return item
+    head, word, tail = match.groups()
+    lower = word.lower()
+    if plural:
+        if lower in IRREGULAR_PLURALS:
+            new = IRREGULAR_PLURALS[lower]
+        elif lower in _SINGULARS or lower.endswith("s"):
+            # Already plural, or a word such as "asparagus" that keeps its form
+            return item
+        elif lower.endswith(("ch", "sh", "x", "z")):
+            new = word + "es"
+        elif lower.endswith("y") and lower[-2:-1] not in ("a", "e", "i", "o", "u", ""):
+            new = word[:-1] + "ies"
+        else:
+            new = word + "s"
+    else:
+        if lower in _SINGULARS:
+            new = _SINGULARS[lower]
+        elif lower.endswith("ies") and len(lower) > 4:
+            new = word[:-3] + "y"
+        elif lower.endswith(("ches", "shes", "xes", "zes")):
+            new = word[:-2]
+        elif lower.endswith("s") and not lower.endswith(("ss", "us", "is")):
+            new = word[:-1]
+        else:
+            return item
+    if word[0].isupper():
+        new = new[0].upper() + new[1:]
+    return f"{head}{new}{tail or ''}"
+
+
+# Unit words repeat across lines, so their inflections are worth keeping
+_inflect_unit = lru_cache(maxsize=256)(inflect)
+
+
+def format_ingredient(parsed):
+    """Return the ingredient line of a parsed (and possibly scaled) ingredient.
+
+    Lines without a quantity are returned as they were written.
+    """
+    if parsed["quantity"] is None:
+        if parsed.get("raw"):
+            return parsed["raw"].strip()
+        return f"{parsed['item']}, {parsed['note']}" if parsed["note"] else parsed["item"]
+    parts = [format_quantity(parsed["quantity"], parsed["unit"])]
+    if parsed["quantity_max"] is not None:
+        parts[0] += "-" + format_quantity(parsed["quantity_max"], parsed["unit"])
+    if parsed["size"]:
+        size = parsed["size"]
+        parts.append(f"x {format_quantity(size['quantity'], size['unit'])}{size['unit'] or ''}")
+    if parsed["modifier"]:
+        parts.append(parsed["modifier"])
+    unit = _unit_text(parsed["unit"], parsed["quantity_max"] or parsed["quantity"], parsed.get("unit_word"))
+    if unit:
+        parts.append(unit)
+    if parsed.get("alt"):
+        alt = parsed["alt"]
+        alt_unit = _unit_text(alt["unit"], alt["quantity"], alt["unit_word"])
+        parts.append(f"({format_quantity(alt['quantity'], alt['unit'])} {alt_unit})")
+    if parsed["item"]:
+        parts.append(parsed["item"])
+    text = " ".join(parts)
+    return f"{text}, {parsed['note']}" if parsed["note"] else text
+
+
+def scale_ingredient(parsed, factor=1.0, system=None):
+    """Return a copy of a parsed ingredient scaled by factor and converted to a unit system.
+
+    Pack sizes ("2 x 150g") stay as they are; only the count of packs is scaled.
+    An equivalent amount ("1 cup (240 ml)") is scaled along, and dropped when
+    converting to a unit system. Items counted without a unit take the plural or
+    singular of the new count ("1 lemon" -> "2 lemons"). The result carries the
+    formatted line in "text".
+    """
+    scaled = dict(parsed)
+    unit = parsed["unit"]
+    for key in ("quantity", "quantity_max"):
+        if parsed[key] is not None:
+            scaled[key], unit = convert(parsed[key] * factor, parsed["unit"], system)
+    scaled["unit"] = unit
+    if unit != parsed["unit"]:
+        scaled["unit_word"] = None
+    if parsed.get("alt"):
+        scaled["alt"] = None if system else dict(parsed["alt"], quantity=parsed["alt"]["quantity"] * factor)
+    if unit is None and parsed["quantity"] is not None and _is_plural(scaled) != _is_plural(parsed):
+        scaled["item"] = inflect(parsed["item"], _is_plural(scaled))
+    scaled["text"] = format_ingredient(scaled)
+    return scaled
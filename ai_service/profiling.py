@@ -0,0 +1,205 @@
+"""
+Per-request CPU and allocation profiling for AI Service
+"""
+
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import tracemalloc
+import uuid
+from flask import request, g
+from config import (PROFILE_SAMPLE_RATE, PROFILE_DIR, PROFILE_TRACE_DEPTH,
+                    PROFILE_SOAK_INTERVAL)
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Only one request is profiled at a time: tracemalloc snapshots are process-wide,
+# so overlapping profiles would attribute each other's allocations
+_profile_lock = threading.Lock()
+_soak_thread = None
+
+# Allocations made by the profiler itself are not interesting
+_SNAPSHOT_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, cProfile.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+]
+
+
+def _should_profile():
+    """Decide whether the current request should be profiled."""
+    header = request.headers.get('X-Profile', '').strip().lower()
+    if header in ('1', 'true', 'yes'):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _route_name():
+    """Return a filesystem-safe name for the current route."""
+    rule = request.url_rule.rule if request.url_rule else request.path
+    return re.sub(r'[^A-Za-z0-9]+', '_', rule).strip('_') or 'root'
+
+
+def _current_rss_kb():
+    """Return the resident set size of this process in kilobytes."""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    # Fall back to the peak RSS on platforms without /proc
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _format_snapshot_diff(snapshot, baseline, limit=25):
+    """Format the largest allocation differences between two snapshots."""
+    snapshot = snapshot.filter_traces(_SNAPSHOT_FILTERS)
+    baseline = baseline.filter_traces(_SNAPSHOT_FILTERS)
+    stats = snapshot.compare_to(baseline, 'lineno')
+    lines = [str(stat) for stat in stats[:limit]]
+    total = sum(stat.size_diff for stat in stats)
+    lines.append(f"Total allocation change: {total / 1024:.1f} KiB")
+    return "\n".join(lines)
+
+
+def _write_profile(profile_id, request_id, route, profiler, snapshot_before,
+                   snapshot_after, elapsed):
+    """Write the CPU profile and allocation report for a request.
+
+    File names use the server-generated profile ID only; the client-supplied
+    request ID is recorded inside the report.
+    """
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base_path = os.path.join(PROFILE_DIR, f"{profile_id}_{route}")
+
+    # Raw pstats data, loadable with pstats/snakeviz for deeper analysis
+    profiler.dump_stats(f"{base_path}.prof")
+
+    cpu_report = io.StringIO()
+    pstats.Stats(profiler, stream=cpu_report).sort_stats('cumulative').print_stats(30)
+
+    with open(f"{base_path}.txt", 'w') as report:
+        report.write(f"Profile ID: {profile_id}\n")
+        report.write(f"Request ID: {request_id or '-'}\n")
+        report.write(f"Route: {request.method} {request.path}\n")
+        report.write(f"Wall time: {elapsed * 1000:.1f} ms\n")
+        report.write(f"RSS: {_current_rss_kb()} KiB\n\n")
+        report.write("=== CPU profile (top 30 by cumulative time) ===\n")
+        report.write(cpu_report.getvalue())
+        report.write("\n=== Allocations during request (top 25 by size) ===\n")
+        report.write(_format_snapshot_diff(snapshot_after, snapshot_before))
+        report.write("\n")
+
+    logger.info(f"Profile for request {profile_id} written to {base_path}.txt")
+
+
+def _start_profile():
+    """Start CPU and allocation profiling for the current request."""
+    if not _should_profile():
+        return
+    # Skip rather than wait if another request is already being profiled
+    if not _profile_lock.acquire(blocking=False):
+        logger.info("Profiler busy, skipping profile for this request")
+        return
+
+    g.profile_id = uuid.uuid4().hex[:12]
+    g.profile_request_id = request.headers.get('X-Request-ID', '')[:200]
+    g.profile_started_tracemalloc = not tracemalloc.is_tracing()
+    if g.profile_started_tracemalloc:
+        tracemalloc.start(PROFILE_TRACE_DEPTH)
+    g.profile_snapshot = tracemalloc.take_snapshot()
+    g.profile_start = time.perf_counter()
+    g.profiler = cProfile.Profile()
+    g.profiler.enable()
+
+
+def _stop_profile(exc=None):
+    """Stop profiling the current request and write the results."""
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return
+    try:
+        profiler.disable()
+        elapsed = time.perf_counter() - g.profile_start
+        snapshot_after = tracemalloc.take_snapshot()
+        if g.profile_started_tracemalloc and not _soak_running():
+            tracemalloc.stop()
+        _write_profile(g.profile_id, g.profile_request_id, _route_name(), profiler,
+                       g.profile_snapshot, snapshot_after, elapsed)
+    except Exception as e:
+        logger.error(f"Error writing request profile: {e}")
+    finally:
+        _profile_lock.release()
+
+
+def _soak_running():
+    return _soak_thread is not None and _soak_thread.is_alive()
+
+
+def _soak_monitor(interval):
+    """Periodically compare heap snapshots to detect leaks in long-running workers."""
+    baseline = tracemalloc.take_snapshot()
+    previous = baseline
+    iteration = 0
+    while True:
+        time.sleep(interval)
+        iteration += 1
+        try:
+            snapshot = tracemalloc.take_snapshot()
+            traced, peak = tracemalloc.get_traced_memory()
+            rss = _current_rss_kb()
+            logger.info(
+                f"Soak snapshot {iteration}: RSS={rss} KiB, "
+                f"traced={traced / 1024:.1f} KiB, peak={peak / 1024:.1f} KiB")
+
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = os.path.join(PROFILE_DIR, f"soak_{os.getpid()}_{iteration:04d}.txt")
+            with open(path, 'w') as report:
+                report.write(f"Snapshot {iteration} after {iteration * interval} s\n")
+                report.write(f"RSS: {rss} KiB\n")
+                report.write(f"Traced: {traced / 1024:.1f} KiB (peak {peak / 1024:.1f} KiB)\n\n")
+                report.write("=== Growth since previous snapshot ===\n")
+                report.write(_format_snapshot_diff(snapshot, previous))
+                report.write("\n\n=== Growth since start ===\n")
+                report.write(_format_snapshot_diff(snapshot, baseline))
+                report.write("\n")
+            previous = snapshot
+        except Exception as e:
+            logger.error(f"Error taking soak snapshot: {e}")
+
+
+def start_soak_monitor(interval=PROFILE_SOAK_INTERVAL):
+    """Start the background heap-growth monitor used for soak tests."""
+    global _soak_thread
+    if interval <= 0 or _soak_running():
+        return
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(PROFILE_TRACE_DEPTH)
+    _soak_thread = threading.Thread(target=_soak_monitor, args=(interval,),
+                                    name="soak-monitor", daemon=True)
+    _soak_thread.start()
+    logger.info(f"Soak monitor started, snapshot interval {interval} s")
+
+
+def register_profiling(app):
+    """Register the profiling hooks with the Flask app"""
+    app.before_request(_start_profile)
+
+    @app.after_request
+    def _add_profile_header(response):
+        if 'profiler' in g:
+            response.headers['X-Profile-Id'] = g.profile_id
+        return response
+
+    app.teardown_request(_stop_profile)
+    start_soak_monitor()
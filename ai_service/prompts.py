@@ -0,0 +1,216 @@
+"""
+Versioned prompt registry for AI Service
+
+Routes load their prompts by name through get_prompt(); the version used is the
+latest registered one unless PROMPT_VERSIONS pins another. build_messages() lays
+every call out the same way: the static system instructions first, then any
+fixed user text, then the images. The static part is byte-identical across calls
+of a prompt version, so provider-side prompt caching can reuse it.
+"""
+
+import logging
+from collections import namedtuple
+from config import PROMPT_VERSIONS
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class Prompt(namedtuple("Prompt", ["name", "version", "system", "user"])):
+    """A registered prompt: system instructions and optional fixed user text."""
+
+    @property
+    def id(self):
+        """Name and version, e.g. "extract@v1"; part of any key for cached results."""
+        return f"{self.name}@{self.version}"
+
+
+EXTRACT_INSTRUCTIONS = """
+Please extract the following information from this recipe image:
+1. Recipe title
+2. Brief description
+3. Cooking time in minutes
+4. Difficulty level (easy, medium, hard)
+5. Ingredients (as a list)
+6. Instructions (as numbered steps)
+7. Servings
+8. Your confidence that the extraction is complete and correct (0 to 1)
+
+Format your response as a valid JSON object with the following keys:
+{
+  "title": "string",
+  "description": "string",
+  "cookingTimeMinutes": number,
+  "difficulty": "string",
+  "ingredients": ["string"],
+  "instructions": ["string"],
+  "servings": number,
+  "confidence": number
+}
+
+Only return the JSON object, no additional text.
+"""
+
+# Prompt versions by name. Never edit a registered version: add a new one, so
+# results and cache entries can always be traced to the exact text used.
+PROMPTS = {
+    "verify": {
+        "v1": {
+            "system": "Does this image contain a recipe? A recipe typically includes ingredients and instructions for preparing a dish. Answer with only 'yes' or 'no'.",
+        },
+    },
+    # The extract variants share the same system instructions, so they also share
+    # a cached prefix; only the short user text differs
+    "extract": {
+        "v1": {
+            "system": EXTRACT_INSTRUCTIONS,
+        },
+    },
+    "extract_multi_page": {
+        "v1": {
+            "system": EXTRACT_INSTRUCTIONS,
+            "user": """
+The attached images are consecutive pages of a single recipe, in page order
+(for example the photo and ingredients on one page and the method on the next).
+Merge them into one recipe.
+""",
+        },
+    },
+    "extract_tile": {
+        "v1": {
+            "system": EXTRACT_INSTRUCTIONS,
+            "user": """
+This image is one tile cut from a larger photo of a recipe page. Neighbouring tiles overlap it.
+Only extract text that is fully visible in this tile, do not guess text that is cut off at the edges.
+Use an empty string, 0 or an empty list for any field that is not visible in this tile.
+""",
+        },
+    },
+    "extract_multi": {
+        "v1": {
+            "system": """
+This image may contain several recipes, for example a cookbook spread or a magazine page.
+For every recipe on the page, in reading order, extract:
+1. Recipe title
+2. Brief description
+3. Cooking time in minutes
+4. Difficulty level (easy, medium, hard)
+5. Ingredients (as a list)
+6. Instructions (as numbered steps)
+7. Servings
+8. Your confidence that the extraction is complete and correct (0 to 1)
+9. The cover image of the recipe: "dish_photo" with the bounding box of the picture of the finished dish if the recipe has one, otherwise "title_crop" with the bounding box of the recipe title
+
+Bounding box coordinates must be normalized to a scale of 0 to 1000, where 0 is the top/left edge and 1000 is the bottom/right edge of the image.
+
+Format your response as a valid JSON object of the form {"recipes": [...]}, where each recipe has the keys
+title, description, cookingTimeMinutes, difficulty, ingredients, instructions, servings, confidence, cover_type and bbox (with ymin, xmin, ymax, xmax).
+
+Only return the JSON object, no additional text.
+""",
+        },
+    },
+    "crop": {
+        "v1": {
+            "system": "You are responsible for extracting the cover image of the recipe included in the image attached. If a section of the image contains an image of the finished dish crop the image to identify the picture of the dish. Otherwise crop the image to extract the title of the recipe. Return the cropped image.",
+        },
+    },
+    "crop_candidates": {
+        "v1": {
+            "system": "You are responsible for proposing cover images for the recipe included in the image attached. Return up to three candidates, best first: if a section of the image contains a picture of the finished dish, a crop of the dish photo; a crop of the recipe title; and any other section that would make a good cover. For each candidate give its cover type, its bounding box and your confidence that the box tightly contains it.",
+        },
+    },
+    "crop_llama": {
+        "v1": {
+            "system": "You are a helpful assistant specialized in image analysis. You will be given a recipe image. Your task is to identify the main dish or recipe title in the image and provide normalized coordinates to crop it. You should return a JSON object with the cover_type (either 'dish_photo' or 'title_crop') and the bounding box coordinates using normalized values from 0 to 1000.",
+            "user": """
+Please analyze this recipe image and provide a JSON object with the following format:
+{
+    "cover_type": "dish_photo", // Use "dish_photo" if you find a picture of the prepared dish, or "title_crop" if you find the title of the recipe
+    "bbox": {
+        "xmin": 100, // The x-coordinate of the top-left corner (value between 0-1000)
+        "ymin": 200, // The y-coordinate of the top-left corner (value between 0-1000)
+        "xmax": 400, // The x-coordinate of the bottom-right corner (value between 0-1000)
+        "ymax": 600  // The y-coordinate of the bottom-right corner (value between 0-1000)
+    },
+    "confidence": 0.9 // Your confidence that the box tightly contains the selected cover (value between 0-1)
+}
+
+IMPORTANT: All bbox coordinates must be normalized values between 0 and 1000, where 0 represents the top/left edge and 1000 represents the bottom/right edge of the image.
+Remember to provide only the JSON object with no additional text.
+""",
+        },
+    },
+    "crop_llama_candidates": {
+        "v1": {
+            "system": "You are a helpful assistant specialized in image analysis. You will be given a recipe image. Your task is to propose up to three cover images for the recipe, best first: the picture of the prepared dish if there is one, and the recipe title. You should return a JSON object with a list of candidates, each with the cover_type (either 'dish_photo' or 'title_crop'), the bounding box coordinates using normalized values from 0 to 1000 and a confidence.",
+            "user": """
+Please analyze this recipe image and provide a JSON object with the following format:
+{
+    "candidates": [
+        {
+            "cover_type": "dish_photo", // "dish_photo" for a picture of the prepared dish, "title_crop" for the title of the recipe
+            "bbox": {"xmin": 100, "ymin": 200, "xmax": 400, "ymax": 600}, // values between 0-1000
+            "confidence": 0.9 // Your confidence that the box tightly contains the cover (value between 0-1)
+        },
+        {
+            "cover_type": "title_crop",
+            "bbox": {"xmin": 50, "ymin": 20, "xmax": 950, "ymax": 120},
+            "confidence": 0.8
+        }
+    ]
+}
+
+IMPORTANT: All bbox coordinates must be normalized values between 0 and 1000, where 0 represents the top/left edge and 1000 represents the bottom/right edge of the image.
+Remember to provide only the JSON object with no additional text.
+""",
+        },
+    },
+    "analyze": {
+        "v1": {
+            "system": """You analyze photos of recipes. For the attached image:
+1. Decide whether it contains a recipe. A recipe typically includes ingredients and instructions for preparing a dish.
+2. If it does, extract the title, a brief description, the cooking time in minutes, the difficulty level (easy, medium, hard), the ingredients (as a list), the instructions (as numbered steps) and the number of servings.
+3. Select the cover image of the recipe. If a section of the image contains a picture of the finished dish, return the bounding box of the dish photo. Otherwise return the bounding box of the recipe title.
+Bounding box coordinates must be normalized to a scale of 0 to 1000, where 0 is the top/left edge and 1000 is the bottom/right edge of the image.
+Report the result by calling the analyze_recipe_image function.""",
+        },
+    },
+}
+
+
+def _version_key(version):
+    return int(version.lstrip("v"))
+
+
+def get_prompt(name, version=None):
+    """Return a registered prompt: the given version, the pinned one or the latest."""
+    versions = PROMPTS.get(name)
+    if not versions:
+        raise KeyError(f"Unknown prompt: {name}")
+    version = version or PROMPT_VERSIONS.get(name) or max(versions, key=_version_key)
+    if version not in versions:
+        raise KeyError(f"Unknown version {version} of prompt {name}")
+    template = versions[version]
+    return Prompt(name, version, template.get("system"), template.get("user"))
+
+
+def active_versions():
+    """Return the prompt id used for every registered prompt name."""
+    return {name: get_prompt(name).id for name in PROMPTS}
+
+
+def build_messages(prompt, images=()):
+    """Return chat messages for a prompt and base64 JPEG images, static part first."""
+    messages = []
+    if prompt.system:
+        messages.append({"role": "system", "content": prompt.system})
+    content = [{"type": "text", "text": prompt.user}] if prompt.user else []
+    content += [{
+        "type": "image_url",
+        "image_url": {
+            "url": f"data:image/jpeg;base64,{image_data}"
+        }
+    } for image_data in images]
+    messages.append({"role": "user", "content": content})
+    return messages
@@ -0,0 +1,44 @@
+"""
+Provider access helpers for AI Service
+"""
+
+import logging
+from config import openai_client, together_client
+from scheduler import scheduler
+from breaker import guarded_call
+from batch_api import current_session
+import usage
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+def get_client(provider):
+    """Return the client for a provider name ("openai" or "together")."""
+    if provider == "together":
+        if together_client is None:
+            raise RuntimeError("Together client is not initialized. Please check API key.")
+        return together_client
+    return openai_client
+
+
+def chat_completion(provider, model, prompt_id=None, **kwargs):
+    """Call the chat completions API of a provider in a slot of the current priority class.
+
+    The model is called as given; callers pick it with usage.budget_model first, so
+    their own stats name the model that ran. The token usage of every call is
+    recorded, per prompt_id if given.
+    Raises breaker.CircuitOpenError without waiting for a slot if the circuit of
+    the provider/model is open. In batch mode (batch_api.batch_mode) the call is
+    sent in a provider batch job instead, outside the slots and breakers.
+    """
+    client = get_client(provider)
+    session = current_session()
+    if session is not None:
+        response = session.submit(provider, model, kwargs)
+        usage.record(provider, model, kwargs.get("messages", []), response, prompt_id, batch=True)
+        return response
+    response = guarded_call(provider, model, lambda: client.chat.completions.create(model=model, **kwargs),
+                            scheduler.slot)
+    usage.record(provider, model, kwargs.get("messages", []), response, prompt_id)
+    return response
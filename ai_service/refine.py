@@ -0,0 +1,162 @@
+"""
+Bounding box refinement for AI Service
+
+Boxes proposed by the vision models are often loose (page margin around the dish
+photo) or clip it. Each side of a box is snapped to the strongest straight edge
+nearby, such as a photo border or the edge of the page, found with gradient
+profiles on a small downscaled copy. Degenerate boxes (swapped, out of range or
+zero-size coordinates) are repaired first instead of being discarded.
+"""
+
+import logging
+import numpy as np
+from PIL import Image
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+KEYS = ['ymin', 'xmin', 'ymax', 'xmax']
+# Longest side of the downscaled copy edges are measured on. The service passes
+# config.BBOX_REFINE_SIDE; this module does not import config, so image workers
+# and benchmarks can use it without building the provider clients
+DEFAULT_SIDE = 384
+# Smallest box side after repair, in normalized (0-1000) units
+MIN_SIZE = 20
+# Each side is searched this share of the box size inwards and outwards, but at
+# least MIN_SEARCH normalized units
+SEARCH = 0.25
+MIN_SEARCH = 40
+# Mean grey-level step along a side that counts as a real edge. Photo borders
+# step along their whole length; text only along a few of its pixels
+MIN_EDGE = 12.0
+# Edges further away from the proposed side must be this much stronger, at the
+# end of the search window, than an edge right at the side
+DISTANCE_PENALTY = 0.5
+# Snapping one axis changes the span the other one is measured on
+PASSES = 2
+
+
+class EdgeMaps:
+    """Gradient profiles of a downscaled grey copy of an image.
+
+    Holds cumulative sums of the horizontal and vertical grey-level steps, so the
+    mean edge strength of any column or row segment is a subtraction.
+    """
+
+    def __init__(self, image, side=DEFAULT_SIDE):
+        scale = min(1.0, side / max(image.size))
+        size = (max(2, round(image.width * scale)), max(2, round(image.height * scale)))
+        if scale < 0.5:
+            # Point-sample at twice the size and average 2x2 blocks: a filtered
+            # resize of a 12 MP photo alone would take longer than the budget
+            small = image.resize((size[0] * 2, size[1] * 2), Image.NEAREST).reduce(2)
+        else:
+            small = image.resize(size, Image.BILINEAR)
+        small = small.convert("L")
+        gray = np.asarray(small, dtype=np.float32)
+        self.height, self.width = gray.shape
+        # Step between columns x and x + 1, summed down the rows
+        steps_x = np.abs(np.diff(gray, axis=1))
+        self.cum_x = np.vstack((np.zeros((1, steps_x.shape[1]), np.float32), steps_x.cumsum(axis=0)))
+        # Step between rows y and y + 1, summed along the columns
+        steps_y = np.abs(np.diff(gray, axis=0))
+        self.cum_y = np.hstack((np.zeros((steps_y.shape[0], 1), np.float32), steps_y.cumsum(axis=1)))
+
+    def column_profile(self, top, bottom):
+        """Mean step at every column boundary between rows top and bottom (pixels)."""
+        return (self.cum_x[bottom] - self.cum_x[top]) / max(1, bottom - top)
+
+    def row_profile(self, left, right):
+        """Mean step at every row boundary between columns left and right (pixels)."""
+        return (self.cum_y[:, right] - self.cum_y[:, left]) / max(1, right - left)
+
+
+def repair_bbox(bbox):
+    """Return a valid normalized bbox close to bbox, or None if it has no usable numbers.
+
+    Swapped coordinates are reordered, coordinates are clamped to 0-1000 and
+    sides shorter than MIN_SIZE are widened around their centre.
+    """
+    if not isinstance(bbox, dict) or not all(k in bbox for k in KEYS):
+        return None
+    try:
+        ymin, xmin, ymax, xmax = (float(bbox[k]) for k in KEYS)
+    except (TypeError, ValueError):
+        return None
+    if not all(np.isfinite([ymin, xmin, ymax, xmax])):
+        return None
+
+    def axis(low, high):
+        low, high = sorted((min(max(low, 0.0), 1000.0), min(max(high, 0.0), 1000.0)))
+        if high - low < MIN_SIZE:
+            centre = min(max((low + high) / 2, MIN_SIZE / 2), 1000.0 - MIN_SIZE / 2)
+            low, high = centre - MIN_SIZE / 2, centre + MIN_SIZE / 2
+        return low, high
+
+    ymin, ymax = axis(ymin, ymax)
+    xmin, xmax = axis(xmin, xmax)
+    return {"ymin": ymin, "xmin": xmin, "ymax": ymax, "xmax": xmax}
+
+
+def _snap(profile, position, window, low, high):
+    """Return the pixel boundary in [low, high] with the best distance-weighted edge near position.
+
+    profile[i] is the step between pixels i and i + 1, i.e. at boundary i + 1.
+    Returns position unchanged when there is no edge of at least MIN_EDGE.
+    """
+    start, end = max(low, position - window, 1), min(high, position + window, len(profile))
+    if end < start:
+        return position
+    boundaries = np.arange(start, end + 1)
+    strength = profile[boundaries - 1]
+    score = strength * (1.0 - DISTANCE_PENALTY * np.abs(boundaries - position) / max(1, window))
+    best = int(np.argmax(score))
+    if strength[best] < MIN_EDGE:
+        return position
+    return int(boundaries[best])
+
+
+def refine_bbox(image, bbox, maps=None, side=DEFAULT_SIDE):
+    """Return bbox (normalized 0-1000) repaired and snapped to nearby image edges.
+
+    Pass EdgeMaps to reuse them for several boxes of the same image; otherwise
+    they are computed on a copy downscaled to side. Returns None only if bbox
+    has no usable coordinates.
+    """
+    box = repair_bbox(bbox)
+    if box is None:
+        return None
+    maps = maps or EdgeMaps(image, side)
+    width, height = maps.width, maps.height
+    # Work in pixel boundaries of the downscaled copy
+    left, right = round(box["xmin"] * width / 1000), round(box["xmax"] * width / 1000)
+    top, bottom = round(box["ymin"] * height / 1000), round(box["ymax"] * height / 1000)
+    min_width = max(1, round(MIN_SIZE * width / 1000))
+    min_height = max(1, round(MIN_SIZE * height / 1000))
+    right, bottom = max(right, left + min_width), max(bottom, top + min_height)
+    window_x = max(round(SEARCH * (right - left)), round(MIN_SEARCH * width / 1000))
+    window_y = max(round(SEARCH * (bottom - top)), round(MIN_SEARCH * height / 1000))
+
+    for _ in range(PASSES):
+        columns = maps.column_profile(top, bottom)
+        left = _snap(columns, left, window_x, 0, right - min_width)
+        right = _snap(columns, right, window_x, left + min_width, width)
+        rows = maps.row_profile(left, right)
+        top = _snap(rows, top, window_y, 0, bottom - min_height)
+        bottom = _snap(rows, bottom, window_y, top + min_height, height)
+
+    return {
+        "ymin": round(top * 1000 / height, 1),
+        "xmin": round(left * 1000 / width, 1),
+        "ymax": round(bottom * 1000 / height, 1),
+        "xmax": round(right * 1000 / width, 1),
+    }
+
+
+def refine_bboxes(image, bboxes, side=DEFAULT_SIDE):
+    """Refine several boxes of one image, computing its edge maps once.
+
+    Boxes without usable coordinates are returned unchanged.
+    """
+    maps = EdgeMaps(image, side)
+    return [refine_bbox(image, bbox, maps) or bbox for bbox in bboxes]
@@ -0,0 +1,122 @@
+"""
+Text-region detection for AI Service
+
+Finds the dominant text block of a recipe photo so /extract can send only that
+region instead of the whole photo (dish picture, table, facing page). Works on a
+small downscaled copy: edge density and colour saturation per cell mark likely
+text, and projection profiles over those cells give the region bounds.
+"""
+
+import logging
+import numpy as np
+from PIL import Image
+from config import ROI_ANALYSIS_SIDE, ROI_MIN_AREA, ROI_MAX_AREA, ROI_MARGIN
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Analysis cell size in pixels of the downscaled copy
+CELL = 8
+# Printed text is dark on light paper: strong edges, little colour
+EDGE_THRESHOLD = 40
+MIN_EDGE_DENSITY = 0.06
+MAX_EDGE_DENSITY = 0.45
+MAX_SATURATION = 60
+# Rows and columns need this share of the busiest one to belong to the core of
+# the region; once the core is known, sparser lines inside its band (titles,
+# short ingredient lines) are added with the lower threshold
+CORE_THRESHOLD = 0.35
+EXPAND_THRESHOLD = 0.2
+# Gaps (in cells) bridged inside the region, e.g. between title and ingredients
+MAX_GAP = 8
+
+
+def _longest_run(profile, threshold, max_gap):
+    """Return (start, end) of the longest run above threshold, bridging small gaps."""
+    above = np.flatnonzero(profile >= threshold)
+    if above.size == 0:
+        return None
+    # Split wherever consecutive active indices are further apart than max_gap
+    breaks = np.flatnonzero(np.diff(above) > max_gap + 1)
+    starts = np.concatenate(([above[0]], above[breaks + 1]))
+    ends = np.concatenate((above[breaks], [above[-1]]))
+    # Pick the run holding the most mass, not just the widest one
+    masses = [profile[s:e + 1].sum() for s, e in zip(starts, ends)]
+    best = int(np.argmax(masses))
+    return int(starts[best]), int(ends[best]) + 1
+
+
+def text_cell_mask(image):
+    """Return a boolean grid marking cells of the downscaled image that look like text."""
+    scale = min(1.0, ROI_ANALYSIS_SIDE / max(image.size))
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    small = image.resize(size, Image.BILINEAR, reducing_gap=2.0).convert("RGB")
+
+    rgb = np.asarray(small, dtype=np.int16)
+    gray = rgb.mean(axis=2)
+    saturation = rgb.max(axis=2) - rgb.min(axis=2)
+
+    # Edges in both directions, so rotated pages are handled too
+    edges = np.zeros(gray.shape, dtype=bool)
+    edges[:, 1:] |= np.abs(np.diff(gray, axis=1)) > EDGE_THRESHOLD
+    edges[1:, :] |= np.abs(np.diff(gray, axis=0)) > EDGE_THRESHOLD
+
+    rows, cols = gray.shape[0] // CELL, gray.shape[1] // CELL
+    if rows == 0 or cols == 0:
+        return None
+
+    def cell_mean(values):
+        values = values[:rows * CELL, :cols * CELL]
+        return values.reshape(rows, CELL, cols, CELL).mean(axis=(1, 3))
+
+    density = cell_mean(edges.astype(np.float32))
+    colour = cell_mean(saturation.astype(np.float32))
+    return (density >= MIN_EDGE_DENSITY) & (density <= MAX_EDGE_DENSITY) & (colour <= MAX_SATURATION)
+
+
+def text_density(image):
+    """Return the share of cells of the downscaled image that look like text (0-1)."""
+    mask = text_cell_mask(image)
+    return float(mask.mean()) if mask is not None else 0.0
+
+
+def find_text_region(image):
+    """Return the normalized (0-1000) bbox of the dominant text region, or None.
+
+    None means no confident region was found and the full image should be used.
+    """
+    mask = text_cell_mask(image)
+    if mask is None or not mask.any():
+        return None
+
+    row_profile = mask.sum(axis=1).astype(np.float32)
+    col_profile = mask.sum(axis=0).astype(np.float32)
+    rows = _longest_run(row_profile, CORE_THRESHOLD * row_profile.max(), max_gap=MAX_GAP)
+    cols = _longest_run(col_profile, CORE_THRESHOLD * col_profile.max(), max_gap=MAX_GAP)
+    if rows is None or cols is None:
+        return None
+
+    # Re-measure each axis only within the other axis' core band, so clutter
+    # beside the text (photos, the facing page) no longer dilutes the profile
+    row_profile = mask[:, cols[0]:cols[1]].sum(axis=1).astype(np.float32)
+    col_profile = mask[rows[0]:rows[1], :].sum(axis=0).astype(np.float32)
+    rows = _longest_run(row_profile, EXPAND_THRESHOLD * row_profile.max(), max_gap=MAX_GAP)
+    cols = _longest_run(col_profile, EXPAND_THRESHOLD * col_profile.max(), max_gap=MAX_GAP)
+
+    height, width = mask.shape
+    ymin = max(0.0, rows[0] / height - ROI_MARGIN)
+    ymax = min(1.0, rows[1] / height + ROI_MARGIN)
+    xmin = max(0.0, cols[0] / width - ROI_MARGIN)
+    xmax = min(1.0, cols[1] / width + ROI_MARGIN)
+
+    area = (ymax - ymin) * (xmax - xmin)
+    if area < ROI_MIN_AREA or area > ROI_MAX_AREA:
+        logger.info(f"Text region covers {area:.0%} of the image, using full image")
+        return None
+
+    return {
+        "ymin": round(ymin * 1000),
+        "xmin": round(xmin * 1000),
+        "ymax": round(ymax * 1000),
+        "xmax": round(xmax * 1000),
+    }
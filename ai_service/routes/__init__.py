@@ -14,7 +14,7 @@ from config import AI_PROVIDER
 logger = logging.getLogger(__name__)
 
 # Import common routes
-from . import verify, extract
+from . import verify, extract, analyze, duplicates, scale, stats
 
 # Conditionally import the appropriate crop module based on AI_PROVIDER
 if AI_PROVIDER == "together":
@@ -28,8 +28,16 @@ else:
     logger.info("Using OpenAI implementation for crop route")
     from . import crop as crop_module
 
+# The batch route dispatches to the crop module selected above
+from . import batch
+
 def register_routes(app):
     """Register all routes with the Flask app"""
     verify.register_route(app)
     extract.register_route(app)
-    crop_module.register_route(app)
\ No newline at end of file
+    analyze.register_route(app)
+    crop_module.register_route(app)
+    batch.register_route(app)
+    duplicates.register_route(app)
+    scale.register_route(app)
+    stats.register_route(app)
@@ -0,0 +1,146 @@
+"""
+Fused analysis route module for AI Service
+
+Verifies, extracts and locates the cover image of a recipe with a single model
+call, instead of the three separate calls made by /verify, /extract and /crop.
+"""
+
+import logging
+from flask import request, jsonify
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import decode_base64_image
+from image_pool import crop_image_data
+from config import OPENAI_ANALYZE_MODEL, STRUCTURED_OUTPUT_RETRIES
+from providers import chat_completion
+from usage import budget_model
+from prompts import get_prompt, build_messages
+from schemas import ANALYSIS_SCHEMA, StructuredOutputError, strict_tool, request_structured
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Recipe fields returned by /extract
+REQUIRED_RECIPE_FIELDS = [
+    "title", "description", "cookingTimeMinutes", "difficulty", "ingredients",
+    "instructions", "servings"
+]
+
+ANALYZE_TOOL = strict_tool(
+    "analyze_recipe_image",
+    "Report whether the image contains a recipe, the extracted recipe and the bounding box of its cover image",
+    ANALYSIS_SCHEMA)
+
+
+def analyze_image(image_data):
+    """Run the fused analysis call and return the parsed analysis.
+
+    Raises StructuredOutputError if no valid analysis can be parsed from the
+    response, even after repair and retries.
+    """
+    prompt = get_prompt("analyze")
+    model = budget_model(OPENAI_ANALYZE_MODEL)
+
+    def call():
+        response = chat_completion(
+            "openai",
+            model,
+            prompt_id=prompt.id,
+            messages=build_messages(prompt, [image_data]),
+            tools=[ANALYZE_TOOL],
+            tool_choice={"type": "function", "function": {"name": "analyze_recipe_image"}},
+        )
+
+        message = response.choices[0].message
+        if not getattr(message, 'tool_calls', None):
+            logger.warning("No tool calls in response")
+            return None
+        return message.tool_calls[0].function.arguments
+
+    return request_structured(call, ANALYSIS_SCHEMA, model, STRUCTURED_OUTPUT_RETRIES)
+
+
+def register_route(app):
+
+    @app.route('/analyze', methods=['POST'])
+    def analyze_recipe_image():
+        """Verify, extract and crop a recipe image with a single model call."""
+        logger.info("Received request to analyze recipe image")
+        try:
+            # Get the base64 encoded image from the request
+            data = request.json
+            if not data or 'image' not in data:
+                return jsonify({
+                    "success": False,
+                    "error": "No image provided"
+                }), 400
+
+            image_data = data['image']
+            # Decode once to validate the image; the crop below reuses the decoded image
+            image_bytes, pil_image = decode_base64_image(image_data)
+            if image_bytes is None:
+                return jsonify({
+                    "success": False,
+                    "error": "Invalid image format"
+                }), 400
+            if not pil_image:
+                return jsonify({
+                    "success": False,
+                    "error": "Failed to process image"
+                }), 400
+
+            try:
+                analysis = analyze_image(image_data)
+            except StructuredOutputError as parse_error:
+                logger.error(f"Could not parse analysis response: {parse_error}")
+                return jsonify({
+                    "success": False,
+                    "error": "Could not parse analysis from image"
+                }), 400
+
+            is_recipe = bool(analysis.get('is_recipe'))
+            if not is_recipe:
+                return jsonify({
+                    "success": True,
+                    "is_recipe": False,
+                    "message": "No recipe found in the image"
+                })
+
+            recipe_data = analysis.get('recipe') or {}
+            missing_fields = [
+                field for field in REQUIRED_RECIPE_FIELDS
+                if field not in recipe_data
+            ]
+            if missing_fields:
+                return jsonify({
+                    "success": False,
+                    "error": f"Missing required fields: {', '.join(missing_fields)}"
+                }), 400
+
+            cover_type = analysis.get('cover_type', 'title_crop')
+            bbox = analysis.get('bbox', {})
+            logger.info(f"Detected bounding box: {bbox}")
+            logger.info(f"Cover type: {cover_type}")
+
+            # Crop locally from the same response, no further model calls needed
+            cropped_base64 = crop_image_data(image_bytes, bbox, image=pil_image)
+            if not cropped_base64:
+                return jsonify({
+                    "success": False,
+                    "error": "Failed to convert cropped image to base64"
+                }), 500
+
+            return jsonify({
+                "success": True,
+                "is_recipe": True,
+                "message": "Recipe detected",
+                "recipe": recipe_data,
+                "cover_type": cover_type,
+                "cropped_image": cropped_base64
+            })
+
+        except Exception as e:
+            logger.error(f"Error analyzing recipe image: {e}")
+            return jsonify({"success": False, "error": str(e)}), 500
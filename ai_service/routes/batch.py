@@ -0,0 +1,188 @@
+"""
+Batch route module for AI Service
+
+POST /batch/<route> runs /verify, /extract or /crop over many images with a
+bounded number of concurrent provider calls. Results are streamed back as
+newline-delimited JSON in completion order, one line per item, followed by a
+summary line. A failing item is reported on its own line and does not fail the
+batch.
+"""
+
+import base64
+import contextvars
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import request, jsonify, Response, stream_with_context
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils import is_valid_base64_image
+from image_pool import crop_base64_regions
+from config import BATCH_CONCURRENCY, BATCH_MAX_CONCURRENCY, BATCH_MAX_ITEMS, BATCH_STORE_DIR
+from scheduler import current_class
+from . import verify, extract, crop_module
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+def _verify_item(image_data):
+    is_recipe = verify.verify_image(image_data)
+    return {"is_recipe": is_recipe}
+
+
+def _extract_item(image_data):
+    # Same ROI, tiling and dedup stages as a single /extract call
+    return extract.extract_image_recipe(image_data)
+
+
+def _crop_item(image_data):
+    # Like /crop, an image whose cover cannot be determined is returned whole
+    crop_result, tier_info, fallback = crop_module.detect_cover_or_original(image_data, crop_module.detect_cover)
+    if fallback:
+        return fallback
+    # The crop decodes the image; None means it could not be decoded at all
+    crops = crop_base64_regions(image_data, [crop_result.get("bbox", {})])
+    if crops is None:
+        raise ValueError("Failed to process image")
+    cropped_base64 = crops[0]
+    if not cropped_base64:
+        raise ValueError("Failed to convert cropped image to base64")
+    return {
+        "cover_type": crop_result.get("cover_type", "title_crop"),
+        "cropped_image": cropped_base64,
+        "model_tier": tier_info
+    }
+
+
+BATCH_HANDLERS = {
+    "verify": _verify_item,
+    "extract": _extract_item,
+    "crop": _crop_item,
+}
+
+
+def _load_ref(ref):
+    """Read an image from the local store as base64. Refs may not leave the store."""
+    store = os.path.realpath(BATCH_STORE_DIR)
+    path = os.path.realpath(os.path.join(store, ref))
+    if os.path.commonpath([store, path]) != store:
+        raise ValueError(f"Invalid image reference: {ref}")
+    with open(path, 'rb') as f:
+        return base64.b64encode(f.read()).decode('utf-8')
+
+
+def _invalid_item():
+    raise ValueError("Item must be an object")
+
+
+def _collect_items():
+    """Return [(item_id, load)] from a multipart upload or a JSON item list.
+
+    load() returns the base64 image; references into the store are read lazily
+    by the worker that processes them. Items without an image and entries that
+    are not objects fail on their own line instead of failing the batch.
+
+    Raises ValueError if the JSON body is not an object or items is not a list.
+    """
+    if request.files:
+        items = []
+        for index, upload in enumerate(request.files.getlist('images') or request.files.values()):
+            image_data = base64.b64encode(upload.read()).decode('utf-8')
+            items.append((upload.filename or str(index), lambda image_data=image_data: image_data))
+        return items
+
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict) or not isinstance(data.get('items', []), list):
+        raise ValueError("items must be a list of objects")
+    items = []
+    for index, item in enumerate(data.get('items', [])):
+        if not isinstance(item, dict):
+            items.append((str(index), _invalid_item))
+            continue
+        item_id = str(item.get('id', index))
+        if 'image' in item:
+            items.append((item_id, lambda image_data=item['image']: image_data))
+        elif 'ref' in item:
+            items.append((item_id, lambda ref=item['ref']: _load_ref(ref)))
+        else:
+            items.append((item_id, None))
+    return items
+
+
+def _process_item(handler, item_id, load):
+    """Run one batch item, turning any failure into a per-item error result."""
+    start = time.perf_counter()
+    try:
+        if load is None:
+            raise ValueError("No image provided")
+        image_data = load()
+        if not is_valid_base64_image(image_data):
+            raise ValueError("Invalid image format")
+        result = {"id": item_id, "success": True}
+        result.update(handler(image_data))
+    except Exception as e:
+        logger.error(f"Batch item {item_id} failed: {e}")
+        result = {"id": item_id, "success": False, "error": str(e)}
+    result["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return result
+
+
+def register_route(app):
+    @app.route('/batch/<route>', methods=['POST'])
+    def batch(route):
+        """Process many images for one route and stream per-item results."""
+        handler = BATCH_HANDLERS.get(route)
+        if handler is None:
+            return jsonify({
+                "success": False,
+                "error": f"Unsupported batch route: {route}"
+            }), 404
+
+        try:
+            items = _collect_items()
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+        if not items:
+            return jsonify({
+                "success": False,
+                "error": "No images provided"
+            }), 400
+        if len(items) > BATCH_MAX_ITEMS:
+            return jsonify({
+                "success": False,
+                "error": f"Too many items (maximum {BATCH_MAX_ITEMS})"
+            }), 400
+
+        concurrency = min(request.args.get('concurrency', BATCH_CONCURRENCY, type=int),
+                          BATCH_MAX_CONCURRENCY)
+        logger.info(f"Received batch of {len(items)} items for /{route} "
+                    f"(concurrency {concurrency}, priority {current_class()})")
+
+        def generate():
+            start = time.perf_counter()
+            succeeded = 0
+            executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
+            try:
+                # Items run with the request's priority class and usage tags
+                futures = [executor.submit(contextvars.copy_context().run, _process_item, handler, item_id, load)
+                           for item_id, load in items]
+                # Yield each result as soon as it finishes, not after the slowest
+                for future in as_completed(futures):
+                    result = future.result()
+                    succeeded += result["success"]
+                    yield json.dumps(result) + "\n"
+                yield json.dumps({
+                    "done": True,
+                    "total": len(items),
+                    "succeeded": succeeded,
+                    "failed": len(items) - succeeded,
+                    "elapsed_ms": round((time.perf_counter() - start) * 1000, 1)
+                }) + "\n"
+            finally:
+                # Stop queued work if the client goes away mid-stream
+                executor.shutdown(wait=False, cancel_futures=True)
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
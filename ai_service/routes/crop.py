@@ -2,19 +2,228 @@
 Crop route module for AI Service
 """
 
-import json
 import logging
 from flask import request, jsonify
 import sys
 import os
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from utils import is_valid_base64_image, base64_to_pil_image, pil_image_to_base64, crop_image
-from config import openai_client, OPENAI_CROP_MODEL
+from utils import decode_base64_image
+from image_pool import crop_image_data, crop_image_data_regions
+from providers import chat_completion
+from prompts import get_prompt, build_messages
+from cascade import run_cascade, check_bbox, low_confidence
+from breaker import serve_stale
+from schemas import CROP_SCHEMA, CROP_CANDIDATES_SCHEMA, strict_tool, request_structured
+from config import STRUCTURED_OUTPUT_RETRIES, CROP_MAX_CANDIDATES, CROP_CANDIDATE_MAX_IOU
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+CROP_TOOL = strict_tool(
+    "crop_image",
+    "Crop an image based on the bounding box coordinates provided in the format [ymin, xmin, ymax, xmax]. Note the input coordinates must be normalized to a scale of 0 to 1000",
+    CROP_SCHEMA)
+
+CANDIDATES_TOOL = strict_tool(
+    "propose_crops",
+    "Propose ranked cover crops of an image, best first, each with bounding box coordinates normalized to a scale of 0 to 1000",
+    CROP_CANDIDATES_SCHEMA)
+
+
+def request_crop_box(image_data, tier, prompt_name="crop", tool=CROP_TOOL, schema=CROP_SCHEMA):
+    """Ask a model tier for the cover bounding box via function calling.
+
+    Returns the parsed tool arguments. Raises StructuredOutputError if the
+    response does not contain a usable call of the tool, even after retries.
+    """
+    prompt = get_prompt(prompt_name)
+    tool_name = tool["function"]["name"]
+
+    def call():
+        # Use the chat.completions.create API with function calling
+        response = chat_completion(
+            tier["provider"],
+            tier["model"],
+            prompt_id=prompt.id,
+            messages=build_messages(prompt, [image_data]),
+            tools=[tool],
+            tool_choice={"type": "function", "function": {"name": tool_name}},
+        )
+
+        # Check if we have a valid tool call response
+        if not (response.choices and response.choices[0].message and
+                hasattr(response.choices[0].message, 'tool_calls') and
+                response.choices[0].message.tool_calls):
+            logger.warning("No tool calls in response")
+            # Log the actual response for debugging
+            logger.info(f"Response content: {response}")
+            return None
+
+        tool_call = response.choices[0].message.tool_calls[0]
+        if tool_call.function.name != tool_name:
+            logger.warning(f"Unexpected function call: {tool_call.function.name}")
+            return None
+
+        # Function arguments are a JSON string
+        return tool_call.function.arguments
+
+    return request_structured(call, schema, tier["model"], STRUCTURED_OUTPUT_RETRIES)
+
+
+def check_crop(tool_input):
+    """Return the problems that should escalate a crop answer to a larger model."""
+    return check_bbox(tool_input.get('bbox')) + low_confidence(tool_input)
+
+
+def detect_cover(image_data):
+    """Run the crop cascade for an image.
+
+    Returns (crop_result, tier_info) where crop_result holds cover_type and bbox.
+    While every crop model's circuit is open, the last result for the same image
+    is returned with tier_info["stale"] set. Raises StructuredOutputError if no
+    usable answer could be parsed.
+    """
+    prompt_id = get_prompt("crop").id
+
+    def detect():
+        crop_result, _, tier_info = run_cascade(
+            "crop", lambda tier: request_crop_box(image_data, tier), check_crop)
+        tier_info["prompt"] = prompt_id
+        return crop_result, tier_info
+
+    return serve_stale(prompt_id, image_data, detect)
+
+
+def detect_cover_or_original(image_data, detect):
+    """Run a cover detection, falling back to the original image when it fails.
+
+    detect(image_data) returns (crop_result, tier_info), as detect_cover does.
+    Returns (crop_result, tier_info, None), or (None, None, fallback) if no crop
+    area could be determined, where fallback is the answer for the whole image:
+    cover_type "original", the image itself as cropped_image and a message.
+    """
+    try:
+        crop_result, tier_info = detect(image_data)
+        return crop_result, tier_info, None
+    except ValueError as parse_error:
+        logger.warning(f"Failed to determine crop area: {parse_error}")
+        message = "Failed to determine crop area, returning original image"
+    except Exception as e:
+        logger.error(f"Error detecting cover: {e}")
+        message = f"Error during image processing: {str(e)}, returning original image"
+    return None, None, {"cover_type": "original", "cropped_image": image_data, "message": message}
+
+
+def _iou(a, b):
+    """Intersection over union of two normalized bounding boxes."""
+    width = min(a["xmax"], b["xmax"]) - max(a["xmin"], b["xmin"])
+    height = min(a["ymax"], b["ymax"]) - max(a["ymin"], b["ymin"])
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    area = lambda box: (box["xmax"] - box["xmin"]) * (box["ymax"] - box["ymin"])
+    return intersection / (area(a) + area(b) - intersection)
+
+
+def rank_candidates(result):
+    """Return the usable candidates of a candidates answer, best first.
+
+    Drops candidates with invalid boxes and boxes that overlap a better
+    candidate by more than CROP_CANDIDATE_MAX_IOU, and keeps at most
+    CROP_MAX_CANDIDATES.
+    """
+    candidates = [c for c in result.get("candidates") or []
+                  if isinstance(c, dict) and not check_bbox(c.get("bbox"))]
+    # The model lists candidates best first; a stable sort keeps that order for ties
+    candidates.sort(key=lambda c: -c["confidence"] if isinstance(c.get("confidence"), (int, float)) else 0)
+    ranked = []
+    for candidate in candidates:
+        bbox = {k: float(candidate["bbox"][k]) for k in ['ymin', 'xmin', 'ymax', 'xmax']}
+        if any(_iou(bbox, other["bbox"]) > CROP_CANDIDATE_MAX_IOU for other in ranked):
+            continue
+        ranked.append({
+            "cover_type": candidate.get("cover_type", "title_crop"),
+            "bbox": bbox,
+            "confidence": candidate.get("confidence"),
+        })
+        if len(ranked) == CROP_MAX_CANDIDATES:
+            break
+    return ranked
+
+
+def check_candidates(result):
+    """Return the problems that should escalate a candidates answer to a larger model."""
+    ranked = rank_candidates(result)
+    if not ranked:
+        return ["no usable candidates"]
+    return low_confidence(ranked[0])
+
+
+def detect_cover_candidates(image_data):
+    """Run the crop candidates cascade for an image.
+
+    Returns (candidates, tier_info) where candidates are ranked by rank_candidates.
+    Raises ValueError if no usable candidate was proposed.
+    """
+    prompt_id = get_prompt("crop_candidates").id
+
+    def detect():
+        result, _, tier_info = run_cascade(
+            "crop_candidates",
+            lambda tier: request_crop_box(image_data, tier, "crop_candidates", CANDIDATES_TOOL, CROP_CANDIDATES_SCHEMA),
+            check_candidates)
+        tier_info["prompt"] = prompt_id
+        candidates = rank_candidates(result)
+        if not candidates:
+            raise ValueError("No usable crop candidates")
+        return candidates, tier_info
+
+    return serve_stale(prompt_id, image_data, detect)
+
+
+def candidates_response(image_data, detect, image_bytes=None, pil_image=None):
+    """Build the /crop response for a request with "candidates": true.
+
+    Every candidate is cropped from a single decode of the image; pass the
+    image bytes and PIL image if the route has already decoded them. The top
+    candidate is also returned as cover_type/cropped_image, so clients that
+    ignore candidates get the same answer as a plain /crop call.
+    """
+    try:
+        candidates, tier_info = detect(image_data)
+    except Exception as e:
+        logger.warning(f"Failed to determine crop candidates: {e}")
+        # Fall back to returning the original image
+        return jsonify({
+            "success": True,
+            "cover_type": "original",
+            "cropped_image": image_data,
+            "candidates": [],
+            "message": "Failed to determine crop area, returning original image"
+        })
+
+    logger.info(f"Detected {len(candidates)} crop candidates")
+    if image_bytes is None:
+        image_bytes, pil_image = decode_base64_image(image_data)
+    crops = crop_image_data_regions(image_bytes, [candidate["bbox"] for candidate in candidates],
+                                    image=pil_image) if image_bytes is not None else None
+    if not crops or not all(crops):
+        return jsonify({
+            "success": False,
+            "error": "Failed to convert cropped image to base64"
+        }), 500
+
+    for candidate, cropped_base64 in zip(candidates, crops):
+        candidate["cropped_image"] = cropped_base64
+    return jsonify({
+        "success": True,
+        "cover_type": candidates[0]["cover_type"],
+        "cropped_image": candidates[0]["cropped_image"],
+        "candidates": candidates,
+        "model_tier": tier_info
+    })
+
 
 def register_route(app):
 
@@ -32,189 +241,53 @@ def register_route(app):
                 }), 400
 
             image_data = data['image']
-            # Validate the image data
-            if not is_valid_base64_image(image_data):
+            # Decode once to validate the image; the crop reuses the decoded image
+            image_bytes, pil_image = decode_base64_image(image_data)
+            if image_bytes is None:
                 return jsonify({
                     "success": False,
                     "error": "Invalid image format"
                 }), 400
-
-            # Convert base64 to PIL Image
-            pil_image = base64_to_pil_image(image_data)
             if not pil_image:
                 return jsonify({
                     "success": False,
                     "error": "Failed to process image"
                 }), 400
 
-            # Prepare system message for OpenAI
-            system_message = "You are responsible for extracting the cover image of the recipe included in the image attached. If a section of the image contains an image of the finished dish crop the image to identify the picture of the dish. Otherwise crop the image to extract the title of the recipe. Return the cropped image."
-
-            # Call OpenAI API for bounding box detection
-            try:
-                logger.info("Calling OpenAI to detect bounding box")
-
-                # Use the chat.completions.create API with function calling
-                response = openai_client.chat.completions.create(
-                    model=OPENAI_CROP_MODEL,
-                    messages=[{
-                        "role": "system",
-                        "content": system_message
-                    }, {
-                        "role":
-                        "user",
-                        "content": [{
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_data}"
-                            }
-                        }]
-                    }],
-                    tools=[{
-                        "type": "function",
-                        "function": {
-                            "name": "crop_image",
-                            "description":
-                            "Crop an image based on the bounding box coordinates provided in the format [ymin, xmin, ymax, xmax]. Note the input coordinates must be normalized to a scale of 0 to 1000",
-                            "parameters": {
-                                "type": "object",
-                                "required": ["cover_type", "bbox"],
-                                "properties": {
-                                    "cover_type": {
-                                        "type": "string",
-                                        "enum": ["dish_photo", "title_crop"],
-                                        "description":
-                                        "Type of cover image to select"
-                                    },
-                                    "bbox": {
-                                        "type": "object",
-                                        "required":
-                                        ["ymin", "xmin", "ymax", "xmax"],
-                                        "properties": {
-                                            "ymin": {
-                                                "type":
-                                                "number",
-                                                "description":
-                                                "y min coordinate of the bounding box (value should be between 0 and 1000)"
-                                            },
-                                            "xmin": {
-                                                "type":
-                                                "number",
-                                                "description":
-                                                "x min coordinate of the bounding box (value should be between 0 and 1000)"
-                                            },
-                                            "ymax": {
-                                                "type":
-                                                "number",
-                                                "description":
-                                                "y max coordinate of the bounding box (value should be between 0 and 1000)"
-                                            },
-                                            "xmax": {
-                                                "type":
-                                                "number",
-                                                "description":
-                                                "x max coordinate of the bounding box (value should be between 0 and 1000)"
-                                            }
-                                        }
-                                    }
-                                }
-                            }
-                        }
-                    }],
-                    tool_choice={"type": "function", "function": {"name": "crop_image"}},
-                )
-
-                # Check if we have a valid tool call response
-                if (response.choices and response.choices[0].message and 
-                    hasattr(response.choices[0].message, 'tool_calls') and 
-                    response.choices[0].message.tool_calls):
-                    
-                    tool_call = response.choices[0].message.tool_calls[0]
-                    if tool_call.function.name == "crop_image":
-                        # Parse function arguments from JSON string
-                        try:
-                            # Parse the function arguments
-                            tool_input = json.loads(tool_call.function.arguments)
-                            cover_type = tool_input.get(
-                                'cover_type', 'title_crop')
-                            bbox = tool_input.get('bbox', {})
-
-                            logger.info(f"Detected bounding box: {bbox}")
-                            logger.info(f"Cover type: {cover_type}")
-
-                            # Crop the image using the bounding box
-                            cropped_image = crop_image(pil_image, bbox)
-
-                            # Convert cropped image back to base64
-                            cropped_base64 = pil_image_to_base64(cropped_image)
-
-                            if not cropped_base64:
-                                return jsonify({
-                                    "success":
-                                    False,
-                                    "error":
-                                    "Failed to convert cropped image to base64"
-                                }), 500
-
-                            return jsonify({
-                                "success": True,
-                                "cover_type": cover_type,
-                                "cropped_image": cropped_base64
-                            })
-                        except Exception as json_error:
-                            logger.error(
-                                f"Error parsing function arguments: {json_error}"
-                            )
-                            # Fall back to returning the original image
-                            return jsonify({
-                                "success":
-                                True,
-                                "cover_type":
-                                "original",
-                                "cropped_image":
-                                image_data,
-                                "message":
-                                "Failed to parse cropping instructions, returning original image"
-                            })
-                    else:
-                        logger.warning(
-                            f"Unexpected function call: {tool_call.function.name}")
-                        # Fall back to returning the original image
-                        return jsonify({
-                            "success":
-                            True,
-                            "cover_type":
-                            "original",
-                            "cropped_image":
-                            image_data,
-                            "message":
-                            "Failed to determine crop area, returning original image"
-                        })
-                else:
-                    logger.warning("No tool calls in response")
-                    # Log the actual response for debugging
-                    logger.info(f"Response content: {response}")
-                    # Fall back to returning the original image
-                    return jsonify({
-                        "success": True,
-                        "cover_type": "original",
-                        "cropped_image": image_data,
-                        "message": "Failed to determine crop area, returning original image"
-                    })
-
-            except Exception as e:
-                logger.error(f"Error calling OpenAI: {e}")
+            # Ranked alternatives from one model call, e.g. for a cover picker
+            if data.get('candidates'):
+                return candidates_response(image_data, detect_cover_candidates, image_bytes, pil_image)
+
+            # Call the model cascade for bounding box detection
+            logger.info("Calling OpenAI to detect bounding box")
+            tool_input, tier_info, fallback = detect_cover_or_original(image_data, detect_cover)
+            if fallback:
                 # Fall back to returning the original image
+                return jsonify({"success": True, **fallback})
+
+            cover_type = tool_input.get('cover_type', 'title_crop')
+            bbox = tool_input.get('bbox', {})
+
+            logger.info(f"Detected bounding box: {bbox}")
+            logger.info(f"Cover type: {cover_type}")
+
+            # Crop the image using the bounding box and convert it back to base64
+            cropped_base64 = crop_image_data(image_bytes, bbox, image=pil_image)
+
+            if not cropped_base64:
                 return jsonify({
                     "success":
-                    True,
-                    "cover_type":
-                    "original",
-                    "cropped_image":
-                    image_data,
-                    "message":
-                    f"Error during image processing: {str(e)}, returning original image"
-                })
+                    False,
+                    "error":
+                    "Failed to convert cropped image to base64"
+                }), 500
+
+            return jsonify({
+                "success": True,
+                "cover_type": cover_type,
+                "cropped_image": cropped_base64,
+                "model_tier": tier_info
+            })
 
         except Exception as e:
             logger.error(f"Error processing crop request: {e}")
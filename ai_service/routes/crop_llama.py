@@ -2,20 +2,104 @@
 Crop route module for AI Service using Together.ai LLaMA models
 """
 
-import json
 import logging
 from flask import request, jsonify
 import sys
 import os
-import base64
-from io import BytesIO
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from utils import is_valid_base64_image, base64_to_pil_image, pil_image_to_base64, crop_image
-from config import together_client, LLAMA_CROP_MODEL, AI_PROVIDER
+from utils import decode_base64_image
+from image_pool import crop_image_data
+from config import together_client
+from providers import chat_completion
+from prompts import get_prompt, build_messages
+from cascade import run_cascade, check_bbox, low_confidence
+from breaker import serve_stale
+from schemas import CROP_SCHEMA, CROP_CANDIDATES_SCHEMA, response_format, request_structured
+from config import STRUCTURED_OUTPUT_RETRIES
+from .crop import rank_candidates, check_candidates, candidates_response, detect_cover_or_original
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+
+def request_crop_box(image_data, tier, prompt_name="crop_llama", schema_name="crop_image", schema=CROP_SCHEMA):
+    """Ask a model tier for the cover bounding box as a JSON object.
+
+    Raises StructuredOutputError if the response cannot be parsed or repaired,
+    even after retries.
+    """
+    prompt = get_prompt(prompt_name)
+    messages = build_messages(prompt, [image_data])
+
+    def call():
+        # Make API call
+        response = chat_completion(
+            tier["provider"],
+            tier["model"],
+            prompt_id=prompt.id,
+            messages=messages,
+            temperature=0.2,  # Lower temperature for more deterministic outputs
+            max_tokens=1000,
+            response_format=response_format(tier["provider"], schema_name, schema)
+        )
+
+        # Extract just the content as a string
+        response_text = response.choices[0].message.content.strip()
+        logger.info(f"Got response from {tier['model']}: {response_text[:100]}...")
+        return response_text
+
+    return request_structured(call, schema, tier["model"], STRUCTURED_OUTPUT_RETRIES)
+
+
+def check_crop(parsed_response):
+    """Return the problems that should escalate a crop answer to a larger model."""
+    if "cover_type" not in parsed_response or "bbox" not in parsed_response:
+        return ["missing cover_type or bbox"]
+    return check_bbox(parsed_response["bbox"]) + low_confidence(parsed_response)
+
+
+def detect_cover(image_data):
+    """Run the crop cascade for an image.
+
+    Returns (crop_result, tier_info) where crop_result holds cover_type and bbox.
+    While every crop model's circuit is open, the last result for the same image
+    is returned with tier_info["stale"] set. Raises StructuredOutputError if no
+    usable answer could be parsed.
+    """
+    prompt_id = get_prompt("crop_llama").id
+
+    def detect():
+        crop_result, _, tier_info = run_cascade(
+            "crop_llama", lambda tier: request_crop_box(image_data, tier), check_crop)
+        tier_info["prompt"] = prompt_id
+        return crop_result, tier_info
+
+    return serve_stale(prompt_id, image_data, detect)
+
+
+def detect_cover_candidates(image_data):
+    """Run the crop candidates cascade for an image.
+
+    Returns (candidates, tier_info) where candidates are ranked by rank_candidates.
+    Raises ValueError if no usable candidate was proposed.
+    """
+    prompt_id = get_prompt("crop_llama_candidates").id
+
+    def detect():
+        result, _, tier_info = run_cascade(
+            "crop_llama_candidates",
+            lambda tier: request_crop_box(image_data, tier, "crop_llama_candidates", "propose_crops",
+                                          CROP_CANDIDATES_SCHEMA),
+            check_candidates)
+        tier_info["prompt"] = prompt_id
+        candidates = rank_candidates(result)
+        if not candidates:
+            raise ValueError("No usable crop candidates")
+        return candidates, tier_info
+
+    return serve_stale(prompt_id, image_data, detect)
+
+
 def register_route(app):
     @app.route('/crop', methods=['POST'])
     def crop_recipe_image():
@@ -31,44 +115,19 @@ def register_route(app):
                 }), 400
 
             image_data = data['image']
-            # Validate the image data
-            if not is_valid_base64_image(image_data):
+            # Decode once to validate the image; the crop reuses the decoded image
+            image_bytes, pil_image = decode_base64_image(image_data)
+            if image_bytes is None:
                 return jsonify({
                     "success": False,
                     "error": "Invalid image format"
                 }), 400
-
-            # Convert base64 to PIL Image
-            pil_image = base64_to_pil_image(image_data)
             if not pil_image:
                 return jsonify({
                     "success": False,
                     "error": "Failed to process image"
                 }), 400
 
-            # Prepare system message for Together.ai
-            system_message = "You are a helpful assistant specialized in image analysis. You will be given a recipe image. Your task is to identify the main dish or recipe title in the image and provide normalized coordinates to crop it. You should return a JSON object with the cover_type (either 'dish_photo' or 'title_crop') and the bounding box coordinates using normalized values from 0 to 1000."
-            
-            # Prepare the user prompt with detailed instructions
-            user_message = """
-            Please analyze this recipe image and provide a JSON object with the following format:
-            {
-                "cover_type": "dish_photo", // Use "dish_photo" if you find a picture of the prepared dish, or "title_crop" if you find the title of the recipe
-                "bbox": {
-                    "xmin": 100, // The x-coordinate of the top-left corner (value between 0-1000)
-                    "ymin": 200, // The y-coordinate of the top-left corner (value between 0-1000)
-                    "xmax": 400, // The x-coordinate of the bottom-right corner (value between 0-1000) 
-                    "ymax": 600  // The y-coordinate of the bottom-right corner (value between 0-1000)
-                }
-            }
-            
-            IMPORTANT: All bbox coordinates must be normalized values between 0 and 1000, where 0 represents the top/left edge and 1000 represents the bottom/right edge of the image.
-            Remember to provide only the JSON object with no additional text.
-            """
-
-            # Create a data URI for the image
-            image_data_uri = f"data:image/jpeg;base64,{image_data}"
-
             # Call Together.ai API for bounding box detection
             try:
                 logger.info("Calling Together.ai to detect bounding box")
@@ -83,95 +142,51 @@ def register_route(app):
                         "message": "Together.ai is not available. Please check API key. Returning original image."
                     })
 
-                # Format the prompt with the image
-                messages = [
-                    {
-                        "role": "system",
-                        "content": system_message
-                    },
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": user_message
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": image_data_uri
-                                }
-                            }
-                        ]
-                    }
-                ]
-
-                # Make API call
-                response = together_client.chat.completions.create(
-                    model=LLAMA_CROP_MODEL,
-                    messages=messages,
-                    temperature=0.2,  # Lower temperature for more deterministic outputs
-                    max_tokens=1000,
-                    response_format={"type": "json_object"}  # Request JSON format
-                )
-
-                # Process the response to extract JSON
-                try:
-                    # Extract just the content as a string
-                    response_text = response.choices[0].message.content.strip()
-                    logger.info(f"Got response from Together.ai: {response_text[:100]}...")
+                # Ranked alternatives from one model call, e.g. for a cover picker
+                if data.get('candidates'):
+                    return candidates_response(image_data, detect_cover_candidates, image_bytes, pil_image)
+
+                parsed_response, tier_info, fallback = detect_cover_or_original(image_data, detect_cover)
+                if fallback:
+                    return jsonify({"success": True, **fallback})
+
+                # Extract the required information
+                if "cover_type" in parsed_response and "bbox" in parsed_response:
+                    cover_type = parsed_response.get("cover_type", "title_crop")
+                    bbox = parsed_response.get("bbox", {})
                     
-                    # Parse the JSON response
-                    parsed_response = json.loads(response_text)
+                    # Validate bbox structure
+                    if not all(key in bbox for key in ["xmin", "ymin", "xmax", "ymax"]):
+                        logger.warning(f"Invalid bbox structure: {bbox}")
+                        raise ValueError("Invalid bounding box structure")
                     
-                    # Extract the required information
-                    if "cover_type" in parsed_response and "bbox" in parsed_response:
-                        cover_type = parsed_response.get("cover_type", "title_crop")
-                        bbox = parsed_response.get("bbox", {})
-                        
-                        # Validate bbox structure
-                        if not all(key in bbox for key in ["xmin", "ymin", "xmax", "ymax"]):
-                            logger.warning(f"Invalid bbox structure: {bbox}")
-                            raise ValueError("Invalid bounding box structure")
-                        
-                        logger.info(f"Detected bounding box: {bbox}")
-                        logger.info(f"Cover type: {cover_type}")
-                        
-                        # Crop the image using the bounding box
-                        cropped_image = crop_image(pil_image, bbox)
-                        
-                        # Convert cropped image back to base64
-                        cropped_base64 = pil_image_to_base64(cropped_image)
-                        
-                        if not cropped_base64:
-                            return jsonify({
-                                "success": False,
-                                "error": "Failed to convert cropped image to base64"
-                            }), 500
-                        
-                        # Return the cropped image
-                        return jsonify({
-                            "success": True,
-                            "cover_type": cover_type,
-                            "cropped_image": cropped_base64
-                        })
-                    else:
-                        # If missing required fields, return original image
-                        logger.warning(f"Missing required fields in response: {response_text}")
+                    logger.info(f"Detected bounding box: {bbox}")
+                    logger.info(f"Cover type: {cover_type}")
+                    
+                    # Crop the image using the bounding box and convert it back to base64
+                    cropped_base64 = crop_image_data(image_bytes, bbox, image=pil_image)
+                    
+                    if not cropped_base64:
                         return jsonify({
-                            "success": True,
-                            "cover_type": "original",
-                            "cropped_image": image_data,
-                            "message": "Invalid response format, returning original image"
-                        })
-                        
-                except json.JSONDecodeError as json_error:
-                    logger.error(f"Error parsing Together.ai response: {json_error}")
+                            "success": False,
+                            "error": "Failed to convert cropped image to base64"
+                        }), 500
+                    
+                    # Return the cropped image
+                    return jsonify({
+                        "success": True,
+                        "cover_type": cover_type,
+                        "cropped_image": cropped_base64,
+                        "model_tier": tier_info
+                    })
+                else:
+                    # If missing required fields, return original image
+                    logger.warning(f"Missing required fields in response: {parsed_response}")
                     return jsonify({
                         "success": True,
                         "cover_type": "original",
                         "cropped_image": image_data,
-                        "message": "Failed to parse response, returning original image"
+                        "message": "Invalid response format, returning original image"
                     })
                     
             except Exception as e:
@@ -186,4 +201,4 @@ def register_route(app):
                 
         except Exception as e:
             logger.error(f"Error processing crop request: {e}")
-            return jsonify({"success": False, "error": str(e)}), 500
\ No newline at end of file
+            return jsonify({"success": False, "error": str(e)}), 500
@@ -0,0 +1,97 @@
+"""
+Duplicate index route module for AI Service
+
+POST /dedup/index adds saved recipes to the near-duplicate index, POST
+/dedup/remove drops deleted ones and POST /dedup/query looks up likely
+duplicates of a recipe. /extract results are
+checked against the same index.
+"""
+
+import logging
+from flask import request, jsonify
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import DEDUP_INDEX_DIR
+import dedup
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+def register_route(app):
+    @app.route('/dedup/index', methods=['POST'])
+    def index_recipes():
+        """Add recipes ({"recipes": [{"id", "title", "ingredients", "instructions"}]}) to the index."""
+        data = request.get_json(silent=True) or {}
+        recipes = data.get('recipes')
+        if not isinstance(recipes, list) or not recipes:
+            return jsonify({
+                "success": False,
+                "error": "No recipes provided"
+            }), 400
+        if not all(isinstance(recipe, dict) and 'id' in recipe for recipe in recipes):
+            return jsonify({
+                "success": False,
+                "error": "Every recipe needs an id"
+            }), 400
+
+        try:
+            index = dedup.get_index()
+            indexed = sum(index.append(DEDUP_INDEX_DIR, recipe['id'], recipe) for recipe in recipes)
+        except Exception as e:
+            logger.error(f"Error indexing recipes: {e}")
+            return jsonify({"success": False, "error": str(e)}), 500
+
+        return jsonify({
+            "success": True,
+            "indexed": indexed,
+            "skipped": len(recipes) - indexed,
+            "total": len(index)
+        })
+
+    @app.route('/dedup/remove', methods=['POST'])
+    def remove_recipes():
+        """Remove deleted recipes ({"ids": [...]}) from the index."""
+        data = request.get_json(silent=True) or {}
+        recipe_ids = data.get('ids')
+        if not isinstance(recipe_ids, list) or not recipe_ids:
+            return jsonify({
+                "success": False,
+                "error": "No recipe ids provided"
+            }), 400
+
+        try:
+            index = dedup.get_index()
+            removed = sum(index.append_removal(DEDUP_INDEX_DIR, recipe_id) for recipe_id in recipe_ids)
+        except Exception as e:
+            logger.error(f"Error removing recipes from duplicate index: {e}")
+            return jsonify({"success": False, "error": str(e)}), 500
+
+        return jsonify({
+            "success": True,
+            "removed": removed,
+            "total": len(index)
+        })
+
+    @app.route('/dedup/query', methods=['POST'])
+    def query_recipe():
+        """Return likely duplicates of a recipe from the index."""
+        data = request.get_json(silent=True) or {}
+        recipe = data.get('recipe')
+        if not isinstance(recipe, dict):
+            return jsonify({
+                "success": False,
+                "error": "No recipe provided"
+            }), 400
+
+        try:
+            duplicates = dedup.find_duplicates(recipe)
+        except Exception as e:
+            logger.error(f"Error querying duplicate index: {e}")
+            return jsonify({"success": False, "error": str(e)}), 500
+
+        return jsonify({
+            "success": True,
+            "duplicates": duplicates
+        })
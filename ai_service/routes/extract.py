@@ -2,18 +2,430 @@
 Extract route module for AI Service
 """
 
-import json
+import contextvars
 import logging
+import re
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from flask import request, jsonify
+from PIL import ImageOps
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from utils import is_valid_base64_image
-from config import openai_client
+from utils import (is_valid_base64_image, base64_to_pil_image,
+                   pil_image_to_base64, downscale_image, split_into_tiles, crop_image)
+from providers import chat_completion
+from prompts import get_prompt, build_messages
+from cascade import run_cascade, low_confidence, check_bbox
+from roi import find_text_region, text_density
+from image_pool import crop_base64_regions
+from dedup import find_duplicates
+from ingredients import parse_ingredients
+from schemas import RECIPE_SCHEMA, MULTI_RECIPE_SCHEMA, StructuredOutputError, response_format, request_structured
+from config import (STRUCTURED_OUTPUT_RETRIES, MULTI_PAGE_MAX_SIDE, MULTI_PAGE_MAX_PAGES,
+                    EXTRACT_MAX_TOKENS_PER_PAGE, TILE_PIXEL_THRESHOLD, TILE_MIN_TEXT_DENSITY, TILE_SIZE, TILE_OVERLAP, TILE_MAX_TILES,
+                    ROI_ENABLED, DEDUP_ENABLED, INGREDIENT_PARSING_ENABLED)
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+REQUIRED_FIELDS = [
+    "title", "description", "cookingTimeMinutes", "difficulty",
+    "ingredients", "instructions", "servings"
+]
+
+def request_recipe(images, tier, prompt_name="extract"):
+    """Ask a model tier to extract the recipe from one or more images and return the parsed JSON object.
+
+    The output token limit grows with the number of images, so a recipe merged
+    from several pages is not cut off. Raises StructuredOutputError if no valid
+    recipe object can be parsed from the response, even after repair and retries.
+    """
+    prompt = get_prompt(prompt_name)
+    max_tokens = EXTRACT_MAX_TOKENS_PER_PAGE * len(images)
+
+    def call():
+        response = chat_completion(
+            tier["provider"],
+            tier["model"],
+            prompt_id=prompt.id,
+            messages=build_messages(prompt, images),
+            response_format=response_format(tier["provider"], "recipe", RECIPE_SCHEMA),
+            max_tokens=max_tokens)
+
+        logger.info(f"Extraction response received from {tier['model']}")
+        if getattr(response.choices[0], "finish_reason", None) == "length":
+            logger.warning(f"Extraction from {len(images)} image(s) hit max_tokens={max_tokens} "
+                           f"on {tier['model']}; the recipe may be truncated")
+        return response.choices[0].message.content
+
+    return request_structured(call, RECIPE_SCHEMA, tier["model"], STRUCTURED_OUTPUT_RETRIES)
+
+
+def missing_fields(recipe_data):
+    """Return the required recipe fields missing from the extracted data."""
+    return [field for field in REQUIRED_FIELDS if field not in recipe_data]
+
+
+def check_recipe(recipe_data):
+    """Return the problems that should escalate an extraction to a larger model."""
+    missing = missing_fields(recipe_data)
+    if missing:
+        return [f"missing fields: {', '.join(missing)}"]
+    problems = []
+    if not recipe_data.get("ingredients"):
+        problems.append("empty ingredient list")
+    if not recipe_data.get("instructions"):
+        problems.append("empty instruction list")
+    return problems + low_confidence(recipe_data)
+
+
+def extract_recipe_data(image_data, prompt_name="extract"):
+    """Run the extraction cascade for an image, or a list of page images.
+
+    Returns (recipe_data, tier_info). Raises ValueError if the recipe could not be
+    parsed or required fields are missing from the final answer.
+    """
+    images = image_data if isinstance(image_data, list) else [image_data]
+    recipe_data, _, tier_info = run_cascade(
+        "extract", lambda tier: request_recipe(images, tier, prompt_name), check_recipe)
+    tier_info["prompt"] = get_prompt(prompt_name).id
+
+    # Validate required fields
+    missing = missing_fields(recipe_data)
+    if missing:
+        raise ValueError(f"Missing required fields: {', '.join(missing)}")
+    return recipe_data, tier_info
+
+
+def crop_to_text_region(image):
+    """Crop a decoded image to its dominant text region.
+
+    Returns (region, bbox), or (image, None) if no confident region was found.
+    """
+    try:
+        # The crop is re-encoded without EXIF, so apply the orientation first
+        image = ImageOps.exif_transpose(image)
+        bbox = find_text_region(image)
+    except Exception as e:
+        logger.warning(f"Text region detection failed: {e}")
+        return image, None
+    if bbox is None:
+        return image, None
+    logger.info(f"Detected text region: {bbox}")
+    return crop_image(image, bbox), bbox
+
+
+def extract_region_recipe(image_data, region_data):
+    """Extract a recipe from the text region, falling back to the full image.
+
+    The full image is used when the region answer cannot be parsed or has no
+    ingredients, since a tight region may have cut off part of the recipe.
+    Returns (recipe_data, tier_info, used_region).
+    """
+    try:
+        recipe_data, tier_info = extract_recipe_data(region_data)
+        if recipe_data.get("ingredients"):
+            return recipe_data, tier_info, True
+        logger.info("No ingredients found in text region, retrying with full image")
+    except ValueError as e:
+        logger.info(f"Extraction from text region failed, retrying with full image: {e}")
+    recipe_data, tier_info = extract_recipe_data(image_data)
+    return recipe_data, tier_info, False
+
+
+def check_duplicates(recipe_data):
+    """Return likely duplicates of an extracted recipe, or None if the check is off or fails."""
+    if not DEDUP_ENABLED:
+        return None
+    try:
+        # Never hold up an extraction while the index is still loading at startup
+        return find_duplicates(recipe_data, wait=False)
+    except Exception as e:
+        logger.warning(f"Duplicate check failed: {e}")
+        return None
+
+
+def add_parsed_ingredients(recipe_data):
+    """Add the quantity, unit and item of each ingredient line as parsed_ingredients.
+
+    The ingredient strings are kept as extracted. Runs locally, without a provider call.
+    """
+    if INGREDIENT_PARSING_ENABLED:
+        recipe_data["parsed_ingredients"] = parse_ingredients(recipe_data.get("ingredients"))
+    return recipe_data
+
+
+def prepare_page(index, image_data):
+    """Decode and downscale one page of a multi-page request.
+
+    Returns (page_base64, timing) where timing reports sizes and milliseconds spent.
+    """
+    start = time.perf_counter()
+    image = base64_to_pil_image(image_data)
+    if image is None:
+        raise ValueError(f"Failed to process page {index + 1}")
+    original_size = list(image.size)
+    image = downscale_image(image, MULTI_PAGE_MAX_SIDE)
+    decoded = time.perf_counter()
+    page_data = pil_image_to_base64(image)
+    if page_data is None:
+        raise ValueError(f"Failed to encode page {index + 1}")
+    encoded = time.perf_counter()
+    return page_data, {
+        "page": index + 1,
+        "original_size": original_size,
+        "sent_size": list(image.size),
+        "bytes_in": len(image_data),
+        "bytes_sent": len(page_data),
+        "decode_ms": round((decoded - start) * 1000, 1),
+        "encode_ms": round((encoded - decoded) * 1000, 1),
+    }
+
+
+def extract_multi_page_recipe(pages):
+    """Extract one merged recipe from an ordered list of page images.
+
+    Pages are downscaled concurrently and sent together in a single model call.
+    Returns (recipe_data, tier_info, timings).
+    """
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(pages)) as executor:
+        prepared = list(executor.map(prepare_page, range(len(pages)), pages))
+    preprocessed = time.perf_counter()
+
+    recipe_data, tier_info = extract_recipe_data(
+        [page_data for page_data, _ in prepared], "extract_multi_page")
+    finished = time.perf_counter()
+
+    timings = {
+        "pages": [timing for _, timing in prepared],
+        "preprocess_ms": round((preprocessed - start) * 1000, 1),
+        "model_ms": round((finished - preprocessed) * 1000, 1),
+        "total_ms": round((finished - start) * 1000, 1),
+    }
+    return recipe_data, tier_info, timings
+
+
+# Shortest normalized line treated as a cut-off copy of a longer line
+MIN_PARTIAL_LINE = 15
+
+
+def should_tile(image):
+    """Return True if an image is large and dense enough to be extracted tile by tile.
+
+    Ordinary phone photos stay below the pixel threshold; larger images are only
+    tiled when most of their area is text, not a dish photo with a few lines.
+    """
+    if image.width * image.height <= TILE_PIXEL_THRESHOLD:
+        return False
+    try:
+        return text_density(image) >= TILE_MIN_TEXT_DENSITY
+    except Exception as e:
+        logger.warning(f"Text density check failed: {e}")
+        return False
+
+
+def _normalize_line(line):
+    """Normalize an ingredient or instruction line for overlap comparison."""
+    line = re.sub(r'^\s*(step\s*\d+[.):]?|\d+[.):])\s+', '', line.lower())
+    return re.sub(r'[^a-z0-9]+', ' ', line).strip()
+
+
+def merge_lines(line_lists):
+    """Concatenate partial lists in tile order, dropping lines repeated by overlapping tiles.
+
+    Besides exact repeats, a line cut off at a tile edge (a long prefix or suffix
+    of another line) is merged with its complete version, keeping the longer one.
+    """
+    merged = []
+    normalized = []
+    for lines in line_lists:
+        for line in lines:
+            key = _normalize_line(line)
+            if not key:
+                continue
+            for index, seen in enumerate(normalized):
+                if key == seen:
+                    break
+                shorter, longer = sorted((key, seen), key=len)
+                if len(shorter) >= MIN_PARTIAL_LINE and (
+                        longer.startswith(shorter) or longer.endswith(shorter)):
+                    if longer == key:
+                        merged[index], normalized[index] = line, key
+                    break
+            else:
+                merged.append(line)
+                normalized.append(key)
+    return merged
+
+
+def merge_partial_recipes(partials):
+    """Merge the partial recipes extracted from the tiles of one page."""
+    def most_common(field):
+        values = [partial.get(field) for partial in partials if partial.get(field)]
+        return Counter(values).most_common(1)[0][0] if values else None
+
+    titles = [partial["title"] for partial in partials if partial.get("title")]
+    descriptions = [partial["description"] for partial in partials if partial.get("description")]
+    confidences = [partial["confidence"] for partial in partials
+                   if isinstance(partial.get("confidence"), (int, float))]
+    return {
+        "title": titles[0] if titles else "",
+        "description": max(descriptions, key=len) if descriptions else "",
+        "cookingTimeMinutes": most_common("cookingTimeMinutes") or 0,
+        "difficulty": most_common("difficulty") or "medium",
+        "ingredients": merge_lines(partial.get("ingredients") or [] for partial in partials),
+        "instructions": merge_lines(partial.get("instructions") or [] for partial in partials),
+        "servings": most_common("servings") or 0,
+        "confidence": min(confidences) if confidences else 0,
+    }
+
+
+def extract_tiled_recipe(image):
+    """Extract a recipe from a large image by extracting overlapping tiles concurrently.
+
+    Returns (recipe_data, tier_info, tile_count). Tiles that fail are skipped; a
+    ValueError is raised only if every tile fails or nothing could be merged.
+    """
+    # Tiles are re-encoded without EXIF, so apply the orientation first
+    image = ImageOps.exif_transpose(image)
+    tiles = split_into_tiles(image, TILE_SIZE, TILE_OVERLAP, TILE_MAX_TILES)
+    tile_images = [pil_image_to_base64(tile) for _, tile in tiles]
+    logger.info(f"Extracting recipe from {len(tiles)} tiles")
+
+    def extract_tile(tile_data):
+        # Partial tiles are expected, so every parsed answer is accepted
+        return run_cascade(
+            "extract_tile", lambda tier: request_recipe([tile_data], tier, "extract_tile"), lambda result: [])
+
+    partials = []
+    tier_info = None
+    with ThreadPoolExecutor(max_workers=len(tile_images)) as executor:
+        # Tiles run with the priority class and usage tags of the request
+        futures = [executor.submit(contextvars.copy_context().run, extract_tile, tile_data)
+                   for tile_data in tile_images]
+        # Collect in tile order so the merged lists keep the reading order
+        for index, future in enumerate(futures):
+            try:
+                partial, _, tier_info = future.result()
+                partials.append(partial)
+            except Exception as e:
+                logger.warning(f"Tile {index} extraction failed: {e}")
+
+    if not partials:
+        raise ValueError("Could not parse recipe data from image")
+    recipe_data = merge_partial_recipes(partials)
+    if not recipe_data["ingredients"] and not recipe_data["instructions"]:
+        raise ValueError("Could not parse recipe data from image")
+    tier_info["prompt"] = get_prompt("extract_tile").id
+    return recipe_data, tier_info, len(tiles)
+
+
+def request_recipes(image_data, tier):
+    """Ask a model tier for every recipe on a page, each with its cover bounding box."""
+    prompt = get_prompt("extract_multi")
+
+    def call():
+        response = chat_completion(
+            tier["provider"],
+            tier["model"],
+            prompt_id=prompt.id,
+            messages=build_messages(prompt, [image_data]),
+            response_format=response_format(tier["provider"], "recipes", MULTI_RECIPE_SCHEMA),
+            max_tokens=2400)
+
+        logger.info(f"Multi-recipe extraction response received from {tier['model']}")
+        return response.choices[0].message.content
+
+    return request_structured(call, MULTI_RECIPE_SCHEMA, tier["model"], STRUCTURED_OUTPUT_RETRIES)
+
+
+def check_recipes(result):
+    """Return the problems that should escalate a multi-recipe extraction."""
+    recipes = result.get("recipes") or []
+    if not recipes:
+        return ["no recipes found"]
+    problems = []
+    for index, recipe_data in enumerate(recipes):
+        problems += [f"recipe {index}: {problem}"
+                     for problem in check_recipe(recipe_data) + check_bbox(recipe_data.get("bbox"))]
+    return problems
+
+
+def extract_page_recipes(image_data):
+    """Extract every recipe on a page and crop the cover of each one.
+
+    Returns (recipes, tier_info); each recipe carries its fields, cover_type, bbox
+    and cropped_image. All crops are cut from a single decode of the image.
+    """
+    result, _, tier_info = run_cascade(
+        "extract_multi", lambda tier: request_recipes(image_data, tier), check_recipes)
+    tier_info["prompt"] = get_prompt("extract_multi").id
+
+    recipes = [recipe_data for recipe_data in result.get("recipes", [])
+               if not missing_fields(recipe_data)]
+    if not recipes:
+        raise ValueError("No recipes found in the image")
+
+    crops = crop_base64_regions(image_data, [recipe_data["bbox"] for recipe_data in recipes])
+    if crops is None:
+        raise ValueError("Failed to process image")
+    for recipe_data, cropped_base64 in zip(recipes, crops):
+        recipe_data["cropped_image"] = cropped_base64
+    return recipes, tier_info
+
+
+def extract_image_recipe(image_data, roi=True, tiled=None):
+    """Run the single-image /extract pipeline: ROI crop, tiling, extraction and dedup.
+
+    Returns the response fields (recipe, model_tier, roi, duplicates and, for
+    tiled pages, tiles). Raises StructuredOutputError or ValueError like
+    extract_recipe_data.
+    """
+    pil_image = base64_to_pil_image(image_data)
+
+    # Send only the text block of the photo unless the caller opts out
+    roi_bbox = None
+    region_data = image_data
+    if pil_image and ROI_ENABLED and roi:
+        pil_image, roi_bbox = crop_to_text_region(pil_image)
+        if roi_bbox:
+            region_data = pil_image_to_base64(pil_image) or image_data
+    roi_info = {
+        "bbox": roi_bbox,
+        "bytes_full": len(image_data),
+        "bytes_sent": len(region_data)
+    } if roi_bbox else None
+
+    # Large, dense pages are split into tiles unless the caller decides otherwise
+    if tiled is not False and pil_image and (tiled or should_tile(pil_image)):
+        recipe_data, tier_info, tile_count = extract_tiled_recipe(pil_image)
+        return {
+            "recipe": add_parsed_ingredients(recipe_data),
+            "model_tier": tier_info,
+            "tiles": tile_count,
+            "roi": roi_info,
+            "duplicates": check_duplicates(recipe_data)
+        }
+
+    if roi_bbox:
+        recipe_data, tier_info, used_region = extract_region_recipe(image_data, region_data)
+        if not used_region:
+            roi_info.update(bytes_sent=roi_info["bytes_full"] + roi_info["bytes_sent"],
+                            fallback=True)
+    else:
+        recipe_data, tier_info = extract_recipe_data(image_data)
+
+    return {
+        "recipe": add_parsed_ingredients(recipe_data),
+        "model_tier": tier_info,
+        "roi": roi_info,
+        "duplicates": check_duplicates(recipe_data)
+    }
+
+
 def register_route(app):
     @app.route('/extract', methods=['POST'])
     def extract_recipe():
@@ -22,6 +434,44 @@ def register_route(app):
         try:
             # Get the base64 encoded image from the request
             data = request.json
+
+            # Recipes spanning several pages arrive as an ordered list of images
+            if data and 'images' in data:
+                pages = data['images']
+                if not isinstance(pages, list) or not pages:
+                    return jsonify({
+                        "success": False,
+                        "error": "No images provided"
+                    }), 400
+                if len(pages) > MULTI_PAGE_MAX_PAGES:
+                    return jsonify({
+                        "success": False,
+                        "error": f"Too many pages (maximum {MULTI_PAGE_MAX_PAGES})"
+                    }), 400
+                if not all(isinstance(page, str) and is_valid_base64_image(page) for page in pages):
+                    return jsonify({
+                        "success": False,
+                        "error": "Invalid image format"
+                    }), 400
+
+                try:
+                    recipe_data, tier_info, timings = extract_multi_page_recipe(pages)
+                except StructuredOutputError:
+                    return jsonify({
+                        "success": False,
+                        "error": "Could not parse recipe data from image"
+                    }), 400
+                except ValueError as e:
+                    return jsonify({"success": False, "error": str(e)}), 400
+
+                return jsonify({
+                    "success": True,
+                    "recipe": add_parsed_ingredients(recipe_data),
+                    "model_tier": tier_info,
+                    "timings": timings,
+                    "duplicates": check_duplicates(recipe_data)
+                })
+
             if not data or 'image' not in data:
                 return jsonify({
                     "success": False,
@@ -36,96 +486,37 @@ def register_route(app):
                     "error": "Invalid image format"
                 }), 400
 
-            # Prepare the prompt for OpenAI
-            prompt = """
-            Please extract the following information from this recipe image:
-            1. Recipe title
-            2. Brief description
-            3. Cooking time in minutes
-            4. Difficulty level (easy, medium, hard)
-            5. Ingredients (as a list)
-            6. Instructions (as numbered steps)
-            7. Servings
-            
-            Format your response as a valid JSON object with the following keys:
-            {
-              "title": "string",
-              "description": "string",
-              "cookingTimeMinutes": number,
-              "difficulty": "string", 
-              "ingredients": ["string"],
-              "instructions": ["string"],
-              "servings": number
-            }
-            
-            Only return the JSON object, no additional text.
-            """
-
-            # Call OpenAI API
-            response = openai_client.chat.completions.create(
-                model="gpt-4.1-nano",
-                messages=[{
-                    "role":
-                    "user",
-                    "content": [{
-                        "type": "text",
-                        "text": prompt
-                    }, {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{image_data}"
-                        }
-                    }]
-                }],
-                max_tokens=800)
-
-            # Extract the response
-            ai_response = response.choices[0].message.content.strip()
-            logger.info(f"OpenAI extraction response received")
-
-            # Parse the JSON response
-            try:
-                # Find the JSON object in the response
-                json_start = ai_response.find('{')
-                json_end = ai_response.rfind('}') + 1
-                if json_start >= 0 and json_end > json_start:
-                    json_str = ai_response[json_start:json_end]
-                    recipe_data = json.loads(json_str)
-
-                    # Validate required fields
-                    required_fields = [
-                        "title", "description", "cookingTimeMinutes", "difficulty",
-                        "ingredients", "instructions", "servings"
-                    ]
-                    missing_fields = [
-                        field for field in required_fields
-                        if field not in recipe_data
-                    ]
-
-                    if missing_fields:
-                        return jsonify({
-                            "success":
-                            False,
-                            "error":
-                            f"Missing required fields: {', '.join(missing_fields)}"
-                        }), 400
-
-                    return jsonify({"success": True, "recipe": recipe_data})
-                else:
+            # Pages with several recipes return a list of recipes with their crops
+            if data.get('multi'):
+                try:
+                    recipes, tier_info = extract_page_recipes(image_data)
+                except StructuredOutputError:
                     return jsonify({
-                        "success":
-                        False,
-                        "error":
-                        "Could not parse recipe data from image"
+                        "success": False,
+                        "error": "Could not parse recipe data from image"
                     }), 400
+                except ValueError as e:
+                    return jsonify({"success": False, "error": str(e)}), 400
 
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON decode error: {e}, Response: {ai_response}")
+                return jsonify({
+                    "success": True,
+                    "recipes": [add_parsed_ingredients(recipe) for recipe in recipes],
+                    "model_tier": tier_info,
+                    "duplicates": [check_duplicates(recipe) for recipe in recipes]
+                })
+
+            try:
+                result = extract_image_recipe(image_data, data.get('roi', True), data.get('tiled'))
+            except StructuredOutputError:
                 return jsonify({
                     "success": False,
                     "error": "Could not parse recipe data from image"
                 }), 400
+            except ValueError as e:
+                return jsonify({"success": False, "error": str(e)}), 400
+
+            return jsonify({"success": True, **result})
 
         except Exception as e:
             logger.error(f"Error extracting recipe: {e}")
-            return jsonify({"success": False, "error": str(e)}), 500
\ No newline at end of file
+            return jsonify({"success": False, "error": str(e)}), 500
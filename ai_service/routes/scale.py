@@ -0,0 +1,79 @@
+"""
+Ingredient scaling route module for AI Service
+
+POST /scale parses ingredient lines, scales them to another number of servings
+and converts them between metric and US units. Runs locally, without a provider
+call.
+"""
+
+import logging
+from flask import request, jsonify
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from config import SCALE_MAX_INGREDIENTS
+from ingredients import parse_ingredients, scale_ingredient
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+UNIT_SYSTEMS = ("metric", "us")
+
+
+def scale_factor(data):
+    """Return the scale factor of a request: "factor", or "target_servings" / "servings"."""
+    if data.get('factor') is not None:
+        return float(data['factor'])
+    if data.get('target_servings') is not None:
+        servings = data.get('servings')
+        return float(data['target_servings']) / (float(servings) if servings is not None else 1.0)
+    return 1.0
+
+
+def register_route(app):
+    @app.route('/scale', methods=['POST'])
+    def scale_ingredients():
+        """Scale ingredient lines ({"ingredients", "servings", "target_servings" or "factor", "units"})."""
+        data = request.get_json(silent=True) or {}
+        lines = data.get('ingredients')
+        if not isinstance(lines, list) or not lines:
+            return jsonify({
+                "success": False,
+                "error": "No ingredients provided"
+            }), 400
+        if len(lines) > SCALE_MAX_INGREDIENTS:
+            return jsonify({
+                "success": False,
+                "error": f"Too many ingredients (maximum {SCALE_MAX_INGREDIENTS})"
+            }), 400
+        if not all(isinstance(line, str) for line in lines):
+            return jsonify({
+                "success": False,
+                "error": "Ingredients must be strings"
+            }), 400
+
+        try:
+            factor = scale_factor(data)
+        except (TypeError, ValueError, ZeroDivisionError):
+            factor = None
+        if factor is None or not 0 < factor < float("inf"):
+            return jsonify({
+                "success": False,
+                "error": "Invalid servings or factor"
+            }), 400
+
+        units = data.get('units')
+        if units is not None and units not in UNIT_SYSTEMS:
+            return jsonify({
+                "success": False,
+                "error": f"Unknown units (expected one of {', '.join(UNIT_SYSTEMS)})"
+            }), 400
+
+        scaled = [scale_ingredient(parsed, factor, units) for parsed in parse_ingredients(lines)]
+        return jsonify({
+            "success": True,
+            "factor": factor,
+            "servings": data.get('target_servings'),
+            "units": units,
+            "ingredients": scaled
+        })
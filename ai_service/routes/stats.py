@@ -0,0 +1,42 @@
+"""
+Stats route module for AI Service
+"""
+
+import logging
+from flask import jsonify
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import breaker
+import cascade
+import http_transport
+import schemas
+import scheduler
+import socket_transport
+import usage
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+def register_route(app):
+    @app.route('/stats', methods=['GET'])
+    def get_stats():
+        """Return runtime statistics used to tune the service."""
+        return jsonify({
+            "success": True,
+            "cascade": cascade.get_stats(),
+            "parse": schemas.get_parse_stats(),
+            "scheduler": scheduler.get_stats(),
+            "http": http_transport.get_stats(),
+            "socket": socket_transport.get_stats()
+        })
+
+    @app.route('/breakers', methods=['GET'])
+    def get_breakers():
+        """Return the circuit breaker state of every provider/model and the stale result cache."""
+        return jsonify(dict(breaker.get_status(), success=True))
+
+    @app.route('/usage', methods=['GET'])
+    def get_usage():
+        """Return token usage, estimated cost and budget status."""
+        return jsonify(dict(usage.get_report(), success=True))
@@ -8,11 +8,33 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from utils import is_valid_base64_image
-from config import openai_client
+from providers import chat_completion
+from usage import budget_model
+from prompts import get_prompt, build_messages
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+def verify_image(image_data):
+    """Return True if the model finds a recipe in the image."""
+    prompt = get_prompt("verify")
+
+    # Call OpenAI API
+    response = chat_completion(
+        "openai",
+        budget_model("gpt-4.1-nano"),
+        prompt_id=prompt.id,
+        messages=build_messages(prompt, [image_data]),
+        max_tokens=10)
+
+    # Extract the response
+    ai_response = response.choices[0].message.content.strip().lower()
+    logger.info(f"OpenAI verification response: {ai_response}")
+
+    # Determine if the image contains a recipe
+    return 'yes' in ai_response
+
+
 def register_route(app):
     @app.route('/verify', methods=['POST'])
     def verify_recipe_image():
@@ -35,33 +57,7 @@ def register_route(app):
                     "error": "Invalid image format"
                 }), 400
 
-            # Prepare the prompt for OpenAI
-            prompt = "Does this image contain a recipe? A recipe typically includes ingredients and instructions for preparing a dish. Answer with only 'yes' or 'no'."
-
-            # Call OpenAI API
-            response = openai_client.chat.completions.create(
-                model="gpt-4.1-nano",
-                messages=[{
-                    "role":
-                    "user",
-                    "content": [{
-                        "type": "text",
-                        "text": prompt
-                    }, {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{image_data}"
-                        }
-                    }]
-                }],
-                max_tokens=10)
-
-            # Extract the response
-            ai_response = response.choices[0].message.content.strip().lower()
-            logger.info(f"OpenAI verification response: {ai_response}")
-
-            # Determine if the image contains a recipe
-            is_recipe = 'yes' in ai_response
+            is_recipe = verify_image(image_data)
 
             return jsonify({
                 "success":
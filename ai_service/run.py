@@ -2,7 +2,16 @@
 Entry point for running the AI Service
 """
 
-from app import app
-
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5050, debug=True)
\ No newline at end of file
+    # Imported here: spawned image workers re-import this script as __mp_main__
+    # and must not build the app, its threads and its provider clients
+    from werkzeug.serving import is_running_from_reloader
+    from app import app
+    from config import AI_SERVICE_SOCKET, AI_SERVICE_DEBUG
+    from socket_transport import serve_socket
+
+    # With the debug reloader the first process only watches files and restarts the
+    # child that serves requests; otherwise this process serves the socket itself
+    if AI_SERVICE_SOCKET and (not AI_SERVICE_DEBUG or is_running_from_reloader()):
+        serve_socket(app, AI_SERVICE_SOCKET)
+    app.run(host='0.0.0.0', port=5050, debug=AI_SERVICE_DEBUG)
\ No newline at end of file
@@ -0,0 +1,204 @@
+"""
+Priority scheduling of provider calls for AI Service
+
+Every provider call takes a slot from a shared scheduler. Calls are tagged with a
+priority class ("interactive" or "bulk"), taken from the route and optionally
+lowered with the X-Priority header, and waiting calls are dispatched by weighted fair queuing across
+classes. Each class can reserve slots and a share of the provider call rate that
+other classes never take, so a large import cannot starve interactive uploads.
+"""
+
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from flask import request
+from config import (SCHEDULER_CONCURRENCY, SCHEDULER_WEIGHTS, SCHEDULER_RESERVED_SLOTS,
+                    SCHEDULER_RATE_LIMIT, SCHEDULER_RESERVED_RATE, SCHEDULER_DEFAULT_CLASS,
+                    SCHEDULER_ROUTE_CLASSES)
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+PRIORITY_HEADER = "X-Priority"
+# Provider call rate window in seconds
+RATE_WINDOW = 60.0
+
+# Priority class of the calls made by the current request or task
+_priority = contextvars.ContextVar("priority", default=None)
+
+
+def current_class():
+    """Return the priority class of the current request or task."""
+    return _priority.get() or SCHEDULER_DEFAULT_CLASS
+
+
+@contextmanager
+def priority(priority_class):
+    """Run the enclosed provider calls in a priority class."""
+    token = _priority.set(priority_class)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class FairScheduler:
+    """Weighted fair queuing of provider calls with reserved slots and rate per class."""
+
+    def __init__(self, concurrency, weights, reserved_slots=None, rate_limit=0, reserved_rate=None):
+        self.concurrency = concurrency
+        self.weights = weights
+        self.reserved_slots = reserved_slots or {}
+        self.rate_limit = rate_limit
+        self.reserved_rate = reserved_rate or {}
+        self.condition = threading.Condition()
+        self.queues = {name: deque() for name in weights}
+        self.running = dict.fromkeys(weights, 0)
+        # Virtual time per class: advances by 1 / weight for every dispatched call
+        self.virtual_time = dict.fromkeys(weights, 0.0)
+        self.dispatch_times = {name: deque() for name in weights}
+        self.dispatched = dict.fromkeys(weights, 0)
+        self.queue_ms = {name: deque(maxlen=1000) for name in weights}
+
+    def _others_reserved_slots(self, name):
+        return sum(max(0, slots - self.running[other])
+                   for other, slots in self.reserved_slots.items() if other != name)
+
+    def _others_reserved_rate(self, name):
+        return sum(max(0.0, share * self.rate_limit - len(self.dispatch_times[other]))
+                   for other, share in self.reserved_rate.items() if other != name)
+
+    def _expire(self, now):
+        for times in self.dispatch_times.values():
+            while times and now - times[0] >= RATE_WINDOW:
+                times.popleft()
+
+    def _can_run(self, name):
+        free = self.concurrency - sum(self.running.values())
+        if free - self._others_reserved_slots(name) <= 0:
+            return False
+        if self.rate_limit:
+            used = sum(len(times) for times in self.dispatch_times.values())
+            if used + self._others_reserved_rate(name) >= self.rate_limit:
+                return False
+        return True
+
+    def _next_class(self):
+        """Return the waiting class with the smallest virtual time that may run now."""
+        ready = [name for name, queue in self.queues.items() if queue and self._can_run(name)]
+        return min(ready, key=self.virtual_time.__getitem__) if ready else None
+
+    def _wait_timeout(self, now):
+        # Slots free up with a notify; rate capacity frees up when the oldest call leaves the window
+        oldest = [times[0] for times in self.dispatch_times.values() if times]
+        return max(0.01, min(oldest) + RATE_WINDOW - now) if self.rate_limit and oldest else None
+
+    def acquire(self, name):
+        """Block until a call of the given class may start. Returns the queue time in seconds."""
+        if name not in self.queues:
+            name = SCHEDULER_DEFAULT_CLASS
+        ticket = object()
+        start = time.perf_counter()
+        with self.condition:
+            queue = self.queues[name]
+            if not queue:
+                # A class that was idle does not bank credit for the time it was away
+                active = [self.virtual_time[other] for other, other_queue in self.queues.items()
+                          if other_queue and other != name]
+                if active:
+                    self.virtual_time[name] = max(self.virtual_time[name], min(active))
+            queue.append(ticket)
+            while True:
+                now = time.monotonic()
+                self._expire(now)
+                if queue[0] is ticket and self._next_class() == name:
+                    break
+                self.condition.wait(self._wait_timeout(now))
+
+            queue.popleft()
+            self.running[name] += 1
+            self.virtual_time[name] += 1.0 / self.weights[name]
+            self.dispatch_times[name].append(time.monotonic())
+            self.dispatched[name] += 1
+            waited = time.perf_counter() - start
+            self.queue_ms[name].append(waited * 1000)
+            # The next waiter of this or another class may be runnable too
+            self.condition.notify_all()
+        return waited
+
+    def release(self, name):
+        if name not in self.queues:
+            name = SCHEDULER_DEFAULT_CLASS
+        with self.condition:
+            self.running[name] -= 1
+            self.condition.notify_all()
+
+    @contextmanager
+    def slot(self, name=None):
+        """Hold a provider call slot for the current priority class."""
+        name = name or current_class()
+        waited = self.acquire(name)
+        if waited > 1.0:
+            logger.info(f"{name} provider call waited {waited:.1f} s for a slot")
+        try:
+            yield
+        finally:
+            self.release(name)
+
+    def get_stats(self):
+        """Return running, waiting and queue time percentiles per class."""
+        with self.condition:
+            stats = {}
+            for name in self.queues:
+                samples = sorted(self.queue_ms[name])
+                stats[name] = {
+                    "weight": self.weights[name],
+                    "reserved_slots": self.reserved_slots.get(name, 0),
+                    "running": self.running[name],
+                    "waiting": len(self.queues[name]),
+                    "dispatched": self.dispatched[name],
+                    "queue_ms_p50": round(samples[len(samples) // 2], 1) if samples else 0.0,
+                    "queue_ms_p95": round(samples[int(len(samples) * 0.95)], 1) if samples else 0.0,
+                    "queue_ms_max": round(samples[-1], 1) if samples else 0.0,
+                }
+            return stats
+
+
+scheduler = FairScheduler(SCHEDULER_CONCURRENCY, SCHEDULER_WEIGHTS, SCHEDULER_RESERVED_SLOTS,
+                          SCHEDULER_RATE_LIMIT, SCHEDULER_RESERVED_RATE)
+
+
+def get_stats():
+    return scheduler.get_stats()
+
+
+def route_class(path):
+    """Return the priority class of a request path."""
+    for prefix, priority_class in SCHEDULER_ROUTE_CLASSES.items():
+        if path.startswith(prefix):
+            return priority_class
+    return SCHEDULER_DEFAULT_CLASS
+
+
+def request_class():
+    """Return the priority class of the current Flask request.
+
+    The X-Priority header can only lower the class of the route (a class with a
+    smaller weight), so a caller cannot move bulk work into interactive slots.
+    """
+    route = route_class(request.path)
+    requested = request.headers.get(PRIORITY_HEADER, "").strip().lower()
+    if requested in SCHEDULER_WEIGHTS and SCHEDULER_WEIGHTS[requested] <= SCHEDULER_WEIGHTS.get(route, 0):
+        return requested
+    return route
+
+
+def register_scheduling(app):
+    """Tag every request with its priority class."""
+
+    @app.before_request
+    def _set_priority():
+        _priority.set(request_class())
@@ -0,0 +1,342 @@
+"""
+Response schemas and structured-output parsing for AI Service
+
+Every model answer that should be JSON is described by a JSON schema here. The
+schema is sent to the provider's strict structured-output mode where available,
+and the answer is parsed locally with a repair step for near-miss outputs
+(code fences, trailing text, truncation, numbers returned as strings) before
+falling back to a retry.
+"""
+
+import json
+import logging
+import re
+import threading
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+BBOX_SCHEMA = {
+    "type": "object",
+    "required": ["ymin", "xmin", "ymax", "xmax"],
+    "additionalProperties": False,
+    "properties": {
+        "ymin": {"type": "number", "description": "y min coordinate of the bounding box (value should be between 0 and 1000)"},
+        "xmin": {"type": "number", "description": "x min coordinate of the bounding box (value should be between 0 and 1000)"},
+        "ymax": {"type": "number", "description": "y max coordinate of the bounding box (value should be between 0 and 1000)"},
+        "xmax": {"type": "number", "description": "x max coordinate of the bounding box (value should be between 0 and 1000)"}
+    }
+}
+
+RECIPE_SCHEMA = {
+    "type": "object",
+    "required": [
+        "title", "description", "cookingTimeMinutes", "difficulty",
+        "ingredients", "instructions", "servings", "confidence"
+    ],
+    "additionalProperties": False,
+    "properties": {
+        "title": {"type": "string"},
+        "description": {"type": "string"},
+        "cookingTimeMinutes": {"type": "number"},
+        "difficulty": {"type": "string", "enum": ["easy", "medium", "hard"]},
+        "ingredients": {"type": "array", "items": {"type": "string"}},
+        "instructions": {"type": "array", "items": {"type": "string"}},
+        "servings": {"type": "number"},
+        "confidence": {
+            "type": "number",
+            "description": "Confidence that the extraction is complete and correct (between 0 and 1)"
+        }
+    }
+}
+
+CROP_SCHEMA = {
+    "type": "object",
+    "required": ["cover_type", "bbox", "confidence"],
+    "additionalProperties": False,
+    "properties": {
+        "cover_type": {
+            "type": "string",
+            "enum": ["dish_photo", "title_crop"],
+            "description": "Type of cover image to select"
+        },
+        "bbox": BBOX_SCHEMA,
+        "confidence": {
+            "type": "number",
+            "description": "Confidence that the bounding box tightly contains the selected cover (between 0 and 1)"
+        }
+    }
+}
+
+CROP_CANDIDATES_SCHEMA = {
+    "type": "object",
+    "required": ["candidates"],
+    "additionalProperties": False,
+    "properties": {
+        "candidates": {
+            "type": "array",
+            "description": "Cover candidates, best first: the dish photo if there is one, and the recipe title",
+            "items": CROP_SCHEMA
+        }
+    }
+}
+
+PAGE_RECIPE_SCHEMA = {
+    "type": "object",
+    "required": RECIPE_SCHEMA["required"] + ["cover_type", "bbox"],
+    "additionalProperties": False,
+    "properties": dict(RECIPE_SCHEMA["properties"],
+                       cover_type=CROP_SCHEMA["properties"]["cover_type"],
+                       bbox=BBOX_SCHEMA)
+}
+
+MULTI_RECIPE_SCHEMA = {
+    "type": "object",
+    "required": ["recipes"],
+    "additionalProperties": False,
+    "properties": {
+        "recipes": {
+            "type": "array",
+            "description": "Every recipe on the page, in reading order",
+            "items": PAGE_RECIPE_SCHEMA
+        }
+    }
+}
+
+ANALYSIS_SCHEMA = {
+    "type": "object",
+    "required": ["is_recipe", "recipe", "cover_type", "bbox"],
+    "additionalProperties": False,
+    "properties": {
+        "is_recipe": {
+            "type": "boolean",
+            "description": "Whether the image contains a recipe"
+        },
+        "recipe": dict(RECIPE_SCHEMA, description="Extracted recipe. Use empty values if the image does not contain a recipe"),
+        "cover_type": CROP_SCHEMA["properties"]["cover_type"],
+        "bbox": BBOX_SCHEMA
+    }
+}
+
+
+class StructuredOutputError(ValueError):
+    """Raised when a model answer cannot be parsed or repaired to match its schema."""
+
+
+# Per-model parse outcomes: clean parses, repaired parses, failures and retries
+_parse_stats = {}
+_parse_stats_lock = threading.Lock()
+
+
+def _record(model, outcome):
+    with _parse_stats_lock:
+        model_stats = _parse_stats.setdefault(model, {
+            "responses": 0, "clean": 0, "repaired": 0, "failed": 0, "retries": 0
+        })
+        if outcome != "retries":
+            model_stats["responses"] += 1
+        model_stats[outcome] += 1
+
+
+def get_parse_stats():
+    """Return parse outcomes and failure rate for every model."""
+    with _parse_stats_lock:
+        return {
+            model: dict(model_stats, failure_rate=round(
+                model_stats["failed"] / model_stats["responses"], 4) if model_stats["responses"] else 0.0)
+            for model, model_stats in _parse_stats.items()
+        }
+
+
+def response_format(provider, name, schema):
+    """Return the response_format argument enforcing a JSON schema for a provider."""
+    if provider == "together":
+        return {"type": "json_schema", "schema": schema}
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": name, "strict": True, "schema": schema}
+    }
+
+
+def strict_tool(name, description, schema):
+    """Return a strict function-calling tool whose arguments follow a schema."""
+    return {
+        "type": "function",
+        "function": {
+            "name": name,
+            "description": description,
+            "strict": True,
+            "parameters": schema
+        }
+    }
+
+
+def validate(data, schema, path="$"):
+    """Validate data against the subset of JSON schema used here. Returns a list of errors."""
+    expected = schema.get("type")
+    if expected == "object":
+        if not isinstance(data, dict):
+            return [f"{path}: expected object"]
+        errors = [f"{path}: missing required field '{field}'"
+                  for field in schema.get("required", []) if field not in data]
+        for key, sub_schema in schema.get("properties", {}).items():
+            if key in data:
+                errors += validate(data[key], sub_schema, f"{path}.{key}")
+        return errors
+    if expected == "array":
+        if not isinstance(data, list):
+            return [f"{path}: expected array"]
+        errors = []
+        for index, item in enumerate(data):
+            errors += validate(item, schema.get("items", {}), f"{path}[{index}]")
+        return errors
+    if expected == "number" and (isinstance(data, bool) or not isinstance(data, (int, float))):
+        return [f"{path}: expected number"]
+    if expected == "integer" and (isinstance(data, bool) or not isinstance(data, int)):
+        return [f"{path}: expected integer"]
+    if expected == "string" and not isinstance(data, str):
+        return [f"{path}: expected string"]
+    if expected == "boolean" and not isinstance(data, bool):
+        return [f"{path}: expected boolean"]
+    if "enum" in schema and data not in schema["enum"]:
+        return [f"{path}: {data!r} not one of {schema['enum']}"]
+    return []
+
+
+_NUMBER_RE = re.compile(r'-?\d+(?:\.\d+)?')
+
+
+def coerce(data, schema):
+    """Coerce near-miss values (string numbers, scalar lists, ...) to the schema types."""
+    expected = schema.get("type")
+    if expected == "object" and isinstance(data, dict):
+        properties = schema.get("properties", {})
+        return {key: coerce(value, properties[key]) if key in properties else value
+                for key, value in data.items()}
+    if expected == "array":
+        if isinstance(data, str):
+            data = [line for line in data.splitlines() if line.strip()]
+        if isinstance(data, list):
+            return [coerce(item, schema.get("items", {})) for item in data]
+    if expected in ("number", "integer") and isinstance(data, str):
+        match = _NUMBER_RE.search(data)
+        if match:
+            number = float(match.group())
+            return int(number) if expected == "integer" or number.is_integer() else number
+    if expected == "string" and isinstance(data, (int, float)) and not isinstance(data, bool):
+        return str(data)
+    if expected == "string" and "enum" in schema and isinstance(data, str):
+        lowered = data.strip().lower()
+        if lowered in schema["enum"]:
+            return lowered
+    if expected == "boolean" and isinstance(data, str):
+        lowered = data.strip().lower()
+        if lowered in ("true", "yes"):
+            return True
+        if lowered in ("false", "no"):
+            return False
+    return data
+
+
+def _close_truncated(text):
+    """Close any strings, arrays and objects left open by a truncated answer."""
+    stack = []
+    in_string = False
+    escape = False
+    for ch in text:
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in '{[':
+            stack.append('}' if ch == '{' else ']')
+        elif ch in '}]' and stack:
+            stack.pop()
+    if in_string:
+        text += '"'
+    text = text.rstrip().rstrip(',')
+    return text + ''.join(reversed(stack))
+
+
+def _repair(text):
+    """Try to recover a JSON object from a near-miss answer. Returns None on failure."""
+    start = text.find('{')
+    if start < 0:
+        return None
+    text = text[start:]
+    decoder = json.JSONDecoder()
+
+    # Trailing text after a complete object
+    try:
+        return decoder.raw_decode(text)[0]
+    except json.JSONDecodeError:
+        pass
+
+    # Trailing commas before closing brackets
+    cleaned = re.sub(r',\s*([}\]])', r'\1', text)
+    try:
+        return decoder.raw_decode(cleaned)[0]
+    except json.JSONDecodeError:
+        pass
+
+    # Truncated output: close what is open, dropping incomplete trailing members
+    candidate = cleaned
+    for _ in range(20):
+        try:
+            return json.loads(_close_truncated(candidate))
+        except json.JSONDecodeError:
+            cut = candidate.rfind(',')
+            if cut <= 0:
+                return None
+            candidate = candidate[:cut]
+    return None
+
+
+def parse_structured(text, schema, model):
+    """Parse a model answer against a schema, repairing near-miss outputs.
+
+    Returns the parsed data. Raises StructuredOutputError if the answer cannot be
+    repaired into an object that matches the schema.
+    """
+    text = (text or "").strip()
+    try:
+        data = json.loads(text)
+        if not validate(data, schema):
+            _record(model, "clean")
+            return data
+    except json.JSONDecodeError:
+        data = _repair(text)
+
+    if data is not None:
+        data = coerce(data, schema)
+        errors = validate(data, schema)
+        if not errors:
+            _record(model, "repaired")
+            logger.info(f"Repaired structured output from {model}")
+            return data
+        logger.warning(f"Structured output from {model} does not match schema: {errors[:5]}")
+    else:
+        logger.warning(f"Could not parse structured output from {model}: {text[:200]}")
+
+    _record(model, "failed")
+    raise StructuredOutputError(f"Could not parse structured output from {model}")
+
+
+def request_structured(call, schema, model, retries=1):
+    """Call a model and parse its answer, retrying only when repair fails.
+
+    call() performs the model call and returns the raw answer text.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return parse_structured(call(), schema, model)
+        except StructuredOutputError:
+            if attempt == retries:
+                raise
+            _record(model, "retries")
+            logger.info(f"Retrying structured output request to {model}")
@@ -0,0 +1,249 @@
+"""
+Unix domain socket transport for AI Service
+
+Co-located callers such as the Node server can send requests over a Unix domain
+socket instead of loopback HTTP. Each request and response is one frame:
+
+    header length (4 bytes, big endian) | body length (4 bytes, big endian) | header | body
+
+The request header is UTF-8 JSON: {"method", "path", "headers", "fields"}. The
+body holds the raw image bytes, placed in fields["image"] (or the field named by
+"image_field"); with "image_lengths" the body is split into several images and
+the field gets a list. The image is not base64 encoded on the wire, so the body
+is a third smaller and the caller skips the encoding.
+
+Requests are dispatched to the Flask app, so routes, hooks and headers such as
+X-Priority behave exactly as over HTTP. The fields are handed to the request as
+already parsed JSON, so the image is never serialized into a JSON body; routes
+still receive it base64 encoded, as over HTTP. The response header is
+{"status", "content_type"} and the body is the response body. A connection can
+carry any number of frames, one after another.
+"""
+
+import base64
+import fcntl
+import json
+import logging
+import os
+import socketserver
+import stat
+import struct
+import threading
+from flask import Request
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+from config import SOCKET_MAX_FRAME_BYTES
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+PREFIX = struct.Struct(">II")
+# WSGI environ key holding the parsed JSON fields of a framed request
+FIELDS_KEY = "ai_service.socket_fields"
+
+_stats = {"connections": 0, "requests": 0, "errors": 0, "bytes_in": 0, "bytes_out": 0}
+_stats_lock = threading.Lock()
+_server = None
+_start_lock = threading.Lock()
+# Held open for the life of the process that serves the socket
+_lock_file = None
+# Types of the optional request header keys
+HEADER_TYPES = {"method": str, "path": str, "headers": dict, "fields": dict, "image_field": str}
+
+
+class FrameError(ValueError):
+    """Raised for a malformed or oversized frame; the connection is closed after replying."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def read_exactly(stream, size):
+    """Read size bytes, or return None if the stream ends before the first byte."""
+    data = stream.read(size)
+    if not data:
+        return None
+    if len(data) < size:
+        raise FrameError("Connection closed in the middle of a frame")
+    return data
+
+
+def read_frame(stream, max_bytes=SOCKET_MAX_FRAME_BYTES):
+    """Return (header dict, body bytes, frame size) of the next frame, or None at the end of the stream."""
+    prefix = read_exactly(stream, PREFIX.size)
+    if prefix is None:
+        return None
+    header_length, body_length = PREFIX.unpack(prefix)
+    if header_length + body_length > max_bytes:
+        raise FrameError(f"Frame of {header_length + body_length} bytes exceeds {max_bytes}", status=413)
+    try:
+        header = json.loads(read_exactly(stream, header_length) or b"")
+    except ValueError:
+        raise FrameError("Frame header is not valid JSON")
+    if not isinstance(header, dict):
+        raise FrameError("Frame header must be a JSON object")
+    body = read_exactly(stream, body_length) if body_length else b""
+    return header, body or b"", PREFIX.size + header_length + body_length
+
+
+def write_frame(stream, header, body=b""):
+    """Write one frame and flush it."""
+    encoded = json.dumps(header).encode("utf-8")
+    stream.write(PREFIX.pack(len(encoded), len(body)) + encoded)
+    stream.write(body)
+    stream.flush()
+    return PREFIX.size + len(encoded) + len(body)
+
+
+class FramedRequest(Request):
+    """Flask request that returns the fields of a framed request without parsing a JSON body."""
+
+    def get_json(self, force=False, silent=False, cache=True):
+        if FIELDS_KEY in self.environ:
+            return self.environ[FIELDS_KEY]
+        return super().get_json(force=force, silent=silent, cache=cache)
+
+
+def check_header(header):
+    """Raise FrameError unless the keys of a request header have the documented types."""
+    for key, kind in HEADER_TYPES.items():
+        if header.get(key) is not None and not isinstance(header[key], kind):
+            raise FrameError(f"Frame header '{key}' must be of type {kind.__name__}")
+    if not all(isinstance(value, str) for value in (header.get("headers") or {}).values()):
+        raise FrameError("Frame header 'headers' values must be strings")
+    lengths = header.get("image_lengths")
+    if lengths is not None and not (
+            isinstance(lengths, list)
+            and all(isinstance(length, int) and not isinstance(length, bool) and length >= 0
+                    for length in lengths)):
+        raise FrameError("Frame header 'image_lengths' must be a list of non-negative integers")
+
+
+def build_fields(header, body):
+    """Return the JSON fields of a request with the raw image bytes of the body placed in them."""
+    check_header(header)
+    fields = dict(header.get("fields") or {})
+    if not body:
+        return fields
+    field = header.get("image_field", "image")
+    lengths = header.get("image_lengths")
+    if lengths is None:
+        fields[field] = base64.b64encode(body).decode("ascii")
+        return fields
+    if sum(lengths) != len(body):
+        raise FrameError("image_lengths do not add up to the body length")
+    images, offset = [], 0
+    for length in lengths:
+        images.append(base64.b64encode(body[offset:offset + length]).decode("ascii"))
+        offset += length
+    fields[field] = images
+    return fields
+
+
+def dispatch(app, header, body):
+    """Run one framed request through the Flask app and return (status, content type, body).
+
+    The app must use FramedRequest as its request class (start_socket_server sets it).
+    """
+    fields = build_fields(header, body)
+    try:
+        builder = EnvironBuilder(path=header.get("path") or "/", method=header.get("method") or "POST",
+                                 headers=header.get("headers") or {}, content_type="application/json",
+                                 environ_base={"REMOTE_ADDR": "unix", FIELDS_KEY: fields})
+    except (TypeError, ValueError) as e:
+        raise FrameError(f"Invalid request in frame header: {e}")
+    try:
+        app_iter, status, headers = run_wsgi_app(app, builder.get_environ(), buffered=True)
+        return int(status.split(" ", 1)[0]), headers.get("Content-Type"), b"".join(app_iter)
+    finally:
+        builder.close()
+
+
+class FrameHandler(socketserver.StreamRequestHandler):
+    """Serve the frames of one connection until the caller closes it."""
+
+    def handle(self):
+        _count("connections")
+        while True:
+            try:
+                frame = read_frame(self.rfile)
+                if frame is None:
+                    return
+                header, body, size = frame
+                _count("requests", bytes_in=size)
+                status, content_type, response = dispatch(self.server.app, header, body)
+                sent = write_frame(self.wfile, {"status": status, "content_type": content_type}, response)
+                _count(bytes_out=sent)
+            except FrameError as e:
+                _count("errors")
+                logger.warning(f"Rejected socket frame: {e}")
+                error = json.dumps({"success": False, "error": str(e)}).encode("utf-8")
+                try:
+                    write_frame(self.wfile, {"status": e.status, "content_type": "application/json"}, error)
+                except OSError:
+                    pass
+                return
+            except (BrokenPipeError, ConnectionResetError):
+                return
+
+
+class SocketServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, app):
+        self.app = app
+        super().__init__(path, FrameHandler)
+
+
+def _count(*names, **amounts):
+    with _stats_lock:
+        for name in names:
+            _stats[name] += 1
+        for name, amount in amounts.items():
+            _stats[name] += amount
+
+
+def start_socket_server(app, path):
+    """Serve the app on a Unix domain socket at path in a background thread and return the server."""
+    global _server
+    if os.path.exists(path):
+        if not stat.S_ISSOCK(os.stat(path).st_mode):
+            raise RuntimeError(f"{path} exists and is not a socket")
+        # Left behind by an earlier run
+        os.unlink(path)
+    app.request_class = FramedRequest
+    _server = SocketServer(path, app)
+    os.chmod(path, 0o660)
+    threading.Thread(target=_server.serve_forever, name="socket-transport", daemon=True).start()
+    logger.info(f"Serving framed requests on unix socket {path}")
+    return _server
+
+
+def serve_socket(app, path):
+    """Start the socket listener at path once, in whichever process gets there first.
+
+    Safe to call from every process of a multi-process server: an exclusive lock
+    on path + ".lock" lets one process bind the socket, and repeated calls in
+    that process return its server. Returns None if another process serves it.
+    """
+    global _lock_file
+    with _start_lock:
+        if _server is not None:
+            return _server
+        lock_file = open(path + ".lock", "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            logger.info(f"Unix socket {path} is served by another process")
+            return None
+        _lock_file = lock_file
+        return start_socket_server(app, path)
+
+
+def get_stats():
+    """Return socket transport counters, or None when the socket is not served."""
+    if _server is None:
+        return None
+    with _stats_lock:
+        return dict(_stats, path=_server.server_address)
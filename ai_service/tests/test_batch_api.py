@@ -0,0 +1,134 @@
+"""
+End-to-end test of provider batch API mode with LocalBatchBackend
+
+Run from ai_service/: python -m unittest discover tests
+"""
+
+import os
+import sys
+import threading
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Importing config builds the provider clients; no request leaves the process
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("TOGETHER_API_KEY", "test")
+
+import usage
+from batch_api import BatchSession, BatchRequestError, LocalBatchBackend, batch_mode, COMPLETED
+from config import BATCH_API_PRICE_FACTOR
+from providers import chat_completion
+
+MODEL = "gpt-4.1-mini"
+PROMPT_TOKENS = 1000
+COMPLETION_TOKENS = 200
+
+
+def respond(body):
+    """Echo the request text back as a completion; requests for "fail" are rejected."""
+    text = body["messages"][0]["content"]
+    if text == "fail":
+        error = ValueError("invalid request")
+        error.status_code = 400
+        raise error
+    return {
+        "id": "chatcmpl-local",
+        "object": "chat.completion",
+        "created": 0,
+        "model": body["model"],
+        "choices": [{"index": 0, "finish_reason": "stop",
+                     "message": {"role": "assistant", "content": f"answer to {text}"}}],
+        "usage": {"prompt_tokens": PROMPT_TOKENS, "completion_tokens": COMPLETION_TOKENS,
+                  "total_tokens": PROMPT_TOKENS + COMPLETION_TOKENS},
+    }
+
+
+class PollCountingBackend(LocalBatchBackend):
+    """LocalBatchBackend that counts the status polls of its jobs."""
+
+    def __init__(self, respond):
+        super().__init__(respond)
+        self.polls = []
+
+    def status(self, job_id):
+        result = super().status(job_id)
+        self.polls.append((job_id, result[0]))
+        return result
+
+
+class BatchSessionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = PollCountingBackend(respond)
+        self.session = BatchSession(lambda provider: self.backend, max_requests=10,
+                                    linger=0.05, poll_interval=0.01)
+
+    def tearDown(self):
+        self.session.close()
+
+    def run_calls(self, texts):
+        """Send one provider call per text from its own thread, in batch mode."""
+        results = {}
+
+        def call(text):
+            with batch_mode(self.session):
+                try:
+                    response = chat_completion("openai", MODEL, messages=[{"role": "user", "content": text}])
+                    results[text] = response.choices[0].message.content
+                except BatchRequestError as e:
+                    results[text] = e
+
+        threads = [threading.Thread(target=call, args=(text,)) for text in texts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=10)
+        return results
+
+    def test_submit_poll_collect(self):
+        texts = [f"item {i}" for i in range(25)]
+        results = self.run_calls(texts)
+
+        # Every caller gets the answer to its own request
+        self.assertEqual(results, {text: f"answer to {text}" for text in texts})
+        stats = self.session.get_stats()
+        self.assertEqual(stats["requests"], 25)
+        self.assertEqual(stats["failed_requests"], 0)
+        self.assertEqual(stats["queued"], 0)
+        # Full jobs are submitted at max_requests, the rest after the linger time
+        self.assertGreaterEqual(stats["jobs"], 3)
+        self.assertEqual(len(self.backend.jobs), stats["jobs"])
+        # Each job is polled while pending and collected once completed
+        for job_id in self.backend.jobs:
+            states = [state for polled, state in self.backend.polls if polled == job_id]
+            self.assertGreater(len(states), 1)
+            self.assertEqual(states[-1], COMPLETED)
+
+    def test_per_item_errors(self):
+        results = self.run_calls(["good", "fail", "also good"])
+
+        self.assertEqual(results["good"], "answer to good")
+        self.assertEqual(results["also good"], "answer to also good")
+        # A failed request fails only its own call, with the status of the batch result
+        self.assertIsInstance(results["fail"], BatchRequestError)
+        self.assertEqual(results["fail"].status_code, 400)
+        stats = self.session.get_stats()
+        self.assertEqual(stats["requests"], 3)
+        self.assertEqual(stats["failed_requests"], 1)
+        self.assertEqual(stats["failed_jobs"], 0)
+
+    def test_usage_at_batch_prices(self):
+        key = f"openai/{MODEL}"
+        before = usage.get_report()["by_model"].get(key, {"calls": 0, "cost_usd": 0.0})
+        self.run_calls([f"priced {i}" for i in range(4)])
+        after = usage.get_report()["by_model"][key]
+
+        full_price = usage.estimate_cost(MODEL, PROMPT_TOKENS, COMPLETION_TOKENS)
+        self.assertGreater(full_price, 0.0)
+        self.assertEqual(after["calls"] - before["calls"], 4)
+        self.assertAlmostEqual(after["cost_usd"] - before["cost_usd"],
+                               4 * full_price * BATCH_API_PRICE_FACTOR["openai"], places=6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+"""
+Tests of ingest.py input reading: every archive member is read once and intact
+
+Run from ai_service/: python -m unittest discover tests
+"""
+
+import asyncio
+import hashlib
+import io
+import os
+import sys
+import tarfile
+import tempfile
+import types
+import unittest
+import zipfile
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Importing config builds the provider clients; no request leaves the process
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("TOGETHER_API_KEY", "test")
+
+from ingest import Ingest, iter_items
+
+MEMBERS = 300
+
+
+def member_bytes(index):
+    """Incompressible bytes of a fake image, so gzip blocks span members."""
+    return os.urandom(2000 + index * 7)
+
+
+class ChecksumIngest(Ingest):
+    """Ingest whose pipeline only reads each item and records its checksum."""
+
+    def __init__(self, args):
+        super().__init__(args, None, None)
+        self.checksums = {}
+
+    async def process(self, item_id, source, read):
+        raw_bytes = await asyncio.get_running_loop().run_in_executor(self.reader, read)
+        # Yield so reads of other items interleave with this one
+        await asyncio.sleep(0)
+        self.checksums[source] = hashlib.sha256(raw_bytes).hexdigest()
+
+
+class IngestInputTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.expected = {}
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write_tar(self, name, mode):
+        path = os.path.join(self.tmp.name, name)
+        with tarfile.open(path, mode) as archive:
+            for index in range(MEMBERS):
+                data = member_bytes(index)
+                info = tarfile.TarInfo(f"pages/page-{index:03d}.jpg")
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+                self.expected[f"{path}:{info.name}"] = hashlib.sha256(data).hexdigest()
+            # Members that are not images are skipped
+            notes = b"not an image"
+            info = tarfile.TarInfo("pages/notes.txt")
+            info.size = len(notes)
+            archive.addfile(info, io.BytesIO(notes))
+        return path
+
+    def write_zip(self, name):
+        path = os.path.join(self.tmp.name, name)
+        with zipfile.ZipFile(path, "w") as archive:
+            for index in range(MEMBERS):
+                data = member_bytes(index)
+                archive.writestr(f"page-{index:03d}.jpg", data)
+                self.expected[f"{path}:page-{index:03d}.jpg"] = hashlib.sha256(data).hexdigest()
+        return path
+
+    def run_ingest(self, inputs, skip=()):
+        out = os.path.join(self.tmp.name, "out")
+        args = types.SimpleNamespace(out=out, workers=1, concurrency=8, max_side=100)
+        ingest = ChecksumIngest(args)
+        try:
+            asyncio.run(ingest.run(iter_items(inputs, skip)))
+        finally:
+            ingest.close()
+        return ingest.checksums
+
+    def test_tar_gz_members_all_present_and_intact(self):
+        path = self.write_tar("photos.tar.gz", "w:gz")
+        self.assertEqual(self.run_ingest([path]), self.expected)
+
+    def test_tar_and_zip_inputs(self):
+        inputs = [self.write_tar("photos.tar", "w"), self.write_zip("photos.zip")]
+        self.assertEqual(self.run_ingest(inputs), self.expected)
+
+    def test_finished_items_are_skipped(self):
+        path = self.write_tar("photos.tgz", "w:gz")
+        done = {item_id for item_id, source, _ in iter_items([path]) if source.endswith("0.jpg")}
+        checksums = self.run_ingest([path], done)
+        self.assertEqual(len(checksums), MEMBERS - len(done))
+        self.assertTrue(all(self.expected[source] == checksum for source, checksum in checksums.items()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+"""
+Tests of ingredients.py parsing and scaling, one table row per ingredient line
+
+Run from ai_service/: python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ingredients import parse_ingredient, scale_ingredient
+
+# line: (quantity, quantity_max, unit, item, size, alt)
+PARSES = {
+    # Numbers and fractions
+    "2 eggs": (2.0, None, None, "eggs", None, None),
+    "0,5 l milk": (0.5, None, "l", "milk", None, None),
+    "1/2 cup sugar": (0.5, None, "cup", "sugar", None, None),
+    "1 1/2 cups flour": (1.5, None, "cup", "flour", None, None),
+    "½ tsp salt": (0.5, None, "tsp", "salt", None, None),
+    "1½ cups milk": (1.5, None, "cup", "milk", None, None),
+    "three cloves garlic": (3.0, None, "clove", "garlic", None, None),
+    "a pinch of salt": (1.0, None, "pinch", "salt", None, None),
+    "1,000 g flour": (1000.0, None, "g", "flour", None, None),
+    # Ranges
+    "2-3 tbsp olive oil": (2.0, 3.0, "tbsp", "olive oil", None, None),
+    "2 to 3 carrots": (2.0, 3.0, None, "carrots", None, None),
+    "1½–2 cups stock": (1.5, 2.0, "cup", "stock", None, None),
+    # Pack sizes
+    "2 x 150g duck breasts": (2.0, None, None, "duck breasts", {"quantity": 150.0, "unit": "g"}, None),
+    "1 (400g) tin tomatoes": (1.0, None, "tin", "tomatoes", {"quantity": 400.0, "unit": "g"}, None),
+    "2 (8 oz) packages cream cheese": (2.0, None, "packet", "cream cheese", {"quantity": 8.0, "unit": "oz"}, None),
+    "1 can (14 oz) tomatoes": (1.0, None, "can", "tomatoes", {"quantity": 14.0, "unit": "oz"}, None),
+    "12 oz can tomatoes": (1.0, None, "can", "tomatoes", {"quantity": 12.0, "unit": "oz"}, None),
+    "2 14-oz cans beans": (2.0, None, "can", "beans", {"quantity": 14.0, "unit": "oz"}, None),
+    # Equivalent amounts in brackets after the unit
+    "1 cup (240 ml) milk": (1.0, None, "cup", "milk", None, {"quantity": 240.0, "unit": "ml", "unit_word": None}),
+    "200g (7 oz) flour": (200.0, None, "g", "flour", None, {"quantity": 7.0, "unit": "oz", "unit_word": None}),
+    "1 cup (2 sticks) butter": (1.0, None, "cup", "butter", None,
+                                {"quantity": 2.0, "unit": "stick", "unit_word": "sticks"}),
+    # Brackets that are not an amount stay in the item
+    "1 large onion (chopped)": (1.0, None, None, "large onion (chopped)", None, None),
+    "1 cup (about 240 ml) milk": (1.0, None, "cup", "(about 240 ml) milk", None, None),
+    # No usable quantity
+    "salt to taste": (None, None, None, "salt to taste", None, None),
+    "1/0 cup sugar": (None, None, None, "1/0 cup sugar", None, None),
+}
+
+# (line, factor, units): scaled text
+SCALED = {
+    ("1 1/2 cups milk", 2, None): "3 cups milk",
+    ("1 1/2 cups milk", 2.5, "metric"): "885 ml milk",
+    ("1 lemon", 2, None): "2 lemons",
+    ("2 eggs", 0.5, None): "1 egg",
+    ("2-3 tbsp olive oil", 2, None): "4-6 tbsp olive oil",
+    ("2 x 150g duck breast fillets, skin on", 2.5, None): "5 x 150g duck breast fillets, skin on",
+    ("1 cup (240 ml) milk", 2, None): "2 cups (480 ml) milk",
+    ("1 cup (240 ml) milk", 0.5, None): "½ cup (120 ml) milk",
+    ("1 cup (240 ml) milk", 2, "metric"): "475 ml milk",
+    ("200g (7 oz) flour", 2, None): "400 g (14 oz) flour",
+    ("1 cup (2 sticks) butter", 2, None): "2 cups (4 sticks) butter",
+    ("1 cup (2 sticks) butter", 0.5, None): "½ cup (1 stick) butter",
+    ("2 (8 oz) packages cream cheese", 2, None): "4 x 8oz packages cream cheese",
+    ("2 (8 oz) packages cream cheese", 0.5, None): "1 x 8oz package cream cheese",
+    ("1 pkg yeast", 2, None): "2 pkgs yeast",
+    ("a pinch of salt", 2, None): "2 pinches salt",
+    ("salt to taste", 2, None): "salt to taste",
+}
+
+
+class ParseIngredientTest(unittest.TestCase):
+    def test_parse(self):
+        for line, expected in PARSES.items():
+            with self.subTest(line=line):
+                parsed = parse_ingredient(line)
+                actual = tuple(parsed[key] for key in ("quantity", "quantity_max", "unit", "item", "size", "alt"))
+                self.assertEqual(actual, expected)
+
+    def test_scale(self):
+        for (line, factor, units), expected in SCALED.items():
+            with self.subTest(line=line, factor=factor, units=units):
+                self.assertEqual(scale_ingredient(parse_ingredient(line), factor, units)["text"], expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
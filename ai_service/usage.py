@@ -0,0 +1,253 @@
+"""
+Token and cost accounting for AI Service
+
+Every provider call records its prompt, image, cached and completion tokens and
+an estimated cost, rolled up per provider/model, per route, per caller, per image
+size and per prompt version. Budgets per route and per caller (USD per
+USAGE_BUDGET_WINDOW) downgrade calls to cheaper models and stop cascade
+escalation once they are used up.
+"""
+
+import base64
+import contextvars
+import io
+import logging
+import math
+import threading
+import time
+from PIL import Image
+from flask import request
+from config import (MODEL_PRICING, BATCH_API_PRICE_FACTOR, USAGE_ROUTE_BUDGETS, USAGE_CALLER_BUDGETS, USAGE_BUDGET_WINDOW,
+                    USAGE_FALLBACK_MODELS, USAGE_LOG_INTERVAL)
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+CALLER_HEADER = "X-Caller"
+# Base64 characters decoded to read image dimensions; enough for JPEG headers with EXIF
+_HEADER_CHARS = 96 * 1024
+# Image size buckets in megapixels
+_SIZE_BUCKETS = [(1, "<1MP"), (4, "1-4MP"), (12, "4-12MP"), (math.inf, ">12MP")]
+
+# Route and caller of the current request or task
+_tags = contextvars.ContextVar("usage_tags", default=("internal", "anonymous"))
+
+_totals = {"model": {}, "route": {}, "caller": {}, "image_size": {}, "prompt": {}}
+# Budget spend per route and caller in the current window
+_spent = {"route": {}, "caller": {}}
+_window_start = 0.0
+_lock = threading.Lock()
+_log_thread = None
+
+
+def current_tags():
+    """Return (route, caller) of the current request or task."""
+    return _tags.get()
+
+
+def _image_size(url):
+    """Return (width, height) of a base64 data URL image, or None."""
+    if not url.startswith("data:"):
+        return None
+    data = url.split(",", 1)[-1]
+    # Dimensions are in the header; only decode the whole image if the header is larger
+    for chars in (_HEADER_CHARS, len(data)):
+        try:
+            prefix = data[:chars - chars % 4] if chars < len(data) else data
+            return Image.open(io.BytesIO(base64.b64decode(prefix))).size
+        except Exception:
+            if chars >= len(data):
+                return None
+    return None
+
+
+def estimate_image_tokens(width, height):
+    """Estimate prompt tokens of a high-detail image (512 px tiles after provider scaling)."""
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def _message_images(messages):
+    """Yield (width, height) of every image in chat messages."""
+    for message in messages:
+        content = message.get("content")
+        if not isinstance(content, list):
+            continue
+        for part in content:
+            if isinstance(part, dict) and part.get("type") == "image_url":
+                size = _image_size(part.get("image_url", {}).get("url", ""))
+                if size:
+                    yield size
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    """Return the estimated cost in USD of a call, or 0.0 for models without pricing."""
+    pricing = MODEL_PRICING.get(model)
+    if not pricing:
+        return 0.0
+    return (prompt_tokens * pricing["input"] + completion_tokens * pricing["output"]) / 1_000_000
+
+
+def _reset_window(now):
+    global _window_start
+    if now - _window_start >= USAGE_BUDGET_WINDOW:
+        _window_start = now - now % USAGE_BUDGET_WINDOW
+        for spent in _spent.values():
+            spent.clear()
+
+
+def _add(group, key, entry):
+    totals = _totals[group].setdefault(key, {
+        "calls": 0, "prompt_tokens": 0, "image_tokens": 0, "cached_tokens": 0,
+        "completion_tokens": 0, "cost_usd": 0.0
+    })
+    for field, value in entry.items():
+        totals[field] += value
+
+
+def record(provider, model, messages, response, prompt_id=None, batch=False):
+    """Record the usage of a provider call, at batch prices for batch API calls. Never raises."""
+    try:
+        usage = getattr(response, "usage", None)
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", 0) or 0
+        sizes = list(_message_images(messages))
+        entry = {
+            "calls": 1,
+            "prompt_tokens": prompt_tokens,
+            # Providers do not report image tokens separately
+            "image_tokens": sum(estimate_image_tokens(*size) for size in sizes),
+            "cached_tokens": cached_tokens,
+            "completion_tokens": completion_tokens,
+            "cost_usd": estimate_cost(model, prompt_tokens, completion_tokens)
+                        * (BATCH_API_PRICE_FACTOR.get(provider, 1.0) if batch else 1.0),
+        }
+        megapixels = sum(width * height for width, height in sizes) / 1_000_000
+        size_bucket = next(name for limit, name in _SIZE_BUCKETS if megapixels < limit) if sizes else "no image"
+
+        route, caller = current_tags()
+        with _lock:
+            _add("model", f"{provider}/{model}", entry)
+            _add("route", route, entry)
+            _add("caller", caller, entry)
+            _add("image_size", size_bucket, entry)
+            if prompt_id:
+                _add("prompt", prompt_id, entry)
+            _reset_window(time.time())
+            _spent["route"][route] = _spent["route"].get(route, 0.0) + entry["cost_usd"]
+            _spent["caller"][caller] = _spent["caller"].get(caller, 0.0) + entry["cost_usd"]
+    except Exception as e:
+        logger.warning(f"Could not record usage for {model}: {e}")
+
+
+def budget_exhausted():
+    """Return a description of the used-up budget of the current route or caller, or None."""
+    route, caller = current_tags()
+    with _lock:
+        _reset_window(time.time())
+        for group, key, budgets in (("route", route, USAGE_ROUTE_BUDGETS),
+                                    ("caller", caller, USAGE_CALLER_BUDGETS)):
+            limit = budgets.get(key)
+            if limit is not None and _spent[group].get(key, 0.0) >= limit:
+                return f"{group} {key} budget of ${limit:.2f} used up"
+    return None
+
+
+def budget_model(model):
+    """Return the model to call: the cheapest fallback of a model once a budget is used up."""
+    reason = budget_exhausted()
+    if not reason:
+        return model
+    cheaper = model
+    while cheaper in USAGE_FALLBACK_MODELS:
+        cheaper = USAGE_FALLBACK_MODELS[cheaper]
+    if cheaper != model:
+        logger.info(f"{reason}, using {cheaper} instead of {model}")
+    return cheaper
+
+
+def _round(totals):
+    return {key: dict(entry, cost_usd=round(entry["cost_usd"], 6)) for key, entry in totals.items()}
+
+
+def _with_cache_share(totals):
+    # Share of prompt tokens served from the provider's prompt cache
+    return {key: dict(entry, cached_share=round(entry["cached_tokens"] / entry["prompt_tokens"], 4)
+                      if entry["prompt_tokens"] else 0.0)
+            for key, entry in totals.items()}
+
+
+def get_report():
+    """Return usage totals per model, route, caller, image size and prompt, and budget status."""
+    with _lock:
+        _reset_window(time.time())
+        budgets = {
+            group: {
+                key: {
+                    "limit_usd": limit,
+                    "spent_usd": round(_spent[group].get(key, 0.0), 6),
+                    "exhausted": _spent[group].get(key, 0.0) >= limit
+                }
+                for key, limit in limits.items()
+            }
+            for group, limits in (("route", USAGE_ROUTE_BUDGETS), ("caller", USAGE_CALLER_BUDGETS))
+        }
+        return {
+            "by_model": _round(_totals["model"]),
+            "by_route": _round(_totals["route"]),
+            "by_caller": _round(_totals["caller"]),
+            "by_image_size": _round(_totals["image_size"]),
+            "by_prompt": _with_cache_share(_round(_totals["prompt"])),
+            "budgets": budgets,
+            "budget_window_s": USAGE_BUDGET_WINDOW,
+        }
+
+
+def _summary():
+    with _lock:
+        entries = list(_totals["model"].values())
+        by_route = {route: entry["cost_usd"] for route, entry in _totals["route"].items()}
+    calls = sum(entry["calls"] for entry in entries)
+    prompt = sum(entry["prompt_tokens"] for entry in entries)
+    images = sum(entry["image_tokens"] for entry in entries)
+    completion = sum(entry["completion_tokens"] for entry in entries)
+    cost = sum(entry["cost_usd"] for entry in entries)
+    routes = ", ".join(f"{route} ${value:.4f}" for route, value in sorted(by_route.items()))
+    return calls, (f"Usage: {calls} calls, {prompt} prompt tokens (~{images} image), "
+                   f"{completion} completion tokens, ${cost:.4f} [{routes}]")
+
+
+def _log_usage(interval):
+    last_calls = 0
+    while True:
+        time.sleep(interval)
+        calls, line = _summary()
+        # Stay quiet while the service is idle
+        if calls != last_calls:
+            logger.info(line)
+            last_calls = calls
+
+
+def start_usage_log(interval=USAGE_LOG_INTERVAL):
+    """Start the background thread logging a usage summary every interval seconds."""
+    global _log_thread
+    if interval <= 0 or (_log_thread is not None and _log_thread.is_alive()):
+        return
+    _log_thread = threading.Thread(target=_log_usage, args=(interval,), name="usage-log", daemon=True)
+    _log_thread.start()
+
+
+def register_usage(app):
+    """Tag every request with its route and caller for usage accounting."""
+
+    @app.before_request
+    def _set_tags():
+        caller = request.headers.get(CALLER_HEADER, "").strip() or "anonymous"
+        _tags.set((request.path, caller))
+
+    start_usage_log()
@@ -6,6 +6,7 @@ import base64
 import io
 import logging
 from PIL import Image
+from refine import repair_bbox, refine_bboxes, DEFAULT_SIDE
 
 # Configure logging
 logging.basicConfig(
@@ -34,6 +35,25 @@ def base64_to_pil_image(base64_image):
         return None
 
 
+def decode_base64_image(base64_image):
+    """Decode a base64 encoded image once, for validation and cropping.
+
+    Returns (image_bytes, image) with the PIL image opened lazily from the bytes.
+    image is None if the bytes are not an image; both are None if the data is
+    not valid base64.
+    """
+    try:
+        image_bytes = base64.b64decode(base64_image)
+    except Exception as e:
+        logger.error(f"Invalid base64 image: {e}")
+        return None, None
+    try:
+        return image_bytes, Image.open(io.BytesIO(image_bytes))
+    except Exception as e:
+        logger.error(f"Error converting base64 to PIL image: {e}")
+        return image_bytes, None
+
+
 def pil_image_to_base64(image, format="JPEG"):
     """Convert PIL Image object to base64 encoded string."""
     try:
@@ -45,14 +65,73 @@ def pil_image_to_base64(image, format="JPEG"):
         return None
 
 
+def downscale_image(image, max_side):
+    """Return the image downscaled so its longest side is at most max_side pixels.
+
+    Images are converted to RGB so they can always be re-encoded as JPEG.
+    """
+    if max(image.size) <= max_side:
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        return image
+    scale = max_side / max(image.size)
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    # Let the JPEG decoder scale down while decoding (no-op once pixels are loaded)
+    if image.format == "JPEG":
+        image.draft("RGB", size)
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    return image.resize(size, Image.LANCZOS, reducing_gap=3.0)
+
+
+def split_into_tiles(image, tile_size, overlap, max_tiles=None):
+    """Split an image into overlapping tiles in reading order (row by row).
+
+    overlap is the fraction of the tile size shared by neighbouring tiles. If
+    max_tiles is given, the tile size grows until the grid fits. Returns a list of
+    ((left, top, right, bottom), tile) pairs with RGB tiles.
+    """
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    while True:
+        step = max(1, int(tile_size * (1 - overlap)))
+        cols = max(1, -(-(image.width - tile_size) // step) + 1) if image.width > tile_size else 1
+        rows = max(1, -(-(image.height - tile_size) // step) + 1) if image.height > tile_size else 1
+        if max_tiles is None or cols * rows <= max_tiles:
+            break
+        tile_size = int(tile_size * 1.25)
+
+    # Spread the tiles evenly so the first and last ones touch the image edges
+    def offsets(count, length):
+        if count == 1:
+            return [0]
+        return [round(i * (length - tile_size) / (count - 1)) for i in range(count)]
+
+    tiles = []
+    for top in offsets(rows, image.height):
+        for left in offsets(cols, image.width):
+            box = (left, top, min(left + tile_size, image.width), min(top + tile_size, image.height))
+            tiles.append((box, image.crop(box)))
+    return tiles
+
+
 def crop_image(image, bbox):
     """Crop image based on normalized bounding box coordinates.
     
     Only supports ymin, xmin, ymax, xmax format: Normalized (0-1000) coordinates for top-left and bottom-right
+    Swapped, out of range and zero-size coordinates are repaired rather than ignored.
     """
     try:
         # Check which format the bbox is using
         if all(k in bbox for k in ['ymin', 'xmin', 'ymax', 'xmax']):
+            repaired = repair_bbox(bbox)
+            if repaired is None:
+                logger.warning(f"Non-numeric crop coordinates: {bbox}. Using original image.")
+                return image
+            if any(float(bbox[k]) != value for k, value in repaired.items()):
+                logger.warning(f"Invalid crop coordinates: {bbox}. Repaired to {repaired}.")
+            bbox = repaired
+
             # Normalized coordinates (0-1000) format
             # Convert from 0-1000 scale to 0-1 scale
             xmin_rel = bbox.get('xmin', 0) / 1000.0
@@ -82,4 +161,31 @@ def crop_image(image, bbox):
 
     except Exception as e:
         logger.error(f"Error cropping image: {e}")
-        return image  # Return original image if cropping fails
\ No newline at end of file
+        return image  # Return original image if cropping fails
+
+
+def crop_image_regions(base64_image, bboxes, format="JPEG", refine=False, refine_side=DEFAULT_SIDE):
+    """Crop several regions out of a base64 encoded image with a single decode.
+
+    With refine, the boxes are first snapped to nearby image edges (refine.py),
+    measured on a copy downscaled to refine_side.
+    Returns a list of base64 encoded crops in the order of bboxes, or None if the
+    image cannot be decoded.
+    """
+    image = base64_to_pil_image(base64_image)
+    if image is None:
+        return None
+    return crop_pil_regions(image, bboxes, format, refine, refine_side)
+
+
+def crop_pil_regions(image, bboxes, format="JPEG", refine=False, refine_side=DEFAULT_SIDE):
+    """Crop several regions out of an opened PIL image, like crop_image_regions."""
+    try:
+        # Decode the pixel data once; every crop below reuses it
+        image.load()
+    except Exception as e:
+        logger.error(f"Error decoding image: {e}")
+        return None
+    if refine:
+        bboxes = refine_bboxes(image, bboxes, refine_side)
+    return [pil_image_to_base64(crop_image(image, bbox), format) for bbox in bboxes]
@@ -0,0 +1,16 @@
+"""
+WSGI entry point for production servers, e.g.
+
+    gunicorn -w 4 -b 0.0.0.0:5050 wsgi:app
+
+Also starts the Unix socket listener of AI_SERVICE_SOCKET in the serving
+process; with several workers, exactly one of them serves the socket. Do not
+use --preload, which would start the listener in the master process.
+"""
+
+from app import app
+from config import AI_SERVICE_SOCKET
+from socket_transport import serve_socket
+
+if AI_SERVICE_SOCKET:
+    serve_socket(app, AI_SERVICE_SOCKET)
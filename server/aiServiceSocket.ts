@@ -0,0 +1,81 @@
+import net from 'net';
+
+/**
+ * Client for the ai_service Unix domain socket transport (ai_service/socket_transport.py).
+ *
+ * Each request and response is one frame: header length and body length as
+ * 4-byte big-endian integers, a JSON header, then the body. The image travels as
+ * raw bytes in the body instead of base64 inside a JSON payload.
+ */
+
+const PREFIX_SIZE = 8;
+
+export interface SocketResponse<T> {
+  status: number;
+  data: T;
+}
+
+function encodeFrame(header: object, body: Buffer): Buffer {
+  const encodedHeader = Buffer.from(JSON.stringify(header), 'utf8');
+  const prefix = Buffer.alloc(PREFIX_SIZE);
+  prefix.writeUInt32BE(encodedHeader.length, 0);
+  prefix.writeUInt32BE(body.length, 4);
+  return Buffer.concat([prefix, encodedHeader, body]);
+}
+
+/**
+ * Sends one request with an image to the ai_service over its Unix domain socket
+ * @param socketPath Path of the socket (AI_SERVICE_SOCKET)
+ * @param path Route, e.g. '/crop'
+ * @param image Raw image bytes, placed in the "image" field of the request
+ * @param fields Other JSON fields of the request
+ * @param headers Request headers such as X-Priority
+ */
+export function postImageOverSocket<T>(
+  socketPath: string,
+  path: string,
+  image: Buffer,
+  fields: Record<string, unknown> = {},
+  headers: Record<string, string> = {},
+  timeoutMs = 180000
+): Promise<SocketResponse<T>> {
+  return new Promise((resolve, reject) => {
+    const socket = net.createConnection({ path: socketPath });
+    const chunks: Buffer[] = [];
+    let received = 0;
+
+    socket.setTimeout(timeoutMs, () => {
+      socket.destroy(new Error(`ai_service socket request to ${path} timed out`));
+    });
+
+    socket.on('connect', () => {
+      socket.write(encodeFrame({ method: 'POST', path, headers, fields }, image));
+    });
+
+    socket.on('data', (chunk: Buffer) => {
+      chunks.push(chunk);
+      received += chunk.length;
+      if (received < PREFIX_SIZE) {
+        return;
+      }
+      const frame = chunks.length === 1 ? chunks[0] : Buffer.concat(chunks);
+      chunks.splice(0, chunks.length, frame);
+      const headerLength = frame.readUInt32BE(0);
+      const bodyLength = frame.readUInt32BE(4);
+      if (received < PREFIX_SIZE + headerLength + bodyLength) {
+        return;
+      }
+      socket.end();
+      try {
+        const header = JSON.parse(frame.subarray(PREFIX_SIZE, PREFIX_SIZE + headerLength).toString('utf8'));
+        const body = frame.subarray(PREFIX_SIZE + headerLength, PREFIX_SIZE + headerLength + bodyLength);
+        resolve({ status: header.status, data: JSON.parse(body.toString('utf8')) as T });
+      } catch (error) {
+        reject(error);
+      }
+    });
+
+    socket.on('error', reject);
+    socket.on('close', () => reject(new Error(`ai_service socket closed before responding to ${path}`)));
+  });
+}
@@ -11,6 +11,7 @@ import { verifyFirebaseToken } from "./firebase-admin";
 import axios from "axios";
 import { log } from "./vite";
 import { WebSocketServer, WebSocket } from 'ws';
+import { postImageOverSocket, type SocketResponse } from "./aiServiceSocket";
 
 // Configure multer for memory storage
 const upload = multer({
@@ -22,6 +23,66 @@ const upload = multer({
 
 // Python AI service configuration
 const AI_SERVICE_URL = 'http://localhost:5050';
+// Unix domain socket of the AI service when both run in the same container;
+// images are then sent as raw bytes instead of base64 JSON over loopback HTTP
+const AI_SERVICE_SOCKET = process.env.AI_SERVICE_SOCKET;
+
+// Helper function to post an image to the Python AI service, over its socket if configured
+async function postImageToAIService<T>(path: string, image: Buffer): Promise<T> {
+  if (AI_SERVICE_SOCKET) {
+    let response: SocketResponse<T> | undefined;
+    try {
+      response = await postImageOverSocket<T>(AI_SERVICE_SOCKET, path, image);
+    } catch (error: any) {
+      // Only fall back when the socket is unavailable, so a request is never sent twice
+      if (error?.code !== 'ENOENT' && error?.code !== 'ECONNREFUSED') {
+        throw error;
+      }
+      console.warn(`AI service socket ${AI_SERVICE_SOCKET} unavailable, using HTTP`);
+    }
+    if (response) {
+      if (response.status >= 400) {
+        throw new Error(`AI service ${path} failed with status ${response.status}`);
+      }
+      return response.data;
+    }
+  }
+  const response = await axios.post(`${AI_SERVICE_URL}${path}`, {
+    image: image.toString('base64'),
+  });
+  return response.data;
+}
+
+// Add saved recipes to the AI service's duplicate index, so later uploads of the
+// same recipe are flagged. Failures are only logged; saving never waits on it
+function indexRecipesForDuplicates(saved: Recipe[]): void {
+  if (saved.length === 0) {
+    return;
+  }
+  axios.post(`${AI_SERVICE_URL}/dedup/index`, {
+    recipes: saved.map((recipe) => ({
+      id: String(recipe.id),
+      title: recipe.title,
+      ingredients: recipe.ingredients ?? [],
+      instructions: recipe.instructions ?? [],
+    })),
+  }).catch((error) => {
+    console.warn(`Failed to add ${saved.length} recipes to the duplicate index:`, error?.message ?? error);
+  });
+}
+
+// Drop deleted recipes from the AI service's duplicate index, so they are no
+// longer reported as duplicates. Failures are only logged, as for indexing
+function removeRecipesFromDuplicateIndex(ids: number[]): void {
+  if (ids.length === 0) {
+    return;
+  }
+  axios.post(`${AI_SERVICE_URL}/dedup/remove`, {
+    ids: ids.map((id) => String(id)),
+  }).catch((error) => {
+    console.warn(`Failed to remove ${ids.length} recipes from the duplicate index:`, error?.message ?? error);
+  });
+}
 
 // WebSocket client connections storage
 const clients = new Map<string, WebSocket>();
@@ -86,12 +147,9 @@ function getStageLabel(stage: string): string {
 }
 
 // Helper function to verify recipe image with Python AI service
-async function verifyRecipeImage(base64Image: string): Promise<{ success: boolean; message: string; is_recipe?: boolean }> {
+async function verifyRecipeImage(image: Buffer): Promise<{ success: boolean; message: string; is_recipe?: boolean }> {
   try {
-    const response = await axios.post(`${AI_SERVICE_URL}/verify`, {
-      image: base64Image,
-    });
-    return response.data;
+    return await postImageToAIService('/verify', image);
   } catch (error) {
     console.error("Error verifying recipe image:", error);
     return { 
@@ -102,7 +160,7 @@ async function verifyRecipeImage(base64Image: string): Promise<{ success: boolea
 }
 
 // Helper function to extract recipe data from image with Python AI service
-async function extractRecipeFromImage(base64Image: string): Promise<{ 
+async function extractRecipeFromImage(image: Buffer): Promise<{ 
   success: boolean; 
   message?: string; 
   recipe?: {
@@ -116,10 +174,7 @@ async function extractRecipeFromImage(base64Image: string): Promise<{
   } 
 }> {
   try {
-    const response = await axios.post(`${AI_SERVICE_URL}/extract`, {
-      image: base64Image,
-    });
-    return response.data;
+    return await postImageToAIService('/extract', image);
   } catch (error) {
     console.error("Error extracting recipe from image:", error);
     return { 
@@ -130,17 +185,14 @@ async function extractRecipeFromImage(base64Image: string): Promise<{
 }
 
 // Helper function to crop recipe image with Python AI service
-async function cropRecipeImage(base64Image: string): Promise<{
+async function cropRecipeImage(image: Buffer): Promise<{
   success: boolean;
   message?: string;
   cropped_image?: string;
   cover_type?: string;
 }> {
   try {
-    const response = await axios.post(`${AI_SERVICE_URL}/crop`, {
-      image: base64Image,
-    });
-    return response.data;
+    return await postImageToAIService('/crop', image);
   } catch (error) {
     console.error("Error cropping recipe image:", error);
     return {
@@ -287,7 +339,7 @@ export async function registerRoutes(app: Express): Promise<Server> {
         console.log(`Sending verification processing status to client ${clientId}`);
       }
       
-      const verificationResult = await verifyRecipeImage(base64Image);
+      const verificationResult = await verifyRecipeImage(req.file.buffer);
       
       if (!verificationResult.success) {
         // Send error update via WebSocket
@@ -343,7 +395,7 @@ export async function registerRoutes(app: Express): Promise<Server> {
       
       // Extract recipe data from image
       log("Extracting recipe data from image");
-      const extractionResult = await extractRecipeFromImage(base64Image);
+      const extractionResult = await extractRecipeFromImage(req.file.buffer);
       
       if (!extractionResult.success || !extractionResult.recipe) {
         // Send error update via WebSocket
@@ -381,7 +433,7 @@ export async function registerRoutes(app: Express): Promise<Server> {
       
       // Use AI to crop the recipe image to focus on the dish or title
       log("Cropping recipe image to focus on dish or title");
-      const cropResult = await cropRecipeImage(base64Image);
+      const cropResult = await cropRecipeImage(req.file.buffer);
       
       // Use cropped image if available, otherwise use original
       let rawImageData = cropResult.success && cropResult.cropped_image 
@@ -426,6 +478,7 @@ export async function registerRoutes(app: Express): Promise<Server> {
         const validatedData = insertRecipeSchema.parse(recipeData);
         console.log('Validation successful');
         newRecipe = await storage.createRecipe(validatedData);
+        indexRecipesForDuplicates([newRecipe]);
         
         // Send saving complete update via WebSocket
         if (clientId) {
@@ -639,6 +692,7 @@ export async function registerRoutes(app: Express): Promise<Server> {
       
       const validatedData = insertRecipeSchema.parse(recipeData);
       const newRecipe = await storage.createRecipe(validatedData);
+      indexRecipesForDuplicates([newRecipe]);
       res.status(201).json(newRecipe);
     } catch (error) {
       if (error instanceof z.ZodError) {
@@ -680,6 +734,9 @@ export async function registerRoutes(app: Express): Promise<Server> {
       
       const validatedData = insertRecipeSchema.partial().parse(req.body);
       const updatedRecipe = await storage.updateRecipe(id, validatedData);
+      if (updatedRecipe && (validatedData.title || validatedData.ingredients || validatedData.instructions)) {
+        indexRecipesForDuplicates([updatedRecipe]);
+      }
       
       res.json(updatedRecipe);
     } catch (error) {
@@ -725,6 +782,7 @@ export async function registerRoutes(app: Express): Promise<Server> {
       if (!deleted) {
         return res.status(500).json({ message: "Failed to delete recipe" });
       }
+      removeRecipesFromDuplicateIndex([id]);
       
       res.status(204).end();
     } catch (error) {
@@ -832,6 +890,8 @@ export async function registerRoutes(app: Express): Promise<Server> {
         }
       }
       
+      indexRecipesForDuplicates(importedRecipes);
+
       res.status(201).json({
         message: `Successfully imported ${importedRecipes.length} recipes`,
         recipes: importedRecipes